@@ -35,6 +35,11 @@ if [ -f "$REPO_ROOT/streamlit_app/requirements.txt" ]; then
   pip install -r "$REPO_ROOT/streamlit_app/requirements.txt"
 fi
 
+if [ -f "$REPO_ROOT/scripts/requirements.txt" ]; then
+  echo "[env] Installing script requirements"
+  pip install -r "$REPO_ROOT/scripts/requirements.txt"
+fi
+
 echo "[env] Virtual environment 'agent-txt2sql' is active."
 
 # Restore previous shell options if we saved them (only when sourced in bash).
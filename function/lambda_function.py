@@ -1,9 +1,182 @@
 import boto3
-from time import sleep
+from time import sleep, time
+from difflib import get_close_matches
+import gzip
+import json
 import os
+import re
 
 # Initialize the Athena client
 athena_client = boto3.client('athena')
+s3_client = boto3.client('s3')
+
+# Value dictionaries built by scripts/build_value_dictionary.py, loaded on first
+# use and kept for the lifetime of the execution environment (refreshed after
+# ValueDictionaryTTL seconds so new uploads eventually show up).
+_value_dictionaries = {}
+VALUE_DICTIONARY_TTL = float(os.environ.get('ValueDictionaryTTL', '900'))
+COLUMN_VALUES_DEFAULT_LIMIT = 50
+COLUMN_VALUES_MAX_LIMIT = 500
+
+
+def load_value_dictionary(database_name, table):
+    cached = _value_dictionaries.get((database_name, table))
+    if cached and time() - cached[0] < VALUE_DICTIONARY_TTL:
+        return cached[1]
+
+    bucket = os.environ.get('ValueDictionaryBucket')
+    prefix = os.environ.get('ValueDictionaryPrefix', 'value-dictionaries').strip('/')
+    key = '/'.join(p for p in [prefix, database_name, f'{table}.json.gz'] if p)
+    if not bucket:
+        raise LookupError("ValueDictionaryBucket environment variable is not set")
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        raise LookupError(f"No value dictionary at s3://{bucket}/{key}")
+    if body[:2] == b'\x1f\x8b':
+        body = gzip.decompress(body)
+    dictionary = json.loads(body)
+    print(f"Loaded value dictionary s3://{bucket}/{key} ({len(dictionary['columns'])} columns)")
+
+    _value_dictionaries[(database_name, table)] = (time(), dictionary)
+    return dictionary
+
+
+def resolve_column(dictionary, column):
+    """Accept the sanitized column name or its original label."""
+    columns = dictionary['columns']
+    if column in columns:
+        return column
+    wanted = column.strip().strip('`"').lower()
+    for name, entry in columns.items():
+        if name.lower() == wanted or (entry.get('label') or '').lower() == wanted:
+            return name
+    return None
+
+
+# Label index built by scripts/generate_schema_artifact.py --label-index. It lets
+# the agent write SQL against the original labels ("reporting date [1.1]") and
+# the <table>_view names while the query runs on the sanitized base table.
+_label_index = {}
+LABEL_INDEX_TTL = float(os.environ.get('LabelIndexTTL', '900'))
+
+
+def load_label_index():
+    if _label_index and time() - _label_index['loaded_at'] < LABEL_INDEX_TTL:
+        return _label_index['index']
+
+    bucket = os.environ.get('LabelIndexBucket') or os.environ.get('ValueDictionaryBucket')
+    key = os.environ.get('LabelIndexKey', 'schema/label-index.json')
+    if not bucket or os.environ.get('RewriteLabels', 'true').lower() == 'false':
+        return None
+    try:
+        index = json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except s3_client.exceptions.NoSuchKey:
+        print(f"No label index at s3://{bucket}/{key}; label rewriting disabled")
+        index = None
+    _label_index.update(loaded_at=time(), index=index)
+    return index
+
+
+def sql_tokens(sql):
+    """Split SQL into (kind, text) with kind in word/quoted/string/comment/other."""
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch == "'" or ch == '"':
+            j = i + 1
+            while j < n:
+                if sql[j] == ch:
+                    if j + 1 < n and sql[j + 1] == ch:
+                        j += 2
+                        continue
+                    break
+                j += 1
+            yield ('string' if ch == "'" else 'quoted'), sql[i:j + 1]
+            i = j + 1
+        elif sql.startswith('--', i):
+            j = sql.find('\n', i)
+            j = n if j == -1 else j
+            yield 'comment', sql[i:j]
+            i = j
+        elif sql.startswith('/*', i):
+            j = sql.find('*/', i + 2)
+            j = n if j == -1 else j + 2
+            yield 'comment', sql[i:j]
+            i = j
+        elif ch.isalnum() or ch == '_':
+            j = i
+            while j < n and (sql[j].isalnum() or sql[j] == '_'):
+                j += 1
+            yield 'word', sql[i:j]
+            i = j
+        else:
+            yield 'other', ch
+            i += 1
+
+
+def rewrite_labels(sql, index):
+    """Replace quoted original labels and view names with base table names.
+
+    Returns the rewritten SQL and a {sanitized name: label} map for the
+    result headers.
+    """
+    tokens = list(sql_tokens(sql))
+    views = index.get('views', {})
+    known_tables = set(index['columns'])
+
+    def identifier(kind, text):
+        return text[1:-1].replace('""', '"') if kind == 'quoted' else text
+
+    referenced = []
+    for kind, text in tokens:
+        if kind in ('word', 'quoted'):
+            name = identifier(kind, text).lower()
+            table = views.get(name, name if name in known_tables else None)
+            if table and table not in referenced:
+                referenced.append(table)
+
+    headers = {}
+    out = []
+    for kind, text in tokens:
+        if kind in ('word', 'quoted'):
+            name = identifier(kind, text).lower()
+            if name in views:
+                table = views[name]
+                headers.update(index['columns'].get(table, {}))
+                out.append(table)
+                continue
+            if kind == 'quoted':
+                tables = index['labels'].get(name)
+                if tables:
+                    table = next((t for t in referenced if t in tables), None)
+                    if table is None and len(tables) == 1:
+                        table = next(iter(tables))
+                    if table:
+                        sanitized = tables[table]
+                        headers[sanitized] = index['columns'][table].get(sanitized, identifier(kind, text))
+                        out.append(f'"{sanitized}"')
+                        continue
+        out.append(text)
+    return ''.join(out), headers
+
+
+def map_result_headers(result, headers):
+    """Rename sanitized column names in an Athena result back to their labels."""
+    if not headers:
+        return result
+    columns = result.get('ResultSet', {}).get('ResultSetMetadata', {}).get('ColumnInfo', [])
+    names = [column.get('Name') for column in columns]
+    for column in columns:
+        label = headers.get(column.get('Name'))
+        if label:
+            column['Name'] = column['Label'] = label
+    rows = result.get('ResultSet', {}).get('Rows', [])
+    if rows and [cell.get('VarCharValue') for cell in rows[0]['Data']] == names:
+        for cell in rows[0]['Data']:
+            cell['VarCharValue'] = headers.get(cell.get('VarCharValue'), cell.get('VarCharValue'))
+    return result
+
 
 def lambda_handler(event, context):
     print(event)
@@ -30,11 +203,28 @@ def lambda_handler(event, context):
         s3_output = os.environ.get('S3Output', 's3://athena-destination-store-alias')  # Fallback to default if not set
         database_name = os.environ.get('DatabaseName')  # Get database name from environment
 
+        # Translate original labels / view names to the base table's columns
+        headers = {}
+        label_index = load_label_index()
+        if label_index:
+            rewritten, headers = rewrite_labels(query, label_index)
+            if rewritten != query:
+                print("the rewritten QUERY:", rewritten)
+                query = rewritten
+
+        # Tag the query with the agent session so a cancelled question's
+        # query can be found and stopped by the app
+        session_id = re.sub(r'[^0-9a-zA-Z._:-]', '', str(event.get('sessionId') or ''))
+        if session_id:
+            query = f"-- agent-session: {session_id}\n{query}"
+
         # Execute the query and wait for completion
         execution_id = execute_athena_query(query, s3_output, database_name)
         result = get_query_results(execution_id)
 
-        return result
+        # Lets the app export the full result from Athena's output file
+        result['QueryExecutionId'] = execution_id
+        return map_result_headers(result, headers)
 
     def execute_athena_query(query, s3_output, database_name=None):
         query_execution_params = {
@@ -66,6 +256,55 @@ def lambda_handler(event, context):
         else:
             raise Exception(f"Query failed with status '{status}'")
 
+    def column_values_handler(event):
+        properties = event.get('requestBody', {}).get('content', {}).get('application/json', {}).get('properties', [])
+        params = {prop['name']: prop.get('value') for prop in properties}
+        print("columnValues parameters:", params)
+
+        database_name = os.environ.get('DatabaseName')
+        table = params.get('table') or os.environ.get('DefaultTable', 'test_population')
+        column = params.get('column') or ''
+        search = (params.get('search') or '').strip().lower()
+        try:
+            limit = int(params.get('limit') or COLUMN_VALUES_DEFAULT_LIMIT)
+        except (TypeError, ValueError):
+            return {"error": f"limit must be a whole number, got {params.get('limit')!r}"}, 400
+        limit = max(1, min(limit, COLUMN_VALUES_MAX_LIMIT))
+
+        try:
+            dictionary = load_value_dictionary(database_name, table)
+        except LookupError as exc:
+            return {"error": f"{exc}. Use /athenaQuery with SELECT DISTINCT instead."}, 404
+
+        name = resolve_column(dictionary, column)
+        if name is None:
+            suggestions = get_close_matches(column.lower(), list(dictionary['columns']), n=5)
+            return {"error": f"Unknown column '{column}' in table {table}", "did_you_mean": suggestions}, 404
+
+        entry = dictionary['columns'][name]
+        if entry.get('high_cardinality'):
+            return {
+                "table": table,
+                "column": name,
+                "high_cardinality": True,
+                "message": "Too many distinct values to list; filter with LIKE via /athenaQuery instead.",
+            }, 200
+
+        values = entry['top_values']
+        if search:
+            values = [item for item in values if search in str(item[0]).lower()]
+        return {
+            "table": table,
+            "column": name,
+            "label": entry.get('label'),
+            "distinct": entry['distinct'],
+            "high_cardinality": False,
+            "row_count": dictionary.get('row_count'),
+            "built_at": dictionary.get('built_at'),
+            "values": [{"value": value, "count": count} for value, count in values[:limit]],
+            "truncated": len(values) > limit,
+        }, 200
+
     action_group = event.get('actionGroup')
     api_path = event.get('apiPath')
 
@@ -77,6 +316,8 @@ def lambda_handler(event, context):
 
     if api_path == '/athenaQuery':
         result = athena_query_handler(event)
+    elif api_path == '/columnValues':
+        result, response_code = column_values_handler(event)
     else:
         response_code = 404
         result = {"error": f"Unrecognized api path: {action_group}::{api_path}"}
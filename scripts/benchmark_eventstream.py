@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""Throughput of the InvokeAgent event-stream decoder against the old string parser.
+
+``invoke_agent.decode_response`` used to append every network chunk to a str,
+split it on ``":message-type"`` and base64-decode ``split('"')[3]`` of the
+part containing ``bytes``. ``eventstream.agent_events`` decodes the binary
+frames incrementally instead. This script feeds the same streams to both in
+fixed-size chunks (as ``iter_content`` delivers them) and reports MB/s.
+
+Streams are either recordings (``AGENT_STREAM_RECORD_DIR`` in the Streamlit
+app writes one ``.eventstream`` file per answer) or synthesized: a number of
+trace events padded to ``--size-mb`` in total followed by one chunk event.
+
+Example usage:
+
+    ./scripts/benchmark_eventstream.py --size-mb 8
+    ./scripts/benchmark_eventstream.py --recording recordings/*.eventstream
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "streamlit_app"))
+
+from eventstream import agent_events, encode_agent_event, encode_chunk  # noqa: E402
+
+
+def synthesize_stream(size_mb: float, trace_kb: int) -> bytes:
+    """Orchestration traces of ``trace_kb`` each, then the final answer chunk."""
+
+    target = int(size_mb * 1024 * 1024)
+    rationale = "The user asks for incident counts per code; query test_population. " * (trace_kb * 16)
+    frames: List[bytes] = []
+    total = 0
+    step = 0
+    while total < target:
+        frame = encode_agent_event(
+            "trace",
+            {
+                "agentId": "BENCHAGENT",
+                "sessionId": "bench",
+                "trace": {
+                    "orchestrationTrace": {
+                        "rationale": {"text": rationale[: trace_kb * 1024], "traceId": f"trace-{step}"}
+                    }
+                },
+            },
+        )
+        frames.append(frame)
+        total += len(frame)
+        step += 1
+    frames.append(encode_chunk("There are 42 incidents with code E_A_C_09."))
+    return b"".join(frames)
+
+
+def legacy_decode(chunks: Iterable[bytes]) -> str:
+    """The previous ``decode_response`` parsing, without its diagnostics.
+
+    The original skipped every chunk that was not valid UTF-8 on its own
+    (most of them, since CRCs and lengths are binary), silently losing
+    frames; ``errors="replace"`` keeps them so both parsers see the same data.
+    """
+
+    string = ""
+    for line in chunks:
+        string += line.decode(encoding="utf-8", errors="replace")
+    for part in string.split(":message-type"):
+        if "bytes" in part:
+            parts = part.split("\"")
+            if len(parts) > 3:
+                try:
+                    return base64.b64decode(parts[3]).decode("utf-8")
+                except Exception:
+                    continue
+    return ""
+
+
+def eventstream_decode(chunks: Iterable[bytes]) -> str:
+    return "".join(event.text or "" for event in agent_events(chunks) if event.type == "chunk")
+
+
+def split_chunks(data: bytes, chunk_size: int) -> List[bytes]:
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def measure(decode: Callable[[Iterable[bytes]], str], chunks: List[bytes], repeat: int) -> Dict[str, float]:
+    size = sum(len(chunk) for chunk in chunks)
+    timings = []
+    answer = ""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        answer = decode(chunks)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    return {
+        "best_seconds": round(best, 4),
+        "median_seconds": round(statistics.median(timings), 4),
+        "mb_per_second": round(size / best / 1024 / 1024, 1),
+        "answer_chars": len(answer),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--recording", type=Path, nargs="*", default=None,
+                        help="Recorded .eventstream files (default: synthesize one)")
+    parser.add_argument("--size-mb", type=float, default=4.0, help="Size of the synthesized stream")
+    parser.add_argument("--trace-kb", type=int, default=8, help="Size of each synthesized trace event")
+    parser.add_argument("--chunk-size", type=int, default=16 * 1024, help="Bytes per network chunk")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="Only time the event-stream decoder")
+    parser.add_argument("--json-output", type=Path, default=None, help="Optional path for raw results")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.recording:
+        streams = {path.name: path.read_bytes() for path in args.recording}
+    else:
+        streams = {f"synthetic-{args.size_mb:g}MB": synthesize_stream(args.size_mb, args.trace_kb)}
+
+    results: Dict[str, Dict[str, object]] = {}
+    print(f"{'stream':<32} {'MB':>7} {'decoder':<12} {'best s':>8} {'MB/s':>8}")
+    for name, data in streams.items():
+        chunks = split_chunks(data, args.chunk_size)
+        decoders = {"eventstream": eventstream_decode}
+        if not args.skip_legacy:
+            decoders["legacy"] = legacy_decode
+        results[name] = {"bytes": len(data)}
+        for label, decode in decoders.items():
+            stats = measure(decode, chunks, args.repeat)
+            results[name][label] = stats
+            print(
+                f"{name:<32} {len(data) / 1024 / 1024:>7.2f} {label:<12} "
+                f"{stats['best_seconds']:>8} {stats['mb_per_second']:>8}"
+            )
+        if "legacy" in results[name]:
+            new, old = results[name]["eventstream"], results[name]["legacy"]
+            if old["answer_chars"] != new["answer_chars"]:
+                print(f"  note: answers differ ({old['answer_chars']} vs {new['answer_chars']} chars)")
+
+    if args.json_output:
+        args.json_output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""Per-request overhead of pooled SigV4 requests versus one connection per call.
+
+Sends ``--requests`` signed requests to ``--url`` twice: once the old way
+(sign, then a bare ``requests.request``, so a new TCP + TLS connection every
+time) and once through ``agent_client.SigV4Client``, which keeps connections
+alive in a pool. The response status does not matter, only the round trip,
+so the default target is the regional agent runtime endpoint and requests are
+signed with dummy credentials unless ``--real-credentials`` is given.
+
+Example usage:
+
+    ./scripts/benchmark_http_pool.py --requests 50
+    ./scripts/benchmark_http_pool.py --url https://bedrock-agent-runtime.us-east-1.amazonaws.com/ --region us-east-1
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import requests
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "streamlit_app"))
+
+from agent_client import SigV4Client  # noqa: E402
+
+
+DUMMY_CREDENTIALS = Credentials("AKIDEXAMPLE", "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def bare_request(url: str, region: str, credentials) -> Callable[[], int]:
+    def send() -> int:
+        req = AWSRequest(method="GET", url=url)
+        SigV4Auth(credentials.get_frozen_credentials(), "bedrock", region).add_auth(req)
+        prepared = req.prepare()
+        return requests.request(prepared.method, prepared.url, headers=dict(prepared.headers), timeout=30).status_code
+
+    return send
+
+
+def pooled_request(client: SigV4Client, url: str) -> Callable[[], int]:
+    def send() -> int:
+        return client.request(url).status_code
+
+    return send
+
+
+def measure(send: Callable[[], int], count: int) -> Dict[str, float]:
+    timings = []
+    statuses = set()
+    for _ in range(count):
+        started = time.perf_counter()
+        statuses.add(send())
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(percentile(timings, 50), 2),
+        "p95_ms": round(percentile(timings, 95), 2),
+        "first_ms": round(timings[0], 2),
+        "statuses": sorted(statuses),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--region", default="eu-central-1")
+    parser.add_argument("--url", default=None, help="Target URL (default: the region's agent runtime endpoint)")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--real-credentials", action="store_true",
+                        help="Sign with the boto3 session's credentials instead of dummy ones")
+    parser.add_argument("--json-output", type=Path, default=None, help="Optional path for raw results")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    url = args.url or f"https://bedrock-agent-runtime.{args.region}.amazonaws.com/"
+
+    if args.real_credentials:
+        from boto3.session import Session
+
+        credentials = Session().get_credentials()
+    else:
+        credentials = DUMMY_CREDENTIALS
+    client = SigV4Client("bedrock", args.region, credentials=credentials)
+
+    results = {
+        "url": url,
+        "bare": measure(bare_request(url, args.region, credentials), args.requests),
+        "pooled": measure(pooled_request(client, url), args.requests),
+        "pool_stats": client.stats(),
+    }
+    client.close()
+
+    print(f"{args.requests} signed GET requests to {url}")
+    print(f"{'':<8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'first ms':>9}")
+    for variant in ("bare", "pooled"):
+        row = results[variant]
+        print(f"{variant:<8} {row['mean_ms']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['first_ms']:>9}")
+    saved = results["bare"]["mean_ms"] - results["pooled"]["mean_ms"]
+    print(f"\nSaved per request: {saved:.1f} ms")
+    print(f"Pool: {json.dumps(results['pool_stats'])}")
+
+    if args.json_output:
+        args.json_output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
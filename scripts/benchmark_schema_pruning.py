@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""Compare prompt size and latency with and without question-relevant schema pruning.
+
+Offline (default), for each question the full schema and the pruned schema are
+rendered from ``streamlit_app/schema_index.json`` and their sizes compared
+(tokens estimated at ~4 characters each), together with the selection time.
+
+With ``--live`` every question is additionally sent to two agent aliases:
+``--full-alias`` whose orchestration prompt embeds the whole ``<athena_schema>``
+and ``--pruned-alias`` whose prompt uses ``$prompt_session_attributes$``. The
+end-to-end latency of both is reported.
+
+Example usage:
+
+    ./scripts/benchmark_schema_pruning.py --questions questions.txt
+    ./scripts/benchmark_schema_pruning.py --live --agent-id ABC123 \\
+        --full-alias FULLALIAS1 --pruned-alias PRUNEDALI1
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "streamlit_app"))
+
+from schema_selector import DEFAULT_TOP_K, SchemaIndex  # noqa: E402
+
+
+DEFAULT_QUESTIONS = [
+    "How many records are there?",
+    "Show me 5 incidents with code E_A_C_09",
+    "How many incidents per reporting date?",
+    "Which counterparties have the most errors in valuation currency?",
+    "List trades where the notional currency of leg 1 is EUR",
+    "What is the distribution of incident codes by action type?",
+    "Show the prior uti and uti for records with clearing obligation true",
+    "Count records by country of the counterparty 2",
+]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_offline(index: SchemaIndex, questions: List[str], top_k: int) -> Dict[str, object]:
+    full_schema = index.render_all()
+    rows = []
+    for question in questions:
+        started = time.perf_counter()
+        pruned = index.pruned_schema(question, top_k=top_k)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        rows.append(
+            {
+                "question": question,
+                "full_chars": len(full_schema),
+                "pruned_chars": len(pruned),
+                "full_tokens": estimate_tokens(full_schema),
+                "pruned_tokens": estimate_tokens(pruned),
+                "selection_ms": round(elapsed_ms, 3),
+            }
+        )
+    return {
+        "rows": rows,
+        "mean_reduction": statistics.mean(1 - r["pruned_chars"] / r["full_chars"] for r in rows),
+        "mean_selection_ms": statistics.mean(r["selection_ms"] for r in rows),
+    }
+
+
+def run_live(args: argparse.Namespace, index: SchemaIndex, questions: List[str]) -> Dict[str, object]:
+    import invoke_agent
+
+    base = f"https://bedrock-agent-runtime.{invoke_agent.theRegion}.amazonaws.com/agents/{args.agent_id}"
+    invoke_agent.schemaIndexPath = str(args.index)
+    invoke_agent.schemaTopK = args.top_k
+    latencies: Dict[str, List[float]] = {"full": [], "pruned": []}
+
+    for question in questions:
+        for variant, alias, pruning in (
+            ("full", args.full_alias, False),
+            ("pruned", args.pruned_alias, True),
+        ):
+            invoke_agent.schemaPruning = pruning
+            url = f"{base}/agentAliases/{alias}/sessions/bench-{uuid.uuid4().hex}/text"
+            started = time.perf_counter()
+            invoke_agent.askQuestion(question, url)
+            latencies[variant].append(time.perf_counter() - started)
+            print(f"  [{variant}] {latencies[variant][-1]:.2f}s  {question}")
+
+    return {
+        variant: {
+            "p50_seconds": round(percentile(values, 50), 3),
+            "p95_seconds": round(percentile(values, 95), 3),
+            "mean_seconds": round(statistics.mean(values), 3),
+        }
+        for variant, values in latencies.items()
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--index",
+        type=Path,
+        default=REPO_ROOT / "streamlit_app" / "schema_index.json",
+        help="Schema index built by schema_selector.py",
+    )
+    parser.add_argument("--questions", type=Path, default=None, help="File with one question per line")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--live", action="store_true", help="Also measure end-to-end agent latency")
+    parser.add_argument("--agent-id", default=None)
+    parser.add_argument("--full-alias", default=None, help="Alias whose prompt embeds the full schema")
+    parser.add_argument("--pruned-alias", default=None, help="Alias whose prompt uses the pruned schema")
+    parser.add_argument("--json-output", type=Path, default=None, help="Optional path for raw results")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    index = SchemaIndex.load(args.index)
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        questions = [q.strip() for q in args.questions.read_text(encoding="utf-8").splitlines() if q.strip()]
+
+    offline = run_offline(index, questions, args.top_k)
+    print(f"{'full tok':>9} {'pruned tok':>10} {'select ms':>9}  question")
+    for row in offline["rows"]:
+        print(
+            f"{row['full_tokens']:>9} {row['pruned_tokens']:>10} {row['selection_ms']:>9}  {row['question']}"
+        )
+    print(f"\nMean schema size reduction: {offline['mean_reduction']:.1%}")
+    print(f"Mean selection time: {offline['mean_selection_ms']:.3f} ms")
+
+    results: Dict[str, object] = {"offline": offline}
+    if args.live:
+        if not (args.agent_id and args.full_alias and args.pruned_alias):
+            sys.exit("--live requires --agent-id, --full-alias and --pruned-alias")
+        print("\nEnd-to-end latency:")
+        results["live"] = run_live(args, index, questions)
+        for variant, stats in results["live"].items():
+            print(f"  {variant}: p50 {stats['p50_seconds']}s, p95 {stats['p95_seconds']}s")
+
+    if args.json_output:
+        args.json_output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+r"""Build the dictionary of distinct values for low-cardinality columns.
+
+To write a filter such as ``incident_code = 'E_A_C_09'`` the agent first has
+to know which codes exist, and discovering them with a ``SELECT DISTINCT``
+scans the whole table. This script precomputes, per table, every column with
+at most ``--max-distinct`` distinct values together with their counts. The
+result is stored as gzipped JSON in S3 (``value-dictionaries/<database>/<table>.json.gz``),
+where the action Lambda's ``/columnValues`` path loads it lazily, and as
+``schema/column-stats/<table>.json``, which ``generate_schema_artifact.py``
+turns into per-column value hints.
+
+Two sources are supported:
+
+* ``--csv`` counts a local CSV (this is what ingestion runs for each upload;
+  counts are merged into the existing dictionary with ``--merge``).
+* ``--athena`` recomputes the dictionary from the table itself with two scans
+  (``approx_distinct`` over all columns, then one ``GROUP BY`` over the
+  low-cardinality ones). Meant for a periodic job, as it also reflects
+  deduplicated or merged (Iceberg) data exactly.
+
+Example usage:
+
+    ./scripts/build_value_dictionary.py --athena \
+        --database txt2sql_dev_athena_db --table test_population \
+        --athena-output s3://sl-athena-output-txt2sql-dev-123456789012-eu-central-1/ \
+        --bucket sl-data-store-txt2sql-dev-123456789012-eu-central-1
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import gzip
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_STATS_DIR = REPO_ROOT / "schema" / "column-stats"
+DEFAULT_COLUMN_MAP_DIR = REPO_ROOT / "schema" / "column-maps"
+DEFAULT_S3_PREFIX = "value-dictionaries"
+DEFAULT_MAX_DISTINCT = 200
+FORMAT_VERSION = 1
+
+
+def dictionary_key(prefix: str, database: str, table: str) -> str:
+    return "/".join(p for p in [prefix.strip("/"), database, f"{table}.json.gz"] if p)
+
+
+def count_csv_values(
+    csv_path: Path,
+    column_names: Sequence[str],
+    *,
+    delimiter: str = ",",
+    quote_char: str = "\"",
+    max_distinct: int = DEFAULT_MAX_DISTINCT,
+) -> Dict[str, Any]:
+    """Count values per column, dropping a column once it exceeds ``max_distinct``."""
+
+    counters: List[Optional[Counter]] = [Counter() for _ in column_names]
+    active = list(range(len(column_names)))
+    row_count = 0
+
+    with csv_path.open(newline="", encoding="utf-8-sig") as fh:
+        reader = csv.reader(fh, delimiter=delimiter, quotechar=quote_char)
+        next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            row_count += 1
+            dropped = False
+            for idx in active:
+                counter = counters[idx]
+                counter[row[idx] if idx < len(row) else ""] += 1
+                if len(counter) > max_distinct:
+                    counters[idx] = None
+                    dropped = True
+            if dropped:
+                active = [idx for idx in active if counters[idx] is not None]
+
+    columns: Dict[str, Any] = {}
+    for name, counter in zip(column_names, counters):
+        columns[name] = (
+            {"high_cardinality": True}
+            if counter is None
+            else {"counts": dict(counter)}
+        )
+    return {"row_count": row_count, "columns": columns}
+
+
+def merge_counts(
+    existing: Optional[Dict[str, Any]],
+    new: Dict[str, Any],
+    max_distinct: int,
+) -> Dict[str, Any]:
+    """Add ``new`` counts to a previously built dictionary."""
+
+    if not existing:
+        return new
+    merged_columns: Dict[str, Any] = {}
+    for name, entry in new["columns"].items():
+        old = existing["columns"].get(name)
+        if entry.get("high_cardinality") or (old and old.get("high_cardinality")):
+            merged_columns[name] = {"high_cardinality": True}
+            continue
+        counts = Counter(old["counts"]) if old else Counter()
+        counts.update(entry["counts"])
+        merged_columns[name] = (
+            {"high_cardinality": True} if len(counts) > max_distinct else {"counts": dict(counts)}
+        )
+    return {
+        "row_count": existing.get("row_count", 0) + new["row_count"],
+        "columns": merged_columns,
+    }
+
+
+def finalize(
+    counted: Dict[str, Any],
+    *,
+    database: str,
+    table: str,
+    labels: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Sort values by count and add the summary fields readers rely on."""
+
+    labels = labels or {}
+    columns: Dict[str, Any] = {}
+    for name, entry in counted["columns"].items():
+        if entry.get("high_cardinality"):
+            columns[name] = {"label": labels.get(name), "high_cardinality": True, "distinct": None}
+            continue
+        top_values = sorted(entry["counts"].items(), key=lambda item: (-item[1], item[0]))
+        columns[name] = {
+            "label": labels.get(name),
+            "high_cardinality": False,
+            "distinct": len(top_values),
+            "top_values": [[value, count] for value, count in top_values],
+        }
+    return {
+        "format_version": FORMAT_VERSION,
+        "database": database,
+        "table": table,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "row_count": counted["row_count"],
+        "columns": columns,
+    }
+
+
+def to_counts(dictionary: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of ``finalize`` so a stored dictionary can be merged into."""
+
+    columns = {}
+    for name, entry in dictionary["columns"].items():
+        if entry.get("high_cardinality"):
+            columns[name] = {"high_cardinality": True}
+        else:
+            columns[name] = {"counts": {value: count for value, count in entry["top_values"]}}
+    return {"row_count": dictionary.get("row_count", 0), "columns": columns}
+
+
+def _athena_rows(athena_client, execution_id: str):
+    paginator = athena_client.get_paginator("get_query_results")
+    first = True
+    for page in paginator.paginate(QueryExecutionId=execution_id):
+        rows = page["ResultSet"]["Rows"]
+        if first:
+            rows = rows[1:]
+            first = False
+        for row in rows:
+            yield [cell.get("VarCharValue") for cell in row["Data"]]
+
+
+def count_athena_values(
+    athena_client,
+    *,
+    database: str,
+    table: str,
+    column_names: Sequence[str],
+    athena_output: str,
+    max_distinct: int = DEFAULT_MAX_DISTINCT,
+) -> Dict[str, Any]:
+    from ingest_csv_to_athena import run_athena_query
+
+    def query(sql: str) -> str:
+        return run_athena_query(athena_client, sql, athena_output, database=database, timeout=1800.0)
+
+    # Scan 1: approximate cardinality of every column (and the row count).
+    approx = ", ".join(f'approx_distinct("{name}")' for name in column_names)
+    execution_id = query(f"SELECT count(*), {approx} FROM {database}.{table}")
+    header = next(_athena_rows(athena_client, execution_id))
+    row_count = int(header[0])
+    low_card = [
+        name
+        for name, estimate in zip(column_names, header[1:])
+        # approx_distinct has ~2% error; leave headroom before the exact pass.
+        if estimate is not None and int(estimate) <= max_distinct * 1.1
+    ]
+
+    columns: Dict[str, Any] = {name: {"high_cardinality": True} for name in column_names}
+    if low_card:
+        # Scan 2: exact counts for the low-cardinality columns in one pass.
+        keys = ", ".join(f"'{name}'" for name in low_card)
+        values = ", ".join(f'coalesce("{name}", \'\')' for name in low_card)
+        execution_id = query(
+            "SELECT column_name, value, count(*) AS n\n"
+            f"FROM {database}.{table}\n"
+            f"CROSS JOIN UNNEST(ARRAY[{keys}], ARRAY[{values}]) AS t(column_name, value)\n"
+            "GROUP BY 1, 2"
+        )
+        counted: Dict[str, Counter] = {name: Counter() for name in low_card}
+        for column_name, value, count in _athena_rows(athena_client, execution_id):
+            counted[column_name][value or ""] = int(count)
+        for name, counter in counted.items():
+            if len(counter) <= max_distinct:
+                columns[name] = {"counts": dict(counter)}
+
+    return {"row_count": row_count, "columns": columns}
+
+
+def write_outputs(
+    dictionary: Dict[str, Any],
+    *,
+    stats_dir: Optional[Path],
+    s3_client=None,
+    bucket: Optional[str] = None,
+    s3_prefix: str = DEFAULT_S3_PREFIX,
+) -> Optional[str]:
+    """Write the local stats file and upload the gzipped dictionary to S3."""
+
+    if stats_dir:
+        stats_dir.mkdir(parents=True, exist_ok=True)
+        path = stats_dir / f"{dictionary['table']}.json"
+        path.write_text(json.dumps(dictionary, indent=1, ensure_ascii=False), encoding="utf-8")
+        print(f"Column stats written to {path}")
+
+    if s3_client and bucket:
+        key = dictionary_key(s3_prefix, dictionary["database"], dictionary["table"])
+        body = gzip.compress(
+            json.dumps(dictionary, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        )
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=body,
+            ContentType="application/json",
+            ContentEncoding="gzip",
+        )
+        print(f"Value dictionary uploaded to s3://{bucket}/{key} ({len(body)} bytes)")
+        return key
+    return None
+
+
+def load_existing(stats_dir: Path, table: str) -> Optional[Dict[str, Any]]:
+    path = stats_dir / f"{table}.json"
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", type=Path, help="Count a local CSV file")
+    source.add_argument("--athena", action="store_true", help="Recompute from the Athena table")
+    parser.add_argument("--database", required=True, help="Athena database")
+    parser.add_argument("--table", required=True, help="Sanitized table name")
+    parser.add_argument("--athena-output", default=None, help="S3 location for Athena query results")
+    parser.add_argument("--bucket", default=None, help="Bucket to upload the dictionary to")
+    parser.add_argument("--s3-prefix", default=DEFAULT_S3_PREFIX)
+    parser.add_argument("--stats-dir", type=Path, default=DEFAULT_STATS_DIR)
+    parser.add_argument("--column-maps", type=Path, default=DEFAULT_COLUMN_MAP_DIR)
+    parser.add_argument("--max-distinct", type=int, default=DEFAULT_MAX_DISTINCT)
+    parser.add_argument("--merge", action="store_true",
+                        help="Add CSV counts to the existing dictionary instead of replacing it")
+    parser.add_argument("--delimiter", default=",")
+    parser.add_argument("--quote-char", default="\"")
+    parser.add_argument("--region", default=None)
+    return parser.parse_args()
+
+
+def main() -> None:
+    import boto3
+
+    from ingest_csv_to_athena import read_csv_header, unique_identifiers
+
+    args = parse_args()
+    session = boto3.Session(**({"region_name": args.region} if args.region else {}))
+
+    map_path = args.column_maps / f"{args.table}.json"
+    labels = json.loads(map_path.read_text(encoding="utf-8")) if map_path.exists() else {}
+
+    if args.csv:
+        csv_path = args.csv.expanduser().resolve()
+        column_names = [safe for safe, _ in unique_identifiers(read_csv_header(csv_path, args.delimiter))]
+        counted = count_csv_values(
+            csv_path,
+            column_names,
+            delimiter=args.delimiter,
+            quote_char=args.quote_char,
+            max_distinct=args.max_distinct,
+        )
+        if args.merge:
+            existing = load_existing(args.stats_dir, args.table)
+            counted = merge_counts(to_counts(existing) if existing else None, counted, args.max_distinct)
+    else:
+        if not args.athena_output:
+            sys.exit("--athena requires --athena-output")
+        if not labels:
+            sys.exit(f"--athena needs the column map {map_path} to know the columns")
+        counted = count_athena_values(
+            session.client("athena"),
+            database=args.database,
+            table=args.table,
+            column_names=list(labels),
+            athena_output=args.athena_output,
+            max_distinct=args.max_distinct,
+        )
+
+    dictionary = finalize(counted, database=args.database, table=args.table, labels=labels)
+    low_card = sum(1 for entry in dictionary["columns"].values() if not entry["high_cardinality"])
+    print(f"{low_card} of {len(dictionary['columns'])} column(s) have <= {args.max_distinct} values")
+    write_outputs(
+        dictionary,
+        stats_dir=args.stats_dir,
+        s3_client=session.client("s3") if args.bucket else None,
+        bucket=args.bucket,
+        s3_prefix=args.s3_prefix,
+    )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""Drop rows whose business key has already been ingested into a table.
+
+Consecutive EMIR extracts overlap (``2024-11-29 to 2024-11-30`` followed by
+``2024-11-30 to 2024-12-01``), so the same ``kr_record_key`` lands in the same
+table more than once. ``KeyIndex`` keeps one small on-disk index per table,
+mapping each key to a digest of the row contents, and streams new files
+through it so that only unseen rows (and, optionally, rows whose contents
+changed) are uploaded.
+
+The index is an SQLite ``WITHOUT ROWID`` table, i.e. a clustered B-tree keyed
+by the business key. Lookups are exact, memory use is bounded by SQLite's page
+cache rather than the number of keys, and tens of millions of keys fit in a
+few hundred MB on disk. Files are processed in batches so each batch costs a
+handful of index queries instead of one per row.
+
+Index updates are staged in a transaction and only made permanent with
+``commit()`` once the filtered rows are in the table (after the upload and the
+DDL or MERGE), so a failed ingestion never marks keys as seen. The transaction also serializes concurrent
+ingestions into the same table.
+"""
+
+from __future__ import annotations
+
+import csv
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+
+DEFAULT_BATCH_SIZE = 20_000
+_LOOKUP_CHUNK = 500
+_FIELD_SEPARATOR = "\x1f"
+
+
+def _tee_lines(fh, consumed: List[str]) -> Iterator[str]:
+    """Yield lines to ``csv.reader`` while collecting them in ``consumed``.
+
+    ``csv.reader`` only reads as far as the record it returns, so the lines
+    collected since the previous record are that record's raw text, even if
+    a quoted field spans several lines.
+    """
+
+    for line in fh:
+        consumed.append(line)
+        yield line
+
+
+class KeyIndex:
+    """On-disk business-key index for one Athena table."""
+
+    def __init__(self, path: Path, timeout: float = 600.0) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(str(path), timeout=timeout, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS row_keys ("
+            " key TEXT PRIMARY KEY,"
+            " digest BLOB NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._in_transaction = False
+
+    def __enter__(self) -> "KeyIndex":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.rollback()
+        self.close()
+
+    def begin(self) -> None:
+        if not self._in_transaction:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._in_transaction = True
+
+    def commit(self) -> None:
+        if self._in_transaction:
+            self._conn.execute("COMMIT")
+            self._in_transaction = False
+
+    def rollback(self) -> None:
+        if self._in_transaction:
+            self._conn.execute("ROLLBACK")
+            self._in_transaction = False
+
+    def close(self) -> None:
+        self.rollback()
+        self._conn.close()
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM row_keys").fetchone()[0]
+
+    def lookup(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        found: Dict[str, bytes] = {}
+        for start in range(0, len(keys), _LOOKUP_CHUNK):
+            chunk = keys[start:start + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT key, digest FROM row_keys WHERE key IN ({placeholders})",
+                chunk,
+            )
+            found.update(rows)
+        return found
+
+    def upsert(self, entries: Iterable[Tuple[str, bytes]]) -> None:
+        self._conn.executemany(
+            "INSERT INTO row_keys (key, digest) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET digest = excluded.digest",
+            entries,
+        )
+
+    def filter_csv(
+        self,
+        src: Path,
+        dst: Path,
+        *,
+        headers: Sequence[str],
+        key_columns: Sequence[str],
+        ignore_columns: Sequence[str] = (),
+        delimiter: str = ",",
+        quote_char: str = "\"",
+        emit_changed: bool = True,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> Dict[str, Any]:
+        """Write the rows of ``src`` that are new (or changed) to ``dst``.
+
+        ``headers`` are the column names used in ``key_columns`` and
+        ``ignore_columns`` (normally the sanitized names). Columns listed in
+        ``ignore_columns``, such as ``source_file_name``, do not count as a
+        change. Records are copied byte for byte, including quoted fields that
+        span several lines.
+        """
+
+        positions = {name: idx for idx, name in enumerate(headers)}
+        missing = [name for name in key_columns if name not in positions]
+        if missing:
+            raise ValueError(f"Key column(s) not found in header: {', '.join(missing)}")
+        key_idx = [positions[name] for name in key_columns]
+        ignored = {positions[name] for name in ignore_columns if name in positions}
+        digest_idx = [idx for idx in range(len(headers)) if idx not in ignored]
+
+        report = {
+            "rows_in": 0,
+            "rows_out": 0,
+            "new_rows": 0,
+            "changed_rows": 0,
+            "duplicate_rows": 0,
+        }
+        self.begin()
+
+        def flush(batch: List[Tuple[str, bytes, str]], out) -> None:
+            existing = self.lookup(list({key for key, _, _ in batch}))
+            updates: Dict[str, bytes] = {}
+            for key, digest, raw in batch:
+                previous = updates.get(key, existing.get(key))
+                if previous is None:
+                    report["new_rows"] += 1
+                elif previous == digest:
+                    report["duplicate_rows"] += 1
+                    continue
+                elif emit_changed:
+                    report["changed_rows"] += 1
+                else:
+                    report["duplicate_rows"] += 1
+                    continue
+                updates[key] = digest
+                out.write(raw)
+                report["rows_out"] += 1
+            self.upsert(updates.items())
+
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        with src.open(newline="", encoding="utf-8-sig") as fh, dst.open(
+            "w", newline="", encoding="utf-8"
+        ) as out:
+            consumed: List[str] = []
+            reader = csv.reader(_tee_lines(fh, consumed), delimiter=delimiter, quotechar=quote_char)
+            if next(reader, None) is None:
+                return report
+            out.write("".join(consumed))
+            consumed.clear()
+            batch: List[Tuple[str, bytes, str]] = []
+            for row in reader:
+                raw = "".join(consumed)
+                consumed.clear()
+                if not row:
+                    continue
+                if len(row) != len(headers):
+                    raise ValueError(
+                        f"Record {report['rows_in'] + 1} of {src.name} has {len(row)} fields, "
+                        f"expected {len(headers)}"
+                    )
+                report["rows_in"] += 1
+                key = _FIELD_SEPARATOR.join(row[idx] for idx in key_idx)
+                digest = hashlib.blake2b(
+                    _FIELD_SEPARATOR.join(row[idx] for idx in digest_idx).encode("utf-8"),
+                    digest_size=16,
+                ).digest()
+                batch.append((key, digest, raw))
+                if len(batch) >= batch_size:
+                    flush(batch, out)
+                    batch = []
+            if batch:
+                flush(batch, out)
+
+        return report
+
+
+def index_path_for(index_dir: Path, database: str, table_name: str) -> Path:
+    return index_dir / f"{database}.{table_name}.sqlite"
+
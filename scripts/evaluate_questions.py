@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""Run a question suite against the Bedrock agent concurrently and record the results.
+
+Questions come from a text file (one per line) or a JSONL file with
+``{"id": ..., "question": ..., "session": ...}`` objects; questions sharing a
+``session`` run in order in the same agent session, all others in their own.
+Up to ``--concurrency`` questions are in flight at once. Each result (answer,
+latency, time to first byte/chunk, generated SQL, LLM vs action time and
+token counts from the trace) is appended to ``--output`` as one JSON line as
+soon as it completes, and a latency summary is printed at the end. Each
+agent session is ended once its last question has finished.
+
+Example usage:
+
+    ./scripts/evaluate_questions.py --questions regression.jsonl \\
+        --agent-id ABC123 --agent-alias-id ALIAS123 --concurrency 30 \\
+        --output results/regression.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "streamlit_app"))
+
+from async_agent import DEFAULT_CONCURRENCY, AsyncAgentClient, QuestionResult, run_questions  # noqa: E402
+
+
+def load_questions(path: Path) -> List[Dict[str, Any]]:
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".jsonl":
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [{"question": line.strip()} for line in text.splitlines() if line.strip()]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(results: List[QuestionResult], wall_seconds: float) -> Dict[str, Any]:
+    ok = [r for r in results if r.status == "ok"]
+    latencies = [r.latency_s for r in ok]
+    summary: Dict[str, Any] = {
+        "questions": len(results),
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "wall_seconds": round(wall_seconds, 1),
+        "questions_per_minute": round(len(results) / wall_seconds * 60, 1) if wall_seconds else None,
+    }
+    if latencies:
+        summary.update(
+            p50_seconds=round(percentile(latencies, 50), 2),
+            p95_seconds=round(percentile(latencies, 95), 2),
+            max_seconds=round(max(latencies), 2),
+            mean_llm_seconds=round(statistics.mean(r.timeline.get("llm_ms", 0) for r in ok) / 1000, 2),
+            mean_action_seconds=round(statistics.mean(r.timeline.get("action_ms", 0) for r in ok) / 1000, 2),
+        )
+    return summary
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--questions", type=Path, required=True, help="Text (one per line) or JSONL file")
+    parser.add_argument("--output", type=Path, required=True, help="JSONL file to write results to")
+    parser.add_argument("--agent-id", default=os.environ.get("AGENT_ID"))
+    parser.add_argument("--agent-alias-id", default=os.environ.get("AGENT_ALIAS_ID"))
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "eu-central-1"))
+    parser.add_argument("--endpoint-url", default=os.environ.get("AGENT_ENDPOINT_URL"),
+                        help="Agent runtime endpoint, e.g. a local agent_replay.py server")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--read-timeout", type=float, default=300.0,
+                        help="Seconds without data before a question is failed")
+    parser.add_argument("--schema-pruning", action="store_true",
+                        help="Send the pruned schema as a prompt session attribute, like the app")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N questions")
+    return parser.parse_args()
+
+
+async def run(args: argparse.Namespace) -> None:
+    questions = load_questions(args.questions)[: args.limit]
+    request_attributes = None
+    if args.schema_pruning:
+        from schema_selector import SchemaIndex
+
+        index = SchemaIndex.load(REPO_ROOT / "streamlit_app" / "schema_index.json")
+
+        def request_attributes(question: str) -> Dict[str, Any]:
+            return {"sessionState": {"promptSessionAttributes": {"athena_schema": index.pruned_schema(question)}}}
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    done = 0
+    with args.output.open("w", encoding="utf-8") as out:
+
+        def on_result(result: QuestionResult) -> None:
+            nonlocal done
+            done += 1
+            out.write(result.to_json() + "\n")
+            out.flush()
+            marker = "ok " if result.status == "ok" else "ERR"
+            print(f"[{done}/{len(questions)}] {marker} {result.latency_s:6.1f}s  {result.question[:70]}")
+
+        started = time.perf_counter()
+        async with AsyncAgentClient(
+            args.agent_id,
+            args.agent_alias_id,
+            args.region,
+            concurrency=args.concurrency,
+            read_timeout=args.read_timeout,
+            request_attributes=request_attributes,
+            endpoint_url=args.endpoint_url,
+        ) as client:
+            results = await run_questions(client, questions, concurrency=args.concurrency, on_result=on_result)
+        wall = time.perf_counter() - started
+
+    summary = summarize(results, wall)
+    print(json.dumps(summary, indent=2))
+
+
+def main() -> None:
+    args = parse_args()
+    if not args.agent_id or not args.agent_alias_id:
+        sys.exit("--agent-id and --agent-alias-id (or AGENT_ID/AGENT_ALIAS_ID) are required")
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        sys.exit("aiohttp is required: pip install -r scripts/requirements.txt")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
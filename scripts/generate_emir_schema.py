@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
-"""Generate the EMIR table schema for Bedrock agent orchestration prompt."""
+"""Generate the EMIR table schema for Bedrock agent orchestration prompt.
+
+Single-table helper kept for the existing docs; generate_schema_artifact.py
+covers every ingested table and only regenerates the ones that changed.
+"""
 
 import json
 from pathlib import Path
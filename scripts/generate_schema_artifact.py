@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+"""Generate the combined table schema for the Bedrock agent orchestration prompt.
+
+Unlike ``generate_emir_schema.py``, which hard-codes a single table, this walks
+every column map in ``schema/column-maps/`` (one per ingested table) together
+with the optional per-table stats in ``schema/column-stats/`` and writes one
+compact artifact: a DDL per table where each column carries a short hint (its
+original label and, when stats are available, its distinct values).
+
+Each table's rendered fragment is cached together with a hash of its inputs,
+so a run only re-renders the tables whose column map, stats or location
+changed. The same run can also rebuild the schema selection index used by the
+Streamlit app for question-relevant pruning, and the label index the action
+Lambda uses to rewrite original labels (``"reporting date [1.1]"``) and
+``<table>_view`` names in incoming SQL to the sanitized base table columns.
+
+Example usage:
+
+    ./scripts/generate_schema_artifact.py --output schema/agent-schema.txt \\
+        --schema-index streamlit_app/schema_index.json \\
+        --label-index schema/label-index.json --upload-label-index
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CONFIG_PATH = REPO_ROOT / "config" / "ingestion-config.json"
+DEFAULT_COLUMN_MAP_DIR = REPO_ROOT / "schema" / "column-maps"
+DEFAULT_STATS_DIR = REPO_ROOT / "schema" / "column-stats"
+DEFAULT_OUTPUT = REPO_ROOT / "schema" / "agent-schema.txt"
+DEFAULT_STATE_PATH = REPO_ROOT / "data" / "schema-cache" / "artifact-state.json"
+
+DEFAULT_LABEL_INDEX_KEY = "schema/label-index.json"
+
+STATE_FORMAT_VERSION = 1
+LABEL_INDEX_FORMAT_VERSION = 1
+MAX_HINT_VALUES = 8
+MAX_HINT_DISTINCT = 50
+
+
+def content_hash(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def column_hint(name: str, label: str, stats: Optional[Dict[str, Any]]) -> str:
+    """Short per-column hint: the original label plus a few known values."""
+
+    hints = []
+    if label and label != name:
+        hints.append(label)
+    if stats:
+        distinct = stats.get("distinct")
+        values = [str(value) for value, _ in stats.get("top_values", [])]
+        if values and distinct is not None and distinct <= MAX_HINT_DISTINCT:
+            shown = ", ".join(values[:MAX_HINT_VALUES])
+            more = ", ..." if distinct > MAX_HINT_VALUES else ""
+            hints.append(f"{distinct} values: {shown}{more}")
+        elif distinct is not None:
+            hints.append(f"{distinct} distinct")
+    return " | ".join(hints)
+
+
+def render_table(
+    database: str,
+    table: str,
+    column_map: Dict[str, str],
+    stats: Dict[str, Any],
+    location: Optional[str],
+) -> str:
+    column_stats = stats.get("columns", {})
+    names = list(column_map)
+    lines = []
+    for position, name in enumerate(names, start=1):
+        separator = "," if position < len(names) else ""
+        hint = column_hint(name, column_map[name], column_stats.get(name))
+        line = f"  `{name}` STRING{separator}"
+        lines.append(f"{line} -- {hint}" if hint else line)
+
+    statement = f"CREATE EXTERNAL TABLE {database}.{table} (\n" + "\n".join(lines) + "\n)"
+    if location:
+        statement += f"\nLOCATION '{location}'"
+    if stats.get("row_count") is not None:
+        statement += f"\n-- rows: {stats['row_count']}"
+    return statement
+
+
+def load_state(path: Path) -> Dict[str, Any]:
+    try:
+        state = json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = {}
+    if state.get("format_version") != STATE_FORMAT_VERSION:
+        state = {"format_version": STATE_FORMAT_VERSION, "tables": {}}
+    return state
+
+
+def save_state(path: Path, state: Dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(state, indent=1), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def table_location(config: Dict[str, Any], table: str) -> Optional[str]:
+    bucket = config.get("bucket")
+    if not bucket:
+        return None
+    prefix = str(config.get("prefix", "custom")).strip("/")
+    if config.get("table_format") == "iceberg":
+        table = f"{table}_iceberg"
+    parts = [p for p in [prefix, table] if p]
+    return f"s3://{bucket}/" + "/".join(parts) + "/"
+
+
+def generate(
+    *,
+    column_map_dir: Path,
+    stats_dir: Path,
+    state_path: Path,
+    config: Dict[str, Any],
+    force: bool = False,
+) -> Dict[str, Any]:
+    """Render every table, reusing cached fragments for unchanged inputs."""
+
+    database = config.get("database", "athena_db")
+    state = load_state(state_path)
+    cached: Dict[str, Dict[str, str]] = state["tables"]
+    fragments: List[str] = []
+    rendered: List[str] = []
+    reused: List[str] = []
+    tables: List[str] = []
+
+    for map_path in sorted(column_map_dir.glob("*.json")):
+        table = map_path.stem
+        tables.append(table)
+        map_bytes = map_path.read_bytes()
+        stats_path = stats_dir / f"{table}.json"
+        stats_bytes = stats_path.read_bytes() if stats_path.exists() else b""
+        location = table_location(config, table)
+        digest = content_hash(
+            map_bytes, stats_bytes, database.encode(), (location or "").encode()
+        )
+
+        entry = cached.get(table)
+        if entry and entry.get("hash") == digest and not force:
+            fragments.append(entry["fragment"])
+            reused.append(table)
+            continue
+
+        fragment = render_table(
+            database,
+            table,
+            json.loads(map_bytes),
+            json.loads(stats_bytes) if stats_bytes else {},
+            location,
+        )
+        cached[table] = {"hash": digest, "fragment": fragment}
+        fragments.append(fragment)
+        rendered.append(table)
+
+    removed = [t for t in cached if t not in tables]
+    for table in removed:
+        del cached[table]
+
+    save_state(state_path, state)
+    return {
+        "database": database,
+        "tables": tables,
+        "rendered": rendered,
+        "reused": reused,
+        "removed": removed,
+        "artifact": "<athena_schema>\n" + "\n\n".join(fragments) + "\n</athena_schema>\n",
+    }
+
+
+def build_schema_index(column_map_dir: Path, database: str, output: Path) -> None:
+    sys.path.insert(0, str(REPO_ROOT / "streamlit_app"))
+    from schema_selector import SchemaIndex, load_column_maps
+
+    SchemaIndex.build(load_column_maps(column_map_dir), database=database).save(output)
+
+
+def build_label_index(column_map_dir: Path, database: str, view_suffix: str) -> Dict[str, Any]:
+    """Lookup tables for the Lambda's label rewriter.
+
+    ``labels`` maps a lowercased label to ``{table: sanitized name}`` (a label
+    may exist in several tables), ``columns`` maps each table's sanitized
+    names back to labels for the result headers, and ``views`` maps the
+    companion view names to their base tables.
+    """
+
+    labels: Dict[str, Dict[str, str]] = {}
+    columns: Dict[str, Dict[str, str]] = {}
+    views: Dict[str, str] = {}
+    for map_path in sorted(column_map_dir.glob("*.json")):
+        table = map_path.stem
+        column_map = json.loads(map_path.read_text(encoding="utf-8"))
+        columns[table] = column_map
+        views[f"{table}_{view_suffix}"] = table
+        for name, label in column_map.items():
+            labels.setdefault(label.lower(), {})[table] = name
+    return {
+        "format_version": LABEL_INDEX_FORMAT_VERSION,
+        "database": database,
+        "views": views,
+        "columns": columns,
+        "labels": labels,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG_PATH,
+                        help="Ingestion config providing database, bucket and prefix")
+    parser.add_argument("--database", default=None, help="Override the database from the config")
+    parser.add_argument("--column-maps", type=Path, default=DEFAULT_COLUMN_MAP_DIR)
+    parser.add_argument("--stats", type=Path, default=DEFAULT_STATS_DIR,
+                        help="Directory of per-table column stats JSON files (optional)")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT,
+                        help="Where to write the combined schema artifact")
+    parser.add_argument("--state", type=Path, default=DEFAULT_STATE_PATH,
+                        help="Per-table hash cache used for incremental regeneration")
+    parser.add_argument("--schema-index", type=Path, default=None,
+                        help="Also rebuild the Streamlit schema selection index at this path")
+    parser.add_argument("--label-index", type=Path, default=None,
+                        help="Also write the Lambda's label rewrite index to this path")
+    parser.add_argument("--upload-label-index", action="store_true",
+                        help="Upload the label index to the config bucket for the action Lambda")
+    parser.add_argument("--label-index-key", default=DEFAULT_LABEL_INDEX_KEY,
+                        help="S3 key of the uploaded label index (Lambda LabelIndexKey)")
+    parser.add_argument("--force", action="store_true", help="Re-render every table")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    config: Dict[str, Any] = {}
+    if args.config.exists():
+        config = json.loads(args.config.read_text(encoding="utf-8"))
+    if args.database:
+        config["database"] = args.database
+
+    result = generate(
+        column_map_dir=args.column_maps,
+        stats_dir=args.stats,
+        state_path=args.state,
+        config=config,
+        force=args.force,
+    )
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    previous = args.output.read_text(encoding="utf-8") if args.output.exists() else None
+    if previous != result["artifact"]:
+        args.output.write_text(result["artifact"], encoding="utf-8")
+
+    if args.schema_index and (
+        result["rendered"] or result["removed"] or not args.schema_index.exists()
+    ):
+        build_schema_index(args.column_maps, result["database"], args.schema_index)
+        print(f"Schema index written to {args.schema_index}")
+
+    if args.label_index or args.upload_label_index:
+        label_index = build_label_index(
+            args.column_maps, result["database"], config.get("view_suffix", "view")
+        )
+        body = json.dumps(label_index, separators=(",", ":"), ensure_ascii=False)
+        if args.label_index:
+            args.label_index.parent.mkdir(parents=True, exist_ok=True)
+            args.label_index.write_text(body, encoding="utf-8")
+            print(f"Label index written to {args.label_index}")
+        if args.upload_label_index:
+            if not config.get("bucket"):
+                sys.exit("--upload-label-index needs a bucket in the config")
+            import boto3
+
+            session = boto3.Session(**({"region_name": config["region"]} if config.get("region") else {}))
+            session.client("s3").put_object(
+                Bucket=config["bucket"],
+                Key=args.label_index_key,
+                Body=body.encode("utf-8"),
+                ContentType="application/json",
+            )
+            print(f"Label index uploaded to s3://{config['bucket']}/{args.label_index_key}")
+
+    print(
+        f"{len(result['tables'])} table(s): {len(result['rendered'])} regenerated, "
+        f"{len(result['reused'])} unchanged"
+    )
+    print(f"Schema artifact: {args.output} ({len(result['artifact'])} chars)")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
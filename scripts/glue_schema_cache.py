@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""Table schemas from the Glue Data Catalog with a local, versioned cache.
+
+Athena keeps its table metadata in the Glue catalog, so one paginated
+``GetTables`` call returns the columns, types, location and SerDe of every
+table in a database; running ``DESCRIBE`` and ``SHOW CREATE TABLE`` through
+Athena for the same information costs two queries per table.
+
+``GlueSchemaCache`` stores those definitions in a JSON file. Each entry keeps
+the table's ``UpdateTime`` and ``VersionId``; a refresh only rewrites the
+entries whose version changed and drops tables that no longer exist. Within
+``max_age_seconds`` of the last refresh no AWS call is made at all, so reading
+the schema of every table in the database is a single local file read.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+CACHE_FORMAT_VERSION = 1
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CACHE_DIR = REPO_ROOT / "data" / "schema-cache"
+DEFAULT_MAX_AGE_SECONDS = 300.0
+
+
+def _timestamp(value: Any) -> Optional[str]:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value) if value is not None else None
+
+
+def table_entry(table: Dict[str, Any]) -> Dict[str, Any]:
+    """Reduce a Glue ``Table`` structure to what schema consumers need."""
+
+    descriptor = table.get("StorageDescriptor", {})
+    serde = descriptor.get("SerdeInfo", {})
+    return {
+        "name": table["Name"],
+        "update_time": _timestamp(table.get("UpdateTime") or table.get("CreateTime")),
+        "version_id": table.get("VersionId"),
+        "table_type": table.get("TableType"),
+        "location": descriptor.get("Location"),
+        "columns": [
+            {"name": col["Name"], "type": col.get("Type", "string"), "comment": col.get("Comment")}
+            for col in descriptor.get("Columns", [])
+        ],
+        "partition_keys": [
+            {"name": col["Name"], "type": col.get("Type", "string"), "comment": col.get("Comment")}
+            for col in table.get("PartitionKeys", [])
+        ],
+        "serde": serde.get("SerializationLibrary"),
+        "serde_parameters": serde.get("Parameters", {}),
+        "parameters": table.get("Parameters", {}),
+    }
+
+
+def _version_key(entry: Dict[str, Any]) -> tuple:
+    return entry.get("update_time"), entry.get("version_id")
+
+
+class GlueSchemaCache:
+    """Cached view of all table definitions in one Glue database."""
+
+    def __init__(
+        self,
+        glue_client,
+        database: str,
+        cache_path: Optional[Path] = None,
+        max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+    ) -> None:
+        self.glue = glue_client
+        self.database = database
+        self.cache_path = cache_path or DEFAULT_CACHE_DIR / f"{database}.json"
+        self.max_age_seconds = max_age_seconds
+        self._data = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        if data.get("format_version") != CACHE_FORMAT_VERSION or data.get("database") != self.database:
+            data = {
+                "format_version": CACHE_FORMAT_VERSION,
+                "database": self.database,
+                "refreshed_at": 0.0,
+                "tables": {},
+            }
+        return data
+
+    def _save(self) -> None:
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._data, indent=1), encoding="utf-8")
+        os.replace(tmp_path, self.cache_path)
+
+    def is_fresh(self) -> bool:
+        return time.time() - self._data["refreshed_at"] < self.max_age_seconds
+
+    def refresh(self) -> Dict[str, int]:
+        """Re-list the database and update only tables whose version changed."""
+
+        cached: Dict[str, Dict[str, Any]] = self._data["tables"]
+        seen = set()
+        stats = {"tables": 0, "added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+
+        paginator = self.glue.get_paginator("get_tables")
+        for page in paginator.paginate(DatabaseName=self.database):
+            for table in page.get("TableList", []):
+                entry = table_entry(table)
+                name = entry["name"]
+                seen.add(name)
+                previous = cached.get(name)
+                if previous is None:
+                    stats["added"] += 1
+                elif _version_key(previous) != _version_key(entry):
+                    stats["updated"] += 1
+                else:
+                    stats["unchanged"] += 1
+                    continue
+                cached[name] = entry
+
+        for name in [n for n in cached if n not in seen]:
+            del cached[name]
+            stats["removed"] += 1
+
+        stats["tables"] = len(cached)
+        self._data["refreshed_at"] = time.time()
+        self._save()
+        return stats
+
+    def tables(self, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        if refresh or not self.is_fresh():
+            self.refresh()
+        return self._data["tables"]
+
+    def table(self, name: str, refresh: bool = False) -> Dict[str, Any]:
+        tables = self.tables(refresh=refresh)
+        if name not in tables and not refresh:
+            # Possibly created since the last refresh.
+            tables = self.tables(refresh=True)
+        try:
+            return tables[name]
+        except KeyError as exc:
+            raise KeyError(f"Table {self.database}.{name} not found in the Glue catalog") from exc
+
+
+def format_create_table(database: str, entry: Dict[str, Any]) -> str:
+    """Render a cached entry as the compact DDL used in the agent prompt."""
+
+    columns = [f"  `{col['name']}` {col['type']}" for col in entry["columns"]]
+    columns_block = ",\n".join(columns)
+    statement = (
+        f"CREATE EXTERNAL TABLE {database}.{entry['name']} (\n"
+        f"{columns_block}\n"
+        ")"
+    )
+    if entry.get("partition_keys"):
+        partitions = ", ".join(f"`{col['name']}` {col['type']}" for col in entry["partition_keys"])
+        statement += f"\nPARTITIONED BY ({partitions})"
+    if entry.get("location"):
+        statement += f"\nLOCATION '{entry['location']}'"
+    return statement
+
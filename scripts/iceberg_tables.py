@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+r"""Apache Iceberg target for the CSV ingestion pipeline.
+
+Hive-style external CSV tables (``build_create_table_sql``) are append-only:
+correcting a record means re-ingesting everything. In Iceberg mode each upload
+is instead staged as a temporary external CSV table and applied to an Iceberg
+table with ``MERGE INTO`` on a configured business key, so a daily incremental
+load only rewrites the data files that contain changed keys. Iceberg also
+keeps per-file column statistics, which lets Athena skip files on filters.
+
+Frequent merges leave many small files and old snapshots behind. They are
+cleaned up with ``OPTIMIZE ... REWRITE DATA USING BIN_PACK`` and ``VACUUM``,
+either after every load (``merge_staged_file(..., compact=True)``, i.e.
+``ingest_csv_to_athena.py --compact``) or from a scheduled run of this
+script, e.g. a nightly cron entry:
+
+    ./scripts/iceberg_tables.py compact \
+        --database txt2sql_dev_athena_db --table test_population \
+        --athena-output s3://sl-athena-output-txt2sql-dev-123456789012-eu-central-1/
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+DEFAULT_TABLE_PROPERTIES = {
+    "table_type": "ICEBERG",
+    "format": "parquet",
+    "write_compression": "zstd",
+    "optimize_rewrite_delete_file_threshold": "10",
+    "vacuum_min_snapshots_to_keep": "5",
+    "vacuum_max_snapshot_age_seconds": str(7 * 24 * 3600),
+}
+
+
+def _quote(identifier: str) -> str:
+    return f'"{identifier}"'
+
+
+def build_create_iceberg_table_sql(
+    database: str,
+    table_name: str,
+    column_pairs: List[Tuple[str, str]],
+    s3_location: str,
+    table_properties: Dict[str, str] | None = None,
+) -> str:
+    properties = dict(DEFAULT_TABLE_PROPERTIES)
+    properties.update(table_properties or {})
+    column_lines = [f"  {safe} STRING" for safe, _ in column_pairs]
+    columns_block = ",\n".join(column_lines)
+    properties_block = ",\n".join(f"  '{key}'='{value}'" for key, value in properties.items())
+
+    return (
+        f"CREATE TABLE IF NOT EXISTS {database}.{table_name} (\n"
+        f"{columns_block}\n"
+        ")\n"
+        f"LOCATION '{s3_location}'\n"
+        "TBLPROPERTIES (\n"
+        f"{properties_block}\n"
+        ");"
+    )
+
+
+def build_merge_sql(
+    database: str,
+    table_name: str,
+    staging_table: str,
+    column_pairs: List[Tuple[str, str]],
+    key_columns: Sequence[str],
+) -> str:
+    """Upsert the staging table into the Iceberg table on ``key_columns``.
+
+    Athena rejects a MERGE where several source rows match the same target
+    row, so the staged rows are first reduced to one row per key. Which
+    duplicate is kept must not depend on how Athena happens to split the
+    scan, so they are ordered by their column values. Each run stages a
+    single file, so there is no newer file to prefer.
+    """
+
+    columns = [safe for safe, _ in column_pairs]
+    missing = [key for key in key_columns if key not in columns]
+    if missing:
+        raise ValueError(f"Merge key column(s) not in table: {', '.join(missing)}")
+
+    select_list = ", ".join(_quote(col) for col in columns)
+    partition_by = ", ".join(_quote(key) for key in key_columns)
+    order_by = ", ".join(f"{_quote(col)} DESC" for col in columns if col not in key_columns) or partition_by
+    on_clause = " AND ".join(f"t.{_quote(key)} = s.{_quote(key)}" for key in key_columns)
+    update_columns = [col for col in columns if col not in key_columns]
+    update_block = ",\n    ".join(f"{_quote(col)} = s.{_quote(col)}" for col in update_columns)
+    insert_values = ", ".join(f"s.{_quote(col)}" for col in columns)
+
+    sql = (
+        f"MERGE INTO {database}.{table_name} t\n"
+        "USING (\n"
+        f"  SELECT {select_list}\n"
+        "  FROM (\n"
+        f"    SELECT *, row_number() OVER (PARTITION BY {partition_by} ORDER BY {order_by}) AS dedup_rn\n"
+        f"    FROM {database}.{staging_table}\n"
+        "  )\n"
+        "  WHERE dedup_rn = 1\n"
+        ") s\n"
+        f"ON {on_clause}\n"
+    )
+    if update_columns:
+        sql += f"WHEN MATCHED THEN UPDATE SET\n    {update_block}\n"
+    sql += (
+        f"WHEN NOT MATCHED THEN INSERT ({select_list})\n"
+        f"  VALUES ({insert_values});"
+    )
+    return sql
+
+
+def build_compaction_sql(database: str, table_name: str) -> List[str]:
+    return [
+        f"OPTIMIZE {database}.{table_name} REWRITE DATA USING BIN_PACK;",
+        f"VACUUM {database}.{table_name};",
+    ]
+
+
+def staging_table_name(table_name: str, run_id: str) -> str:
+    return f"{table_name}__staging_{run_id}"
+
+
+def merge_staged_file(
+    run_query: Callable[[str], None],
+    *,
+    database: str,
+    table_name: str,
+    staging_table: str,
+    column_pairs: List[Tuple[str, str]],
+    key_columns: Sequence[str],
+    iceberg_location: str,
+    staging_ddl: str,
+    compact: bool = False,
+) -> None:
+    """Create the Iceberg table if needed and merge one staged CSV into it.
+
+    ``run_query`` executes a single Athena statement and raises on failure;
+    ``staging_ddl`` creates ``staging_table`` over the staged CSV. The staging
+    table is always dropped afterwards (its S3 data is left to the caller).
+    """
+
+    print(f"Ensuring Iceberg table {database}.{table_name} exists ...")
+    run_query(
+        build_create_iceberg_table_sql(database, table_name, column_pairs, iceberg_location)
+    )
+
+    print(f"Creating staging table {database}.{staging_table} ...")
+    run_query(staging_ddl)
+    try:
+        print(f"Merging staged rows into {database}.{table_name} on {', '.join(key_columns)} ...")
+        run_query(build_merge_sql(database, table_name, staging_table, column_pairs, key_columns))
+    finally:
+        run_query(f"DROP TABLE IF EXISTS {database}.{staging_table};")
+
+    if compact:
+        compact_table(run_query, database=database, table_name=table_name)
+
+
+def compact_table(run_query: Callable[[str], None], *, database: str, table_name: str) -> None:
+    for statement in build_compaction_sql(database, table_name):
+        print(f"Running: {statement}")
+        run_query(statement)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=["compact"], help="Maintenance action to run")
+    parser.add_argument("--database", required=True, help="Athena database")
+    parser.add_argument(
+        "--table",
+        action="append",
+        required=True,
+        help="Iceberg table to compact; repeat for several tables",
+    )
+    parser.add_argument(
+        "--athena-output",
+        required=True,
+        help="S3 location (s3://bucket/prefix/) for Athena query results",
+    )
+    parser.add_argument("--region", default=None, help="AWS region (defaults to AWS config)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    import boto3
+
+    from ingest_csv_to_athena import run_athena_query
+
+    args = parse_args()
+    session = boto3.Session(**({"region_name": args.region} if args.region else {}))
+    athena_client = session.client("athena")
+
+    def run_query(sql: str) -> None:
+        # OPTIMIZE can take a while on large tables.
+        run_athena_query(
+            athena_client, sql, args.athena_output, database=args.database, timeout=3600.0
+        )
+
+    for table in args.table:
+        compact_table(run_query, database=args.database, table_name=table)
+    print("Compaction complete.")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
@@ -4,9 +4,17 @@ r"""Utility script to load a local CSV into the Bedrock Text2SQL data lake.
 
 Steps performed:
 1. Read the local CSV header and build sanitized column names that are safe for Athena.
-2. Upload the CSV to the configured S3 data bucket under a deterministic prefix.
-3. Execute Athena DDL statements to create the database (if needed),
+2. Validate every row (field count, quoting, UTF-8). Invalid rows are written to a
+   quarantine object and left out of the uploaded data.
+3. Optionally drop rows whose business key was already ingested into the table.
+4. Upload the CSV to the configured S3 data bucket under a deterministic prefix.
+5. Execute Athena DDL statements to create the database (if needed),
    create an external table, and optionally a view with the original column names.
+   With ``--table-format iceberg`` the upload is staged instead and merged into an
+   Apache Iceberg table on ``--merge-key`` (see ``iceberg_tables.py``).
+6. Optionally update the table's value dictionary of low-cardinality columns
+   (see ``build_value_dictionary.py``): deduplicated rows appended to a hive
+   table are merged into it, otherwise it is recounted from the table.
 
 Requirements:
 - boto3 installed and AWS credentials configured in your environment.
@@ -29,9 +37,12 @@ from __future__ import annotations
 
 import argparse
 import csv
+import hashlib
 import json
 import re
+import shutil
 import sys
+import tempfile
 import time
 from pathlib import Path
 from typing import Dict, Iterable, List, Tuple
@@ -39,6 +50,11 @@ from typing import Dict, Iterable, List, Tuple
 import boto3
 from botocore.exceptions import ClientError
 
+import build_value_dictionary as value_dictionary
+from dedup_index import KeyIndex, index_path_for
+from iceberg_tables import merge_staged_file, staging_table_name
+from validate_csv import format_report, validate_csv
+
 
 def sanitize_identifier(raw: str) -> str:
     """Return a lowercase identifier safe for Athena table/column names."""
@@ -144,6 +160,17 @@ def upload_to_s3(
         raise RuntimeError(f"Failed to upload to s3://{bucket}/{key}: {exc}") from exc
 
 
+def delete_s3_prefix(s3_client, bucket: str, prefix: str) -> None:
+    try:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if objects:
+                s3_client.delete_objects(Bucket=bucket, Delete={"Objects": objects})
+    except ClientError as exc:
+        raise RuntimeError(f"Failed to delete s3://{bucket}/{prefix}: {exc}") from exc
+
+
 def run_athena_query(
     athena_client,
     query: str,
@@ -151,7 +178,7 @@ def run_athena_query(
     database: str | None = None,
     poll_interval: float = 2.0,
     timeout: float = 300.0,
-) -> None:
+) -> str:
     params = {
         "QueryString": query,
         "ResultConfiguration": {"OutputLocation": output_location},
@@ -178,7 +205,7 @@ def run_athena_query(
             if state != "SUCCEEDED":
                 details = status["QueryExecution"]["Status"].get("StateChangeReason", "")
                 raise RuntimeError(f"Athena query ended with state {state}: {details}")
-            return
+            return execution_id
 
         if time.time() - start_time > timeout:
             raise TimeoutError(
@@ -188,6 +215,123 @@ def run_athena_query(
         time.sleep(poll_interval)
 
 
+def validate_for_upload(
+    csv_path: Path,
+    column_pairs: List[Tuple[str, str]],
+    workdir: Path,
+    delimiter: str,
+    quote_char: str,
+    max_invalid_rows: int | None,
+) -> Tuple[Dict[str, object], Path]:
+    """Validate ``csv_path`` and return the report plus the file to upload.
+
+    When invalid rows are found, the returned path is a cleaned copy inside
+    ``workdir`` and the rejected rows are in ``report["quarantine_path"]``.
+    """
+
+    report = validate_csv(
+        csv_path,
+        [safe for safe, _ in column_pairs],
+        delimiter=delimiter,
+        quote_char=quote_char,
+        quarantine_path=workdir / f"{csv_path.stem}.quarantine.csv",
+        cleaned_path=workdir / csv_path.name,
+    )
+    print(format_report(report))
+
+    invalid_rows = int(report["invalid_rows"])
+    if max_invalid_rows is not None and invalid_rows > max_invalid_rows:
+        raise ValueError(
+            f"{csv_path.name} has {invalid_rows} invalid row(s), "
+            f"more than the allowed {max_invalid_rows}"
+        )
+
+    if invalid_rows:
+        return report, Path(str(report["cleaned_path"]))
+    return report, csv_path
+
+
+def file_digest(path: Path) -> str:
+    """Short content hash, used to give each deduplicated upload its own key."""
+
+    digest = hashlib.blake2b(digest_size=6)
+    with path.open("rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def update_value_dictionary(
+    *,
+    athena_client,
+    s3_client,
+    bucket: str,
+    database: str,
+    table: str,
+    column_pairs: List[Tuple[str, str]],
+    athena_output: str,
+    added_rows_path: Path | None,
+    appended: bool,
+    delimiter: str,
+    quote_char: str,
+    s3_prefix: str,
+    max_distinct: int,
+) -> None:
+    """Bring the table's value dictionary up to date after a successful ingest.
+
+    ``added_rows_path`` holds the rows this run added to the table (None if
+    none were). Their counts are merged into the existing dictionary only
+    when ``appended`` is set, i.e. the rows were deduplicated and added next
+    to the table's earlier files. Anything else (a re-upload that replaced an
+    object, an Iceberg MERGE that updated rows, no existing dictionary) is
+    recounted from the table itself.
+    """
+
+    if added_rows_path is None:
+        print(
+            "No rows were ingested into the table; leaving the value dictionary as it is "
+            "(rebuild it with build_value_dictionary.py --athena if the table changed)"
+        )
+        return
+    column_names = [safe for safe, _ in column_pairs]
+    existing = value_dictionary.load_existing(value_dictionary.DEFAULT_STATS_DIR, table)
+    if appended and existing and existing.get("database") == database:
+        print(f"Merging the added rows into the value dictionary of {table} ...")
+        counted = value_dictionary.merge_counts(
+            value_dictionary.to_counts(existing),
+            value_dictionary.count_csv_values(
+                added_rows_path,
+                column_names,
+                delimiter=delimiter,
+                quote_char=quote_char,
+                max_distinct=max_distinct,
+            ),
+            max_distinct,
+        )
+    else:
+        print(f"Rebuilding the value dictionary of {table} from the table ...")
+        counted = value_dictionary.count_athena_values(
+            athena_client,
+            database=database,
+            table=table,
+            column_names=column_names,
+            athena_output=athena_output,
+            max_distinct=max_distinct,
+        )
+    value_dictionary.write_outputs(
+        value_dictionary.finalize(
+            counted,
+            database=database,
+            table=table,
+            labels={safe: original for safe, original in column_pairs},
+        ),
+        stats_dir=value_dictionary.DEFAULT_STATS_DIR,
+        s3_client=s3_client,
+        bucket=bucket,
+        s3_prefix=s3_prefix,
+    )
+
+
 def dump_column_map(column_pairs: List[Tuple[str, str]], destination: Path) -> None:
     mapping = {safe: original for safe, original in column_pairs}
     destination.write_text(json.dumps(mapping, indent=2), encoding="utf-8")
@@ -249,6 +393,62 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Skip uploading to S3 (useful if file already present)",
     )
+    parser.add_argument(
+        "--skip-validation",
+        action="store_true",
+        help="Skip the row-level validation and quarantine pass",
+    )
+    parser.add_argument(
+        "--max-invalid-rows",
+        type=int,
+        default=None,
+        help="Fail instead of quarantining when more rows than this are invalid",
+    )
+    parser.add_argument(
+        "--dedup-key",
+        action="append",
+        default=None,
+        help="Sanitized column forming the business key; repeat for composite keys",
+    )
+    parser.add_argument(
+        "--dedup-ignore",
+        action="append",
+        default=None,
+        help="Sanitized column ignored when deciding whether a seen row changed",
+    )
+    parser.add_argument(
+        "--dedup-index-dir",
+        type=Path,
+        default=Path("data/dedup-index"),
+        help="Directory holding the per-table key indexes",
+    )
+    parser.add_argument(
+        "--value-dictionary",
+        action="store_true",
+        help="Update the table's value dictionary of low-cardinality column values after the ingest",
+    )
+    parser.add_argument(
+        "--table-format",
+        choices=["hive", "iceberg"],
+        default="hive",
+        help="Create an external CSV table (hive) or merge into an Iceberg table",
+    )
+    parser.add_argument(
+        "--merge-key",
+        action="append",
+        default=None,
+        help="Sanitized key column for Iceberg MERGE; repeat for composite keys",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Run OPTIMIZE and VACUUM on the Iceberg table after merging",
+    )
+    parser.add_argument(
+        "--quarantine-prefix",
+        default="quarantine",
+        help="S3 prefix (outside the table location) for rejected rows",
+    )
     parser.add_argument(
         "--skip-ddl",
         action="store_true",
@@ -273,6 +473,19 @@ def ingest_csv(
     column_map_output: Path | None = None,
     skip_upload: bool = False,
     skip_ddl: bool = False,
+    validate: bool = True,
+    max_invalid_rows: int | None = None,
+    quarantine_prefix: str = "quarantine",
+    dedup_key_columns: List[str] | None = None,
+    dedup_ignore_columns: List[str] | None = None,
+    dedup_index_dir: Path | None = None,
+    dedup_emit_changed: bool = True,
+    table_format: str = "hive",
+    merge_key_columns: List[str] | None = None,
+    compact_after_merge: bool = False,
+    build_value_dictionary: bool = False,
+    value_dictionary_prefix: str = value_dictionary.DEFAULT_S3_PREFIX,
+    value_dictionary_max_distinct: int = value_dictionary.DEFAULT_MAX_DISTINCT,
 ) -> Dict[str, str | int | None]:
     csv_path = Path(csv_path).expanduser().resolve()
     if not csv_path.exists():
@@ -294,6 +507,31 @@ def ingest_csv(
     else:
         s3_location = f"s3://{bucket}/"
 
+    if table_format not in {"hive", "iceberg"}:
+        raise ValueError(f"Unsupported table format: {table_format}")
+    staging_table: str | None = None
+    staging_prefix: str | None = None
+    if table_format == "iceberg":
+        if not merge_key_columns:
+            raise ValueError("Iceberg tables need at least one merge key column")
+        if skip_ddl and not skip_upload:
+            # Staged rows are only applied by the MERGE, so they would sit in
+            # the staging folder forever.
+            print(
+                "Warning: Iceberg rows are merged by the DDL step, which is skipped; "
+                "not staging the upload",
+                file=sys.stderr,
+            )
+            skip_upload = True
+        # Each upload gets its own staging folder next to (not inside) the
+        # Iceberg table's data location.
+        run_id = time.strftime("%Y%m%d%H%M%S") + f"_{sanitize_identifier(csv_path.stem)[:40]}"
+        staging_table = staging_table_name(sanitized_table, run_id)
+        base_parts = [p for p in [prefix_clean] if p]
+        staging_prefix = "/".join(base_parts + [f"{sanitized_table}_staging", run_id])
+        s3_key = f"{staging_prefix}/{sanitized_filename}"
+        s3_location = f"s3://{bucket}/" + "/".join(base_parts + [f"{sanitized_table}_iceberg"]) + "/"
+
     session_kwargs = {}
     if region:
         session_kwargs["region_name"] = region
@@ -302,54 +540,184 @@ def ingest_csv(
     s3_client = session.client("s3")
     athena_client = session.client("athena")
 
-    if not skip_upload:
-        print(f"Uploading {csv_path} to s3://{bucket}/{s3_key} ...")
-        upload_to_s3(s3_client, bucket, s3_key, csv_path)
-    else:
-        print("Skipping S3 upload as requested")
-
-    if not skip_ddl:
-        print(f"Ensuring database {database} exists ...")
-        run_athena_query(
-            athena_client,
-            f"CREATE DATABASE IF NOT EXISTS {database};",
-            athena_output,
-        )
-
-        print(f"Creating external table {database}.{sanitized_table} ...")
-        ddl = build_create_table_sql(
-            database=database,
-            table_name=sanitized_table,
-            column_pairs=column_pairs,
-            s3_location=s3_location,
-            delimiter=delimiter,
-            quote_char=quote_char,
-        )
-        run_athena_query(
-            athena_client,
-            ddl,
-            athena_output,
-            database=database,
-        )
+    validation: Dict[str, object] | None = None
+    quarantine_key: str | None = None
+    dedup: Dict[str, int] | None = None
+    key_index: KeyIndex | None = None
+    no_new_rows = False
+    workdir = Path(tempfile.mkdtemp(prefix="ingest-"))
+    try:
+        upload_path = csv_path
+        if validate:
+            print(f"Validating rows of {csv_path.name} ...")
+            validation, upload_path = validate_for_upload(
+                csv_path,
+                column_pairs,
+                workdir,
+                delimiter,
+                quote_char,
+                max_invalid_rows,
+            )
+        else:
+            print("Skipping row validation as requested")
 
-        if create_view:
-            view_sql = build_view_sql(
-                database=database,
-                table_name=sanitized_table,
-                column_pairs=column_pairs,
-                view_suffix=view_suffix,
+        if dedup_key_columns and not skip_upload:
+            if dedup_index_dir is None:
+                raise ValueError("dedup_index_dir is required when dedup_key_columns is set")
+            index_path = index_path_for(
+                Path(dedup_index_dir).expanduser().resolve(), database, sanitized_table
+            )
+            print(f"Deduplicating on {', '.join(dedup_key_columns)} using {index_path} ...")
+            key_index = KeyIndex(index_path)
+            deduped_path = workdir / "dedup" / csv_path.name
+            dedup = key_index.filter_csv(
+                upload_path,
+                deduped_path,
+                headers=[safe for safe, _ in column_pairs],
+                key_columns=dedup_key_columns,
+                ignore_columns=dedup_ignore_columns or [],
+                delimiter=delimiter,
+                quote_char=quote_char,
+                emit_changed=dedup_emit_changed,
             )
             print(
-                f"Creating view {database}.{sanitized_table}_{view_suffix} with original column names ..."
+                f"  {dedup['rows_in']} row(s) in, {dedup['new_rows']} new, "
+                f"{dedup['changed_rows']} changed, {dedup['duplicate_rows']} already ingested"
             )
+            upload_path = deduped_path
+            if dedup["rows_out"] == 0:
+                no_new_rows = True
+            elif table_format == "hive":
+                # The filtered file holds only this run's new rows, so it must
+                # not replace the object an earlier upload of the same file left
+                # in the table's folder.
+                s3_key = "/".join(
+                    folder_parts
+                    + [f"{sanitize_identifier(csv_path.stem)}.{time.strftime('%Y%m%d%H%M%S')}-{file_digest(deduped_path)}.csv"]
+                )
+
+        if not skip_upload:
+            if no_new_rows:
+                print("No new or changed rows; skipping the data upload")
+                s3_key = None
+            else:
+                print(f"Uploading {upload_path} to s3://{bucket}/{s3_key} ...")
+                upload_to_s3(s3_client, bucket, s3_key, upload_path)
+
+            if validation and validation.get("quarantine_path"):
+                quarantine_parts = [
+                    p for p in [quarantine_prefix.strip("/"), prefix_clean, sanitized_table] if p
+                ]
+                quarantine_key = "/".join(
+                    quarantine_parts + [f"{sanitize_identifier(csv_path.stem)}.quarantine.csv"]
+                )
+                print(f"Uploading rejected rows to s3://{bucket}/{quarantine_key} ...")
+                upload_to_s3(
+                    s3_client,
+                    bucket,
+                    quarantine_key,
+                    Path(str(validation["quarantine_path"])),
+                )
+        else:
+            print("Skipping S3 upload as requested")
+
+        if not skip_ddl:
+            print(f"Ensuring database {database} exists ...")
             run_athena_query(
                 athena_client,
-                view_sql,
+                f"CREATE DATABASE IF NOT EXISTS {database};",
                 athena_output,
+            )
+
+            if table_format == "iceberg" and no_new_rows:
+                print("Nothing staged; skipping the MERGE")
+            elif table_format == "iceberg":
+                def run_query(sql: str) -> None:
+                    run_athena_query(athena_client, sql, athena_output, database=database)
+
+                try:
+                    merge_staged_file(
+                        run_query,
+                        database=database,
+                        table_name=sanitized_table,
+                        staging_table=staging_table,
+                        column_pairs=column_pairs,
+                        key_columns=merge_key_columns,
+                        iceberg_location=s3_location,
+                        staging_ddl=build_create_table_sql(
+                            database=database,
+                            table_name=staging_table,
+                            column_pairs=column_pairs,
+                            s3_location=f"s3://{bucket}/{staging_prefix}/",
+                            delimiter=delimiter,
+                            quote_char=quote_char,
+                        ),
+                        compact=compact_after_merge,
+                    )
+                finally:
+                    if not skip_upload:
+                        delete_s3_prefix(s3_client, bucket, f"{staging_prefix}/")
+            else:
+                print(f"Creating external table {database}.{sanitized_table} ...")
+                ddl = build_create_table_sql(
+                    database=database,
+                    table_name=sanitized_table,
+                    column_pairs=column_pairs,
+                    s3_location=s3_location,
+                    delimiter=delimiter,
+                    quote_char=quote_char,
+                )
+                run_athena_query(
+                    athena_client,
+                    ddl,
+                    athena_output,
+                    database=database,
+                )
+
+            if create_view:
+                view_sql = build_view_sql(
+                    database=database,
+                    table_name=sanitized_table,
+                    column_pairs=column_pairs,
+                    view_suffix=view_suffix,
+                )
+                print(
+                    f"Creating view {database}.{sanitized_table}_{view_suffix} with original column names ..."
+                )
+                run_athena_query(
+                    athena_client,
+                    view_sql,
+                    athena_output,
+                    database=database,
+                )
+        else:
+            print("Skipping Athena DDL execution as requested")
+
+        if key_index:
+            # Keys only count as ingested once their rows are queryable, i.e.
+            # after the DDL or MERGE has succeeded.
+            key_index.commit()
+
+        if build_value_dictionary:
+            update_value_dictionary(
+                athena_client=athena_client,
+                s3_client=s3_client,
+                bucket=bucket,
                 database=database,
+                table=sanitized_table,
+                column_pairs=column_pairs,
+                athena_output=athena_output,
+                added_rows_path=None if skip_upload or skip_ddl or no_new_rows else upload_path,
+                appended=table_format == "hive" and dedup is not None,
+                delimiter=delimiter,
+                quote_char=quote_char,
+                s3_prefix=value_dictionary_prefix,
+                max_distinct=value_dictionary_max_distinct,
             )
-    else:
-        print("Skipping Athena DDL execution as requested")
+    finally:
+        if key_index:
+            key_index.close()
+        shutil.rmtree(workdir, ignore_errors=True)
 
     if column_map_output:
         column_map_output = column_map_output.expanduser().resolve()
@@ -359,6 +727,7 @@ def ingest_csv(
 
     summary: Dict[str, str | int | None] = {
         "table": f"{database}.{sanitized_table}",
+        "table_format": table_format,
         "view": f"{database}.{sanitized_table}_{view_suffix}" if create_view else None,
         "s3_location": s3_location,
         "s3_key": s3_key,
@@ -367,6 +736,10 @@ def ingest_csv(
         "column_map_path": str(column_map_output) if column_map_output else None,
         "upload_performed": "no" if skip_upload else "yes",
         "ddl_executed": "no" if skip_ddl else "yes",
+        "rows_validated": validation["total_rows"] if validation else None,
+        "invalid_rows": validation["invalid_rows"] if validation else None,
+        "quarantine_s3_key": quarantine_key,
+        "rows_deduplicated": dedup["duplicate_rows"] if dedup else None,
     }
     return summary
 
@@ -389,6 +762,16 @@ def main() -> None:
         column_map_output=args.column_map_output,
         skip_upload=args.skip_upload,
         skip_ddl=args.skip_ddl,
+        validate=not args.skip_validation,
+        max_invalid_rows=args.max_invalid_rows,
+        quarantine_prefix=args.quarantine_prefix,
+        dedup_key_columns=args.dedup_key,
+        dedup_ignore_columns=args.dedup_ignore,
+        dedup_index_dir=args.dedup_index_dir,
+        table_format=args.table_format,
+        merge_key_columns=args.merge_key,
+        compact_after_merge=args.compact,
+        build_value_dictionary=args.value_dictionary,
     )
 
     print("\nIngestion complete. Summary:")
@@ -398,6 +781,15 @@ def main() -> None:
     print(f"  S3 data location: {summary['s3_location']}")
     print(f"  Athena output location: {summary['athena_output']}")
     print(f"  Total columns: {summary['total_columns']}")
+    if summary.get("rows_validated") is not None:
+        print(
+            f"  Rows validated: {summary['rows_validated']} "
+            f"({summary['invalid_rows']} quarantined)"
+        )
+    if summary.get("rows_deduplicated") is not None:
+        print(f"  Rows skipped as already ingested: {summary['rows_deduplicated']}")
+    if summary.get("quarantine_s3_key"):
+        print(f"  Quarantine object: s3://{args.bucket}/{summary['quarantine_s3_key']}")
     if summary.get("column_map_path"):
         print(f"  Column map: {summary['column_map_path']}")
 
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
-"""Batch-ingest CSV files dropped into the repo's upload directory."""
+"""Batch-ingest CSV files dropped into the repo's upload directory.
+
+Runs once over the files currently present, or with ``--watch`` keeps running
+and ingests new files as soon as they have finished landing.
+"""
 
 from __future__ import annotations
 
@@ -12,12 +16,14 @@ from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 from ingest_csv_to_athena import ingest_csv, sanitize_identifier
+from upload_watcher import list_candidates, run_watch
 
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 DEFAULT_UPLOAD_DIR = REPO_ROOT / "data" / "uploads"
 DEFAULT_PROCESSED_DIR = DEFAULT_UPLOAD_DIR / "processed"
 DEFAULT_CONFIG_PATH = REPO_ROOT / "config" / "ingestion-config.json"
+DEFAULT_STATUS_PATH = DEFAULT_UPLOAD_DIR / "watch-status.json"
 
 
 def load_config(path: Path) -> Dict[str, Any]:
@@ -93,9 +99,132 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Skip running Athena DDL statements",
     )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and ingest new files as they land",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="Number of files ingested in parallel in watch mode",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2.0,
+        help="Seconds between directory rescans in watch mode",
+    )
+    parser.add_argument(
+        "--settle-seconds",
+        type=float,
+        default=3.0,
+        help="How long a file's size and mtime must be unchanged before ingesting it",
+    )
+    parser.add_argument(
+        "--status-file",
+        type=Path,
+        default=DEFAULT_STATUS_PATH,
+        help="JSON file updated with queue depth and lag in watch mode",
+    )
+    parser.add_argument(
+        "--no-inotify",
+        action="store_true",
+        help="Use directory polling even where inotify is available",
+    )
     return parser.parse_args()
 
 
+def resolve_table_name(csv_file: Path, table_prefix: str) -> str:
+    table_name_candidate = sanitize_identifier(csv_file.stem)
+    if table_prefix:
+        return sanitize_identifier(f"{table_prefix}_{table_name_candidate}")
+    return table_name_candidate
+
+
+def ingest_one_file(
+    csv_file: Path,
+    *,
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    column_map_dir: Optional[Path],
+) -> Dict[str, Any]:
+    table_name = resolve_table_name(csv_file, config.get("table_name_prefix", ""))
+
+    column_map_output = None
+    if column_map_dir:
+        column_map_output = column_map_dir / f"{table_name}.json"
+
+    dedup_config = config.get("dedup") or {}
+    if "tables" in dedup_config and table_name not in dedup_config["tables"]:
+        dedup_config = {}
+    iceberg_config = config.get("iceberg") or {}
+    dictionary_config = config.get("value_dictionary") or {}
+    dedup_index_dir = None
+    if dedup_config.get("key_columns"):
+        dedup_index_dir = REPO_ROOT / dedup_config.get("index_dir", "data/dedup-index")
+
+    return ingest_csv(
+        csv_path=csv_file,
+        bucket=config["bucket"],
+        prefix=config.get("prefix", "custom"),
+        table_name=table_name,
+        database=config.get("database", "athena_db"),
+        athena_output=config["athena_output"],
+        region=config.get("region"),
+        delimiter=config.get("delimiter", ","),
+        quote_char=config.get("quote_char", "\""),
+        create_view=bool(config.get("create_view", False)),
+        view_suffix=config.get("view_suffix", "view"),
+        column_map_output=column_map_output,
+        skip_upload=args.skip_upload,
+        skip_ddl=args.skip_ddl,
+        validate=bool(config.get("validate", True)),
+        max_invalid_rows=config.get("max_invalid_rows"),
+        quarantine_prefix=config.get("quarantine_prefix", "quarantine"),
+        dedup_key_columns=dedup_config.get("key_columns"),
+        dedup_ignore_columns=dedup_config.get("ignore_columns"),
+        dedup_index_dir=dedup_index_dir,
+        dedup_emit_changed=bool(dedup_config.get("emit_changed", True)),
+        table_format=config.get("table_format", "hive"),
+        merge_key_columns=iceberg_config.get("merge_key_columns"),
+        compact_after_merge=iceberg_config.get("compact") == "always",
+        build_value_dictionary=bool(dictionary_config.get("enabled", False)),
+        value_dictionary_prefix=dictionary_config.get("s3_prefix", "value-dictionaries"),
+        value_dictionary_max_distinct=int(dictionary_config.get("max_distinct", 200)),
+    )
+
+
+def watch(
+    *,
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    upload_dir: Path,
+    processed_dir: Path,
+    column_map_dir: Optional[Path],
+) -> None:
+    def ingest_and_archive(csv_file: Path) -> Dict[str, Any]:
+        print(f"\n--- Processing {csv_file.name} ---")
+        summary = ingest_one_file(
+            csv_file, config=config, args=args, column_map_dir=column_map_dir
+        )
+        moved_to = move_to_processed(csv_file, processed_dir)
+        print(f"SUCCESS: {csv_file.name} -> {summary['table']} (archived to {moved_to.name})")
+        return summary
+
+    run_watch(
+        upload_dir=upload_dir,
+        processed_dir=processed_dir,
+        ingest_one=ingest_and_archive,
+        workers=args.workers,
+        poll_interval=args.poll_interval,
+        settle_seconds=args.settle_seconds,
+        status_path=args.status_file.expanduser().resolve() if args.status_file else None,
+        use_inotify=not args.no_inotify,
+    )
+
+
 def main() -> None:
     args = parse_args()
     config = load_config(args.config)
@@ -106,9 +235,22 @@ def main() -> None:
 
     upload_dir.mkdir(parents=True, exist_ok=True)
 
-    csv_files = sorted(
-        [p for p in upload_dir.glob("*.csv") if p.is_file() and processed_dir not in p.parents]
-    )
+    column_map_dir: Optional[Path] = None
+    if config.get("column_map_dir"):
+        column_map_dir = (REPO_ROOT / config["column_map_dir"]).expanduser().resolve()
+        column_map_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.watch:
+        watch(
+            config=config,
+            args=args,
+            upload_dir=upload_dir,
+            processed_dir=processed_dir,
+            column_map_dir=column_map_dir,
+        )
+        return
+
+    csv_files = list_candidates(upload_dir, processed_dir)
 
     if args.limit is not None:
         csv_files = csv_files[: args.limit]
@@ -119,44 +261,14 @@ def main() -> None:
 
     print(f"Found {len(csv_files)} CSV file(s) to ingest from {upload_dir}.")
 
-    column_map_dir: Optional[Path] = None
-    if config.get("column_map_dir"):
-        column_map_dir = (REPO_ROOT / config["column_map_dir"]).expanduser().resolve()
-        column_map_dir.mkdir(parents=True, exist_ok=True)
-
-    table_prefix = config.get("table_name_prefix", "")
-
     failures: List[tuple[Path, str]] = []
     successes: List[Dict[str, Any]] = []
 
     for csv_file in csv_files:
-        table_name_candidate = sanitize_identifier(csv_file.stem)
-        if table_prefix:
-            table_name = sanitize_identifier(f"{table_prefix}_{table_name_candidate}")
-        else:
-            table_name = table_name_candidate
-
-        column_map_output = None
-        if column_map_dir:
-            column_map_output = column_map_dir / f"{table_name}.json"
-
         print(f"\n--- Processing {csv_file.name} ---")
         try:
-            summary = ingest_csv(
-                csv_path=csv_file,
-                bucket=config["bucket"],
-                prefix=config.get("prefix", "custom"),
-                table_name=table_name,
-                database=config.get("database", "athena_db"),
-                athena_output=config["athena_output"],
-                region=config.get("region"),
-                delimiter=config.get("delimiter", ","),
-                quote_char=config.get("quote_char", "\""),
-                create_view=bool(config.get("create_view", False)),
-                view_suffix=config.get("view_suffix", "view"),
-                column_map_output=column_map_output,
-                skip_upload=args.skip_upload,
-                skip_ddl=args.skip_ddl,
+            summary = ingest_one_file(
+                csv_file, config=config, args=args, column_map_dir=column_map_dir
             )
         except Exception as exc:  # noqa: BLE001
             failures.append((csv_file, str(exc)))
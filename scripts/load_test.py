@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+
+"""Load-test the agent request handlers and report latency percentiles.
+
+Drives ``streamlit_app/invoke_agent.lambda_handler`` (``--target agent``) or
+``frontend/lambda-proxy.py``'s ``lambda_handler`` (``--target proxy``) in
+this process, the way one App Runner instance or Lambda container would run
+them, with one of two arrival models:
+
+* ``--mode open --rate R``: Poisson arrivals at R requests/second,
+  independent of how fast answers come back (at most ``--max-in-flight``
+  run at once). Latency is measured from the scheduled arrival, so time
+  spent queueing behind slow requests counts.
+* ``--mode closed --users N``: N users that each ask, wait for the answer,
+  think for ``--think-time`` seconds and ask again.
+
+``--backend replay`` (the default) answers from an ``agent_replay`` server
+(agent) or ``StubAgentRuntimeClient`` (proxy), with the replay timing and
+failure options below, so runs are repeatable and cost nothing. The replay
+server runs in a child process, so its CPU time and memory are not part of
+the samples; the proxy's stub client runs in this process. ``--backend
+real`` calls the configured agent.
+
+Written to ``--output-dir``: ``requests.csv`` (one row per request),
+``samples.csv`` (CPU, RSS, in-flight and completions per sample interval),
+``summary.json`` and ``report.html``.
+
+Example usage:
+
+    ./scripts/load_test.py --target agent --mode open --rate 5 --duration 60 \\
+        --frame-delay-ms 200 --throttle-rate 0.05 --output-dir results/load-open-5
+    ./scripts/load_test.py --target proxy --mode closed --users 20 --duration 120
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import html
+import importlib.util
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "streamlit_app"))
+
+from agent_replay import Scenario, StubAgentRuntimeClient  # noqa: E402
+
+
+REPLAY_AGENT_ID = "REPLAYAGNT"
+REPLAY_ALIAS_ID = "REPLAYALIA"
+DEFAULT_QUESTIONS = [
+    "How many records are there?",
+    "Show me 5 incident reports",
+    "How many incidents per incident code?",
+    "Which counterparties have the most trades?",
+]
+
+
+@dataclass
+class RequestResult:
+    start_s: float
+    latency_s: float
+    ok: bool
+    error: str = ""
+    user: int = -1
+
+
+@dataclass
+class Sample:
+    t_s: float
+    cpu_percent: float
+    rss_mb: float
+    in_flight: int
+    completed: int
+    errors: int
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def rss_mb() -> float:
+    """Current resident set size (peak RSS where /proc is not available)."""
+
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def start_replay_process(args: argparse.Namespace) -> Tuple[str, Callable[[], None]]:
+    """Start ``agent_replay.py`` with the replay options in a child process; (url, stop)."""
+
+    command = [
+        sys.executable, "-u", str(REPO_ROOT / "streamlit_app" / "agent_replay.py"), "--port", "0",
+        "--first-byte-delay-ms", str(args.first_byte_delay_ms),
+        "--frame-delay-ms", str(args.frame_delay_ms),
+        "--frame-jitter-ms", str(args.frame_jitter_ms),
+        "--throttle-rate", str(args.throttle_rate),
+        "--error-rate", str(args.error_rate),
+        "--stream-throttle-rate", str(args.stream_throttle_rate),
+    ]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    if args.recording:
+        command += ["--recording", *(str(path) for path in args.recording)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    match = re.search(r"Replaying on (\S+)", line)
+    if not match:
+        process.kill()
+        raise RuntimeError(f"agent_replay.py did not start: {line.strip() or 'no output'}")
+
+    def stop() -> None:
+        process.terminate()
+        process.wait(timeout=10)
+
+    return match.group(1), stop
+
+
+def agent_target(args: argparse.Namespace, scenario: Optional[Scenario]) -> Tuple[Callable[[str, str], Tuple[bool, str]], Callable[[], None]]:
+    """``call(question, session) -> (ok, error)`` for invoke_agent.lambda_handler.
+
+    With a replay ``scenario`` the same options are served by a child process
+    (see ``start_replay_process``), not by a server in this process.
+    """
+
+    stop_server = None
+    if scenario is not None:
+        url, stop_server = start_replay_process(args)
+        os.environ.update(
+            AGENT_ENDPOINT_URL=url,
+            AGENT_ID=REPLAY_AGENT_ID,
+            AGENT_ALIAS_ID=REPLAY_ALIAS_ID,
+            ANSWER_CACHE="off",
+        )
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "AKIDEXAMPLE")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY")
+    import invoke_agent
+
+    def call(question: str, session: str) -> Tuple[bool, str]:
+        response = invoke_agent.lambda_handler(
+            {"sessionId": session, "question": question, "bypassCache": True}, None
+        )
+        if response["status_code"] != 200:
+            return False, f"status {response['status_code']}"
+        answer = json.loads(response["body"]).get("trace_data", "")
+        if answer.startswith(("Error", "HTTP Error", "No response")):
+            return False, answer.split(":")[0][:60]
+        return True, ""
+
+    return call, (stop_server or (lambda: None))
+
+
+def proxy_target(args: argparse.Namespace, scenario: Optional[Scenario]) -> Tuple[Callable[[str, str], Tuple[bool, str]], Callable[[], None]]:
+    """``call(question, session) -> (ok, error)`` for frontend/lambda-proxy.py."""
+
+    spec = importlib.util.spec_from_file_location("lambda_proxy", REPO_ROOT / "frontend" / "lambda-proxy.py")
+    proxy = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(proxy)
+    agent_id, alias_id = os.environ.get("AGENT_ID"), os.environ.get("AGENT_ALIAS_ID")
+    if scenario is not None:
+        proxy.bedrock_runtime = StubAgentRuntimeClient(scenario)
+        agent_id, alias_id = REPLAY_AGENT_ID, REPLAY_ALIAS_ID
+
+    def call(question: str, session: str) -> Tuple[bool, str]:
+        body = {"agentId": agent_id, "agentAliasId": alias_id, "sessionId": session, "question": question}
+        response = proxy.lambda_handler({"httpMethod": "POST", "body": json.dumps(body)}, None)
+        if response["statusCode"] != 200:
+            return False, json.loads(response["body"]).get("type") or f"status {response['statusCode']}"
+        return True, ""
+
+    return call, lambda: None
+
+
+class LoadRun:
+    def __init__(self, call: Callable[[str, str], Tuple[bool, str]], questions: List[str], seed: Optional[int]) -> None:
+        self.call = call
+        self.questions = questions
+        self.rng = random.Random(seed)
+        self.results: List[RequestResult] = []
+        self.samples: List[Sample] = []
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.started = time.perf_counter()
+
+    def now(self) -> float:
+        return time.perf_counter() - self.started
+
+    def ask(self, scheduled: float, user: int = -1) -> None:
+        with self._lock:
+            self.in_flight += 1
+            question = self.rng.choice(self.questions)
+        session = f"load-{uuid.uuid4().hex[:12]}"
+        try:
+            ok, error = self.call(question, session)
+        except Exception as exc:  # a handler that raises is an error, not a crash of the run
+            ok, error = False, type(exc).__name__
+        finished = self.now()
+        with self._lock:
+            self.in_flight -= 1
+            self.results.append(RequestResult(round(scheduled, 4), round(finished - scheduled, 4), ok, error, user))
+
+    def sample(self, interval: float) -> None:
+        last_wall, last_cpu = time.perf_counter(), time.process_time()
+        while not self._stop.wait(interval):
+            wall, cpu = time.perf_counter(), time.process_time()
+            with self._lock:
+                completed = len(self.results)
+                errors = sum(1 for r in self.results if not r.ok)
+                in_flight = self.in_flight
+            self.samples.append(
+                Sample(round(self.now(), 2), round((cpu - last_cpu) / (wall - last_wall) * 100, 1),
+                       round(rss_mb(), 1), in_flight, completed, errors)
+            )
+            last_wall, last_cpu = wall, cpu
+
+    def run_open(self, rate: float, duration: float, max_in_flight: int) -> None:
+        with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="load") as pool:
+            arrival = 0.0
+            while True:
+                arrival += self.rng.expovariate(rate)
+                if arrival >= duration:
+                    break
+                delay = arrival - self.now()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.ask, arrival)
+
+    def run_closed(self, users: int, duration: float, think_time: float) -> None:
+        def user_loop(user: int) -> None:
+            while self.now() < duration:
+                self.ask(self.now(), user)
+                if think_time:
+                    time.sleep(self.rng.expovariate(1 / think_time))
+
+        threads = [threading.Thread(target=user_loop, args=(u,), daemon=True) for u in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def stop_sampling(self) -> None:
+        self._stop.set()
+
+
+def summarize(results: List[RequestResult], wall_s: float, warmup: float) -> Dict[str, Any]:
+    measured = [r for r in results if r.start_s >= warmup]
+    ok = [r.latency_s for r in measured if r.ok]
+    errors: Dict[str, int] = {}
+    for r in measured:
+        if not r.ok:
+            errors[r.error] = errors.get(r.error, 0) + 1
+    window = max(wall_s - warmup, 1e-9)
+    summary: Dict[str, Any] = {
+        "requests": len(measured),
+        "ok": len(ok),
+        "errors": len(measured) - len(ok),
+        "error_rate": round((len(measured) - len(ok)) / len(measured), 4) if measured else 0.0,
+        "throughput_rps": round(len(ok) / window, 3),
+        "error_types": errors,
+    }
+    if ok:
+        summary.update(
+            p50_s=round(percentile(ok, 50), 3),
+            p95_s=round(percentile(ok, 95), 3),
+            p99_s=round(percentile(ok, 99), 3),
+            max_s=round(max(ok), 3),
+        )
+    return summary
+
+
+def write_csv(path: Path, rows: List[Any]) -> None:
+    if not rows:
+        path.write_text("", encoding="utf-8")
+        return
+    with path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(asdict(rows[0])))
+        writer.writeheader()
+        writer.writerows(asdict(row) for row in rows)
+
+
+def svg_line(points: List[Tuple[float, float]], title: str, width: int = 560, height: int = 140) -> str:
+    if len(points) < 2:
+        return ""
+    max_x = max(x for x, _ in points) or 1.0
+    max_y = max(y for _, y in points) or 1.0
+    coords = " ".join(
+        f"{x / max_x * (width - 10) + 5:.1f},{height - 20 - y / max_y * (height - 35):.1f}" for x, y in points
+    )
+    return (
+        f'<figure><figcaption>{html.escape(title)} (max {max_y:g})</figcaption>'
+        f'<svg width="{width}" height="{height}" style="border:1px solid #ddd">'
+        f'<polyline fill="none" stroke="#1f77b4" stroke-width="1.5" points="{coords}"/></svg></figure>'
+    )
+
+
+def write_report(path: Path, config: Dict[str, Any], summary: Dict[str, Any],
+                 results: List[RequestResult], samples: List[Sample]) -> None:
+    per_second: Dict[int, List[float]] = {}
+    for r in results:
+        if r.ok:
+            per_second.setdefault(int(r.start_s + r.latency_s), []).append(r.latency_s)
+    p95_series = [(float(t), percentile(v, 95)) for t, v in sorted(per_second.items())]
+    rows = "".join(
+        f"<tr><th>{html.escape(str(k))}</th><td>{html.escape(json.dumps(v) if isinstance(v, dict) else str(v))}</td></tr>"
+        for k, v in summary.items()
+    )
+    config_rows = "".join(
+        f"<tr><th>{html.escape(str(k))}</th><td>{html.escape(str(v))}</td></tr>" for k, v in config.items()
+    )
+    charts = "".join([
+        svg_line(p95_series, "p95 latency (s) of answers completed per second"),
+        svg_line([(s.t_s, float(s.in_flight)) for s in samples], "Requests in flight"),
+        svg_line([(s.t_s, s.cpu_percent) for s in samples], "CPU (% of one core)"),
+        svg_line([(s.t_s, s.rss_mb) for s in samples], "RSS (MB)"),
+    ])
+    path.write_text(
+        "<!doctype html><html><head><meta charset='utf-8'><title>Load test</title>"
+        "<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse}"
+        "th,td{border:1px solid #ddd;padding:4px 8px;text-align:left}</style></head><body>"
+        f"<h1>Load test: {html.escape(str(config['target']))} ({html.escape(str(config['mode']))})</h1>"
+        f"<h2>Summary</h2><table>{rows}</table><h2>Over time</h2>{charts}"
+        f"<h2>Configuration</h2><table>{config_rows}</table></body></html>",
+        encoding="utf-8",
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--target", choices=("agent", "proxy"), default="agent")
+    parser.add_argument("--backend", choices=("replay", "real"), default="replay")
+    parser.add_argument("--mode", choices=("open", "closed"), default="open")
+    parser.add_argument("--rate", type=float, default=2.0, help="Open loop: mean arrivals per second")
+    parser.add_argument("--max-in-flight", type=int, default=200, help="Open loop: concurrent request limit")
+    parser.add_argument("--users", type=int, default=10, help="Closed loop: concurrent users")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Closed loop: mean seconds between answers")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to generate load for")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds excluded from the summary")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--questions", type=Path, default=None, help="Text file, one question per line")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output-dir", type=Path, default=Path("load-test-results"))
+    replay = parser.add_argument_group("replay backend")
+    replay.add_argument("--recording", type=Path, nargs="*", default=[])
+    replay.add_argument("--first-byte-delay-ms", type=float, default=300.0)
+    replay.add_argument("--frame-delay-ms", type=float, default=150.0)
+    replay.add_argument("--frame-jitter-ms", type=float, default=50.0)
+    replay.add_argument("--throttle-rate", type=float, default=0.0)
+    replay.add_argument("--error-rate", type=float, default=0.0)
+    replay.add_argument("--stream-throttle-rate", type=float, default=0.0)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    scenario = None
+    if args.backend == "replay":
+        options = dict(
+            first_byte_delay_ms=args.first_byte_delay_ms,
+            frame_delay_ms=args.frame_delay_ms,
+            frame_jitter_ms=args.frame_jitter_ms,
+            throttle_rate=args.throttle_rate,
+            error_rate=args.error_rate,
+            stream_throttle_rate=args.stream_throttle_rate,
+            seed=args.seed,
+        )
+        scenario = Scenario.from_files(args.recording, **options) if args.recording else Scenario.synthetic(**options)
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        questions = [line.strip() for line in args.questions.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+    call, shutdown = (agent_target if args.target == "agent" else proxy_target)(args, scenario)
+    run = LoadRun(call, questions, args.seed)
+    sampler = threading.Thread(target=run.sample, args=(args.sample_interval,), daemon=True)
+    sampler.start()
+    try:
+        if args.mode == "open":
+            run.run_open(args.rate, args.duration, args.max_in_flight)
+        else:
+            run.run_closed(args.users, args.duration, args.think_time)
+    finally:
+        wall = run.now()
+        run.stop_sampling()
+        sampler.join()
+        shutdown()
+
+    config = {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()}
+    summary = summarize(run.results, wall, args.warmup)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    write_csv(args.output_dir / "requests.csv", sorted(run.results, key=lambda r: r.start_s))
+    write_csv(args.output_dir / "samples.csv", run.samples)
+    (args.output_dir / "summary.json").write_text(
+        json.dumps({"config": config, "summary": summary}, indent=2), encoding="utf-8"
+    )
+    write_report(args.output_dir / "report.html", config, summary, run.results, run.samples)
+
+    print(json.dumps(summary, indent=2))
+    print(f"Results written to {args.output_dir}/")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
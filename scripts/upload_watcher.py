@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+"""Watch the upload directory and feed new CSV files to the ingestion pipeline.
+
+Used by ``ingest_uploads.py --watch``. New files are detected with Linux
+inotify (through ``ctypes``, no extra dependency) and, where inotify is not
+available, by polling the directory. A file is only handed to ingestion once
+its size and mtime have stopped changing for ``settle_seconds``, so partially
+copied uploads are never picked up. Ready files go through a bounded pool of
+worker threads, and a small JSON status file reports queue depth and lag.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import json
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Minimal inotify wrapper reporting file names written into a directory."""
+
+    def __init__(self, directory: Path) -> None:
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("libc does not provide inotify")
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, str(directory).encode(), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+        self.directory = directory
+        self._fd = fd
+
+    def wait(self, timeout: float) -> List[Path]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        names: List[Path] = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            raw_name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if raw_name:
+                names.append(self.directory / os.fsdecode(raw_name))
+        return names
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Fallback watcher that simply sleeps; every wake-up triggers a rescan."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def wait(self, timeout: float) -> List[Path]:
+        time.sleep(timeout)
+        return []
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(directory: Path, use_inotify: bool = True):
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory)
+        except OSError as exc:
+            print(f"inotify unavailable ({exc}); falling back to polling")
+    return PollingWatcher(directory)
+
+
+def list_candidates(upload_dir: Path, processed_dir: Path) -> List[Path]:
+    return sorted(
+        p
+        for p in upload_dir.glob("*.csv")
+        if p.is_file() and processed_dir not in p.parents
+    )
+
+
+def _stat_signature(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_status(status_path: Path, status: Dict[str, Any]) -> None:
+    """Write the status file atomically so readers never see partial JSON."""
+
+    status_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = status_path.with_suffix(status_path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps(status, indent=2), encoding="utf-8")
+    os.replace(tmp_path, status_path)
+
+
+def run_watch(
+    *,
+    upload_dir: Path,
+    processed_dir: Path,
+    ingest_one: Callable[[Path], Dict[str, Any]],
+    workers: int = 2,
+    max_queue: int = 100,
+    poll_interval: float = 2.0,
+    settle_seconds: float = 3.0,
+    status_path: Optional[Path] = None,
+    use_inotify: bool = True,
+    stop_event: Optional[threading.Event] = None,
+) -> None:
+    """Run until interrupted, ingesting each CSV once it has finished landing.
+
+    ``ingest_one`` receives the stable file path; it is expected to move the
+    file out of ``upload_dir`` on success. Failed files are not retried until
+    their size or mtime changes.
+    """
+
+    stop_event = stop_event or threading.Event()
+    work_queue: "queue.Queue[Tuple[Path, float]]" = queue.Queue(maxsize=max_queue)
+    lock = threading.Lock()
+
+    # path -> (signature, first time this signature was seen, first seen at all)
+    pending: Dict[Path, Tuple[Tuple[int, int], float, float]] = {}
+    queued: Set[Path] = set()
+    failed: Dict[Path, Tuple[int, int]] = {}
+    stats: Dict[str, Any] = {
+        "started_at": time.time(),
+        "processed": 0,
+        "failed": 0,
+        "in_flight": 0,
+        "last_lag_seconds": None,
+        "max_lag_seconds": 0.0,
+        "last_file": None,
+        "last_error": None,
+    }
+
+    def worker() -> None:
+        while not stop_event.is_set():
+            try:
+                path, arrived_at = work_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            signature = _stat_signature(path)
+            with lock:
+                stats["in_flight"] += 1
+            try:
+                ingest_one(path)
+            except Exception as exc:  # noqa: BLE001
+                print(f"ERROR: Failed to ingest {path.name}: {exc}")
+                with lock:
+                    stats["failed"] += 1
+                    stats["last_error"] = f"{path.name}: {exc}"
+                    if signature:
+                        failed[path] = signature
+            else:
+                lag = time.time() - arrived_at
+                with lock:
+                    stats["processed"] += 1
+                    stats["last_file"] = path.name
+                    stats["last_lag_seconds"] = round(lag, 3)
+                    stats["max_lag_seconds"] = round(max(stats["max_lag_seconds"], lag), 3)
+            finally:
+                with lock:
+                    stats["in_flight"] -= 1
+                    queued.discard(path)
+                work_queue.task_done()
+
+    def publish_status(now: float) -> None:
+        if not status_path:
+            return
+        with lock:
+            oldest = min((first for _, _, first in pending.values()), default=None)
+            status = dict(stats)
+            status.update(
+                {
+                    "updated_at": now,
+                    "queue_depth": work_queue.qsize(),
+                    "pending_files": len(pending),
+                    "oldest_pending_seconds": round(now - oldest, 3) if oldest else 0.0,
+                    "workers": workers,
+                }
+            )
+        write_status(status_path, status)
+
+    def scan(now: float) -> None:
+        for path in list_candidates(upload_dir, processed_dir):
+            with lock:
+                if path in queued:
+                    continue
+            signature = _stat_signature(path)
+            if signature is None:
+                pending.pop(path, None)
+                continue
+            if failed.get(path) == signature:
+                continue
+            failed.pop(path, None)
+
+            previous = pending.get(path)
+            if previous is None or previous[0] != signature:
+                first_seen = previous[2] if previous else now
+                pending[path] = (signature, now, first_seen)
+                continue
+            if now - previous[1] < settle_seconds:
+                continue
+
+            try:
+                work_queue.put_nowait((path, previous[2]))
+            except queue.Full:
+                # Back-pressure: leave it pending and try again next scan.
+                continue
+            with lock:
+                queued.add(path)
+            del pending[path]
+
+        for path in [p for p in pending if not p.exists()]:
+            del pending[path]
+
+    threads = [
+        threading.Thread(target=worker, name=f"ingest-worker-{i}", daemon=True)
+        for i in range(max(1, workers))
+    ]
+    for thread in threads:
+        thread.start()
+
+    watcher = open_watcher(upload_dir, use_inotify=use_inotify)
+    print(
+        f"Watching {upload_dir} with {type(watcher).__name__} "
+        f"({workers} worker(s), settle {settle_seconds}s). Press Ctrl+C to stop."
+    )
+    try:
+        while not stop_event.is_set():
+            now = time.time()
+            scan(now)
+            publish_status(now)
+            # Wake up early while files are settling so they are not delayed by
+            # a full poll interval.
+            timeout = min(poll_interval, settle_seconds / 2) if pending else poll_interval
+            watcher.wait(timeout)
+    finally:
+        stop_event.set()
+        watcher.close()
+        for thread in threads:
+            thread.join(timeout=5)
+        publish_status(time.time())
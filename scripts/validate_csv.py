@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+"""Validate a local CSV before it is handed to Athena's OpenCSVSerde.
+
+Athena reads the table through Hive's text input format, which splits records
+on newlines *before* the SerDe sees them. A row with the wrong number of
+fields, an unterminated quote or bytes that are not valid UTF-8 therefore does
+not fail the query; it silently shifts values into the wrong columns. This
+module finds those rows up front.
+
+Two engines are available:
+
+* ``arrow`` parses the file in large blocks with ``pyarrow.csv`` (vectorized,
+  typically several hundred MB/s) and is used whenever pyarrow is installed.
+* ``python`` is a line-oriented fallback built on the standard ``csv`` module.
+
+Both engines apply the same rules as Athena: one record per physical line,
+every record has exactly as many fields as the header, every field is valid
+UTF-8 and quotes are well formed. pyarrow accepts stray or unterminated
+quotes, so the arrow engine also runs the strict ``csv`` check on the lines
+that contain a quote character. The fast pass only counts. When it finds invalid rows, a second
+line-oriented pass writes them to a quarantine CSV and (optionally) writes a
+cleaned copy of the file containing only the valid lines, byte for byte.
+
+Example usage:
+
+    ./scripts/validate_csv.py --csv-path data/uploads/extract.csv \
+        --quarantine-output /tmp/extract.quarantine.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:  # pragma: no cover - optional dependency
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pa_csv = None
+
+
+DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+MAX_SAMPLES = 20
+
+REASON_FIELD_COUNT = "field_count"
+REASON_ENCODING = "encoding"
+REASON_QUOTING = "quoting"
+
+QUARANTINE_HEADER = ["line_number", "reason", "detail", "raw_line"]
+
+
+def arrow_available() -> bool:
+    return pa_csv is not None
+
+
+def _new_report(csv_path: Path, engine: str, expected_fields: int) -> Dict[str, Any]:
+    return {
+        "csv_path": str(csv_path),
+        "engine": engine,
+        "expected_fields": expected_fields,
+        "total_rows": 0,
+        "valid_rows": 0,
+        "invalid_rows": 0,
+        "invalid_by_reason": {
+            REASON_FIELD_COUNT: 0,
+            REASON_ENCODING: 0,
+            REASON_QUOTING: 0,
+        },
+        "samples": [],
+        "bytes": csv_path.stat().st_size,
+        "elapsed_seconds": 0.0,
+        "quarantine_path": None,
+        "cleaned_path": None,
+    }
+
+
+def _record_invalid(
+    report: Dict[str, Any],
+    line_number: Optional[int],
+    reason: str,
+    detail: str,
+) -> None:
+    report["invalid_rows"] += 1
+    report["invalid_by_reason"][reason] += 1
+    if len(report["samples"]) < MAX_SAMPLES:
+        report["samples"].append(
+            {"line_number": line_number, "reason": reason, "detail": detail}
+        )
+
+
+def _finish_report(report: Dict[str, Any], started: float) -> Dict[str, Any]:
+    report["valid_rows"] = report["total_rows"] - report["invalid_rows"]
+    elapsed = time.perf_counter() - started
+    report["elapsed_seconds"] = round(elapsed, 3)
+    report["mb_per_second"] = (
+        round(report["bytes"] / (1024 * 1024) / elapsed, 1) if elapsed > 0 else None
+    )
+    return report
+
+
+def _classify_line(
+    raw: bytes,
+    delimiter: str,
+    quote_char: str,
+    expected_fields: int,
+) -> Optional[tuple[str, str]]:
+    """Return ``(reason, detail)`` if a physical line is not a valid record."""
+
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        return REASON_ENCODING, str(exc)
+
+    reader = csv.reader(
+        [text.rstrip("\r\n")],
+        delimiter=delimiter,
+        quotechar=quote_char,
+        strict=True,
+    )
+    try:
+        fields = next(reader, [])
+    except csv.Error as exc:
+        return REASON_QUOTING, str(exc)
+
+    if len(fields) != expected_fields:
+        return REASON_FIELD_COUNT, f"expected {expected_fields} fields, found {len(fields)}"
+    return None
+
+
+def _is_blank(raw: bytes) -> bool:
+    return not raw.strip(b"\r\n")
+
+
+def _line_pass(
+    csv_path: Path,
+    delimiter: str,
+    quote_char: str,
+    expected_fields: int,
+    report: Dict[str, Any],
+    quarantine_path: Optional[Path] = None,
+    cleaned_path: Optional[Path] = None,
+) -> None:
+    """Classify every data line, optionally writing quarantine/cleaned output."""
+
+    quarantine_fh = None
+    quarantine_writer = None
+    cleaned_fh = None
+    try:
+        if quarantine_path:
+            quarantine_path.parent.mkdir(parents=True, exist_ok=True)
+            quarantine_fh = quarantine_path.open("w", newline="", encoding="utf-8")
+            quarantine_writer = csv.writer(quarantine_fh)
+            quarantine_writer.writerow(QUARANTINE_HEADER)
+        if cleaned_path:
+            cleaned_path.parent.mkdir(parents=True, exist_ok=True)
+            cleaned_fh = cleaned_path.open("wb")
+
+        with csv_path.open("rb") as fh:
+            header = fh.readline()
+            if cleaned_fh:
+                cleaned_fh.write(header)
+
+            for line_number, raw in enumerate(fh, start=2):
+                if _is_blank(raw):
+                    continue
+                report["total_rows"] += 1
+                problem = _classify_line(raw, delimiter, quote_char, expected_fields)
+                if problem is None:
+                    if cleaned_fh:
+                        cleaned_fh.write(raw)
+                    continue
+
+                reason, detail = problem
+                _record_invalid(report, line_number, reason, detail)
+                if quarantine_writer:
+                    quarantine_writer.writerow(
+                        [
+                            line_number,
+                            reason,
+                            detail,
+                            raw.decode("utf-8", errors="backslashreplace").rstrip("\r\n"),
+                        ]
+                    )
+    finally:
+        if quarantine_fh:
+            quarantine_fh.close()
+        if cleaned_fh:
+            cleaned_fh.close()
+
+
+def _arrow_pass(
+    csv_path: Path,
+    headers: List[str],
+    delimiter: str,
+    quote_char: str,
+    block_size: int,
+    report: Dict[str, Any],
+) -> None:
+    """Count rows and detect invalid ones with pyarrow's streaming CSV reader."""
+
+    invalid_texts = set()
+
+    def on_invalid_row(row) -> str:  # pyarrow.csv.InvalidRow
+        report["total_rows"] += 1
+        detail = f"expected {row.expected_columns} fields, found {row.actual_columns}"
+        _record_invalid(report, row.number, REASON_FIELD_COUNT, detail)
+        invalid_texts.add(row.text.rstrip("\r\n"))
+        return "skip"
+
+    # Columns are read as binary so that invalid UTF-8 does not abort the whole
+    # read; validity is then checked per column with a vectorized cast.
+    read_options = pa_csv.ReadOptions(
+        column_names=headers,
+        skip_rows=1,
+        block_size=block_size,
+        use_threads=True,
+    )
+    parse_options = pa_csv.ParseOptions(
+        delimiter=delimiter,
+        quote_char=quote_char,
+        newlines_in_values=False,
+        ignore_empty_lines=True,
+        invalid_row_handler=on_invalid_row,
+    )
+    convert_options = pa_csv.ConvertOptions(
+        column_types={name: pa.binary() for name in headers},
+        strings_can_be_null=False,
+    )
+
+    reader = pa_csv.open_csv(
+        str(csv_path),
+        read_options=read_options,
+        parse_options=parse_options,
+        convert_options=convert_options,
+    )
+    for batch in reader:
+        report["total_rows"] += batch.num_rows
+        bad_rows = set()
+        for column in batch.columns:
+            try:
+                column.cast(pa.string())
+            except pa.ArrowInvalid:
+                # Rare path: locate the offending rows in this batch only.
+                for index, value in enumerate(column.to_pylist()):
+                    try:
+                        value.decode("utf-8")
+                    except UnicodeDecodeError:
+                        bad_rows.add(index)
+        for _ in bad_rows:
+            _record_invalid(report, None, REASON_ENCODING, "invalid UTF-8 in row")
+
+    _quote_pass(csv_path, delimiter, quote_char, invalid_texts, report)
+
+
+def _quote_pass(
+    csv_path: Path,
+    delimiter: str,
+    quote_char: str,
+    already_invalid: set,
+    report: Dict[str, Any],
+) -> None:
+    """Record lines that pyarrow parsed but ``csv`` rejects in strict mode.
+
+    Only lines containing the quote character can fail, so the others are
+    skipped without decoding. Lines pyarrow already rejected are not counted
+    twice.
+    """
+
+    quote = quote_char.encode("utf-8")
+    with csv_path.open("rb") as fh:
+        fh.readline()
+        for line_number, raw in enumerate(fh, start=2):
+            if quote not in raw:
+                continue
+            try:
+                text = raw.decode("utf-8").rstrip("\r\n")
+            except UnicodeDecodeError:
+                continue  # counted by the encoding check
+            if text in already_invalid:
+                continue
+            try:
+                next(csv.reader([text], delimiter=delimiter, quotechar=quote_char, strict=True), [])
+            except csv.Error as exc:
+                _record_invalid(report, line_number, REASON_QUOTING, str(exc))
+
+
+def validate_csv(
+    csv_path: Path,
+    headers: List[str],
+    *,
+    delimiter: str = ",",
+    quote_char: str = "\"",
+    quarantine_path: Optional[Path] = None,
+    cleaned_path: Optional[Path] = None,
+    engine: str = "auto",
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Dict[str, Any]:
+    """Validate every data row of ``csv_path`` against its header.
+
+    ``headers`` holds one unique name per column, e.g. the sanitized names
+    from ``unique_identifiers``; only their count and order matter.
+    When invalid rows are found and ``quarantine_path``/``cleaned_path`` are
+    given, they receive the rejected lines and the accepted lines respectively.
+    Neither file is written for a clean input.
+    """
+
+    if engine == "auto":
+        engine = "arrow" if arrow_available() else "python"
+    if engine == "arrow" and not arrow_available():
+        raise RuntimeError("pyarrow is not installed; use engine='python'")
+    if engine not in {"arrow", "python"}:
+        raise ValueError(f"Unknown validation engine: {engine}")
+
+    csv_path = Path(csv_path)
+    expected_fields = len(headers)
+    report = _new_report(csv_path, engine, expected_fields)
+    started = time.perf_counter()
+
+    if engine == "arrow":
+        _arrow_pass(csv_path, headers, delimiter, quote_char, block_size, report)
+    else:
+        _line_pass(csv_path, delimiter, quote_char, expected_fields, report)
+
+    if report["invalid_rows"] and (quarantine_path or cleaned_path):
+        # Second, line-oriented pass that produces exact line numbers and
+        # byte-identical cleaned output. Only runs for files that need fixing.
+        remediation = _new_report(csv_path, engine, expected_fields)
+        _line_pass(
+            csv_path,
+            delimiter,
+            quote_char,
+            expected_fields,
+            remediation,
+            quarantine_path=quarantine_path,
+            cleaned_path=cleaned_path,
+        )
+        report = remediation
+
+    if report["invalid_rows"]:
+        report["quarantine_path"] = str(quarantine_path) if quarantine_path else None
+        report["cleaned_path"] = str(cleaned_path) if cleaned_path else None
+
+    return _finish_report(report, started)
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    buffer = io.StringIO()
+    buffer.write(
+        f"Validated {report['total_rows']} row(s) with the {report['engine']} engine "
+        f"in {report['elapsed_seconds']}s"
+    )
+    if report.get("mb_per_second"):
+        buffer.write(f" ({report['mb_per_second']} MB/s)")
+    buffer.write("\n")
+    buffer.write(f"  Valid rows: {report['valid_rows']}\n")
+    buffer.write(f"  Invalid rows: {report['invalid_rows']}\n")
+    for reason, count in report["invalid_by_reason"].items():
+        if count:
+            buffer.write(f"    {reason}: {count}\n")
+    for sample in report["samples"][:5]:
+        line = sample["line_number"] if sample["line_number"] is not None else "?"
+        buffer.write(f"    line {line}: {sample['reason']} ({sample['detail']})\n")
+    if report.get("quarantine_path"):
+        buffer.write(f"  Quarantine file: {report['quarantine_path']}\n")
+    return buffer.getvalue().rstrip("\n")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--csv-path", required=True, type=Path, help="Path to local CSV file")
+    parser.add_argument("--delimiter", default=",", help="CSV delimiter (default ',')")
+    parser.add_argument(
+        "--quote-char",
+        default="\"",
+        help='CSV quote character (default "\"")',
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["auto", "arrow", "python"],
+        default="auto",
+        help="Validation engine (default: arrow if pyarrow is installed)",
+    )
+    parser.add_argument(
+        "--quarantine-output",
+        type=Path,
+        default=None,
+        help="Optional path for a CSV of rejected rows",
+    )
+    parser.add_argument(
+        "--cleaned-output",
+        type=Path,
+        default=None,
+        help="Optional path for a copy of the file without the rejected rows",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    from ingest_csv_to_athena import read_csv_header, unique_identifiers
+
+    args = parse_args()
+    csv_path = args.csv_path.expanduser().resolve()
+    headers = read_csv_header(csv_path, args.delimiter)
+    report = validate_csv(
+        csv_path,
+        [safe for safe, _ in unique_identifiers(headers)],
+        delimiter=args.delimiter,
+        quote_char=args.quote_char,
+        quarantine_path=args.quarantine_output,
+        cleaned_path=args.cleaned_output,
+        engine=args.engine,
+    )
+    print(format_report(report))
+    if report["invalid_rows"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit("Aborted by user")
@@ -0,0 +1,113 @@
+"""Reusable SigV4-signing HTTP client for the Bedrock agent runtime.
+
+``sigv4_request`` used to take ``Session().get_credentials().get_frozen_credentials()``
+as a default argument, i.e. credentials frozen once at import; temporary
+credentials (App Runner instance role, SSO, assumed roles) stopped working
+when they expired. Each call also went through a bare ``requests.request``,
+which opens and closes a new TLS connection every time.
+
+``SigV4Client`` keeps one ``requests.Session`` with a pooled keep-alive
+adapter and signs every request with freshly resolved credentials: botocore's
+refreshable credentials renew themselves shortly before expiry when
+``get_frozen_credentials()`` is called. Connect and read timeouts are
+configurable, and ``stats()`` reports how many requests reused a pooled
+connection.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from boto3.session import Session
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 180.0
+DEFAULT_POOL_SIZE = 10
+
+
+class SigV4Client:
+    """Signs and sends requests for one AWS service and region."""
+
+    def __init__(
+        self,
+        service: str,
+        region: str,
+        *,
+        credentials=None,
+        boto_session: Optional[Session] = None,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+    ) -> None:
+        self.service = service
+        self.region = region
+        self.timeout = (connect_timeout, read_timeout)
+        # Fixed botocore Credentials, frozen ReadOnlyCredentials (which have no
+        # get_frozen_credentials) or the (refreshable) session chain.
+        self._credentials = credentials or (boto_session or Session()).get_credentials()
+        if self._credentials is None:
+            raise RuntimeError("No AWS credentials found")
+
+        self._http = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self._http.mount("https://", self._adapter)
+        self._http.mount("http://", self._adapter)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def request(
+        self,
+        url: str,
+        method: str = "GET",
+        body: Optional[str | bytes] = None,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        stream: bool = False,
+    ) -> requests.Response:
+        credentials = getattr(self._credentials, "get_frozen_credentials", lambda: self._credentials)()
+        req = AWSRequest(method=method, url=url, data=body, params=params, headers=headers)
+        SigV4Auth(credentials, self.service, self.region).add_auth(req)
+        prepared = req.prepare()
+        with self._lock:
+            self._requests += 1
+        try:
+            return self._http.request(
+                method=prepared.method,
+                url=prepared.url,
+                headers=dict(prepared.headers),
+                data=prepared.body,
+                stream=stream,
+                timeout=self.timeout,
+            )
+        except requests.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        """Requests sent, connections opened and how many requests reused one."""
+
+        pools = self._adapter.poolmanager.pools
+        opened = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+        with self._lock:
+            sent, errors = self._requests, self._errors
+        return {
+            "requests": sent,
+            "errors": errors,
+            "connections_opened": opened,
+            "connections_reused": max(0, sent - opened),
+        }
+
+    def close(self) -> None:
+        self._http.close()
@@ -0,0 +1,212 @@
+"""Run agent questions on a bounded worker pool so the UI can poll and cancel.
+
+The Submit handler used to stream the answer inline, so the script was
+blocked for the whole orchestration and a runaway question could not be
+stopped. ``JobPool.submit`` starts an ``AgentJob`` on one of ``max_workers``
+threads (at most ``max_queued`` more wait for a worker; beyond that
+``PoolSaturated`` is raised) and returns at once. The worker appends answer
+text and progress steps to the job, which the page re-reads on every rerun.
+
+``JobPool.cancel`` sets the job's cancel flag, closes its HTTP response (the
+worker's blocked read fails and the agent stream is abandoned) and calls
+``on_cancel(job)``, which stops any Athena query the agent is still waiting
+for (see ``invoke_agent.stop_session_queries``).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from result_tables import ResultCapture
+from trace_collector import TraceCollector
+
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_QUEUED = 16
+
+
+class PoolSaturated(RuntimeError):
+    """All workers are busy and the queue is full."""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class AgentJob:
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+    def __init__(self, question: str, session_id: str, context: Optional[Dict[str, Any]] = None) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.question = question
+        self.session_id = session_id
+        self.context = context or {}
+        self.state = self.QUEUED
+        self.collector = TraceCollector()
+        self.results = ResultCapture()
+        self.chunks: List[str] = []
+        self.steps: List[Tuple[str, Optional[str]]] = []
+        self.error: Optional[str] = None
+        self.submitted = time.perf_counter()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.first_output: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self._response = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.state in (self.QUEUED, self.RUNNING)
+
+    @property
+    def text(self) -> str:
+        with self._lock:
+            return "".join(self.chunks)
+
+    @property
+    def label(self) -> str:
+        if self.state == self.QUEUED:
+            return "Waiting for a free worker..."
+        with self._lock:
+            return f"{self.steps[-1][0]}..." if self.steps else "Asking the agent..."
+
+    def add_text(self, text: str) -> None:
+        with self._lock:
+            if self.first_output is None:
+                self.first_output = time.perf_counter() - (self.started or self.submitted)
+            self.chunks.append(text)
+
+    def add_step(self, label: str, detail: Optional[str] = None) -> None:
+        with self._lock:
+            if self.first_output is None:
+                self.first_output = time.perf_counter() - (self.started or self.submitted)
+            self.steps.append((label, detail))
+
+    def restart(self, collector: TraceCollector) -> None:
+        """Drop the progress so far and continue with ``collector`` (e.g. a hedged request's)."""
+
+        with self._lock:
+            self.collector = collector
+            self.results = ResultCapture()
+            self.chunks = []
+            self.steps = []
+
+    def attach_response(self, response: Any) -> None:
+        """Remember the HTTP response so ``cancel`` can close it from another thread."""
+
+        with self._lock:
+            self._response = response
+        if self.cancel_event.is_set():
+            response.close()
+
+    def check_cancelled(self) -> None:
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def close_response(self) -> None:
+        with self._lock:
+            response = self._response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - (self.started or self.submitted)
+
+
+class JobPool:
+    def __init__(
+        self,
+        runner: Callable[[AgentJob], None],
+        *,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        on_cancel: Optional[Callable[[AgentJob], Any]] = None,
+    ) -> None:
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.on_cancel = on_cancel
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-job")
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def submit(self, question: str, session_id: str, context: Optional[Dict[str, Any]] = None) -> AgentJob:
+        with self._lock:
+            if self._running + self._queued >= self.max_workers + self.max_queued:
+                self.rejected += 1
+                print(f"Agent job pool saturated: {self._running} running, {self._queued} queued, "
+                      f"{self.rejected} rejected so far")
+                raise PoolSaturated(f"All {self.max_workers} workers are busy and {self._queued} questions are waiting")
+            self._queued += 1
+            waiting = self._running + self._queued - self.max_workers
+            if waiting > 0:
+                print(f"Agent job pool busy: question queued ({waiting} waiting for a worker)")
+        job = AgentJob(question, session_id, context)
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: AgentJob) -> None:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        job.started = time.perf_counter()
+        try:
+            job.check_cancelled()
+            job.state = AgentJob.RUNNING
+            self.runner(job)
+            job.state = AgentJob.CANCELLED if job.cancel_event.is_set() else AgentJob.DONE
+        except Exception as e:
+            if job.cancel_event.is_set():
+                job.state = AgentJob.CANCELLED
+            else:
+                job.state = AgentJob.FAILED
+                job.error = f"{type(e).__name__}: {e}"
+                job.collector.add("error", f"Agent job failed: {job.error}")
+        finally:
+            job.finished = time.perf_counter()
+            job.close_response()
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+                if job.state == AgentJob.CANCELLED:
+                    self.cancelled += 1
+
+    def cancel(self, job: AgentJob) -> None:
+        if not job.active or job.cancel_event.is_set():
+            return
+        job.cancel_event.set()
+        job.collector.add("cancel", "Cancelled by the user")
+        job.close_response()
+        if self.on_cancel is not None:
+            try:
+                self.on_cancel(job)
+            except Exception as e:
+                print(f"Cancelling job {job.id} cleanup failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": self._queued,
+                "workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+            }
+
+    def saturated(self) -> bool:
+        with self._lock:
+            return self._running >= self.max_workers
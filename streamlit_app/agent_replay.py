@@ -0,0 +1,364 @@
+"""Local stand-in for the Bedrock agent runtime that replays event streams.
+
+``ReplayServer`` serves ``POST /agents/{id}/agentAliases/{alias}/sessions/{sid}/text``
+(the ``InvokeAgent`` endpoint ``invoke_agent.lambda_handler`` calls; point it
+there with ``AGENT_ENDPOINT_URL=http://127.0.0.1:8089``) and answers with
+recorded event streams (``AGENT_STREAM_RECORD_DIR`` captures) or synthetic
+ones from ``synthetic_stream``. ``StubAgentRuntimeClient`` replays the same
+scenarios through the boto3 ``invoke_agent`` interface, e.g. for
+``frontend/lambda-proxy.py``::
+
+    proxy.bedrock_runtime = StubAgentRuntimeClient(Scenario.synthetic())
+
+A ``Scenario`` decides per request what to send and how: delay before the
+first byte and between frames, how frames are split into network chunks, and
+injected failures (HTTP 429 with ``Retry-After``, HTTP 500, or a
+``throttlingException`` frame in the middle of the stream). Injection uses a
+seeded random generator, so a run is reproducible. Signatures are not
+checked; any credentials will do.
+
+    python agent_replay.py --port 8089 --recording captures/*.eventstream \\
+        --frame-delay-ms 40 --throttle-rate 0.1 --seed 7
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import itertools
+import json
+import random
+import re
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from eventstream import CONTENT_TYPE, EventStreamDecoder, agent_event, encode_agent_event, encode_chunk, encode_message, text_decoder
+
+
+AGENT_PATH_RE = re.compile(r"^/agents/([^/]+)/agentAliases/([^/]+)/sessions/([^/]+)/text$")
+DEFAULT_PORT = 8089
+
+_PRELUDE = struct.Struct(">I")
+
+
+def split_frames(data: bytes) -> List[bytes]:
+    """Raw frames of a recorded stream, verified but not re-encoded."""
+
+    frames: List[bytes] = []
+    offset = 0
+    decoder = EventStreamDecoder()
+    while offset < len(data):
+        (length,) = _PRELUDE.unpack_from(data, offset)
+        frame = data[offset:offset + length]
+        decoder.feed(frame)
+        frames.append(frame)
+        offset += length
+    decoder.close()
+    return frames
+
+
+def synthetic_stream(question: str, *, sql: Optional[str] = None, answer: Optional[str] = None,
+                     answer_chunks: int = 3) -> List[bytes]:
+    """Frames shaped like a real traced answer: pre-processing, one query, the answer."""
+
+    sql = sql or "SELECT COUNT(*) FROM test_population"
+    answer = answer or f"Replayed answer to: {question}"
+
+    def trace(phase: str, body: Dict[str, Any]) -> bytes:
+        return encode_agent_event("trace", {"agentId": "REPLAY", "sessionId": "replay", "trace": {phase: body}})
+
+    usage = {"metadata": {"usage": {"inputTokens": 1200, "outputTokens": 80}}}
+    frames = [
+        trace("preProcessingTrace", {"modelInvocationInput": {"traceId": "pre-0"}}),
+        trace("preProcessingTrace", {"modelInvocationOutput": {"traceId": "pre-0", **usage}}),
+        trace("orchestrationTrace", {"modelInvocationInput": {"traceId": "orc-0"}}),
+        trace("orchestrationTrace", {"modelInvocationOutput": {"traceId": "orc-0", **usage}}),
+        trace("orchestrationTrace", {"rationale": {"traceId": "orc-0", "text": f"Query the table to answer: {question}"}}),
+        trace("orchestrationTrace", {"invocationInput": {"traceId": "orc-0", "actionGroupInvocationInput": {
+            "apiPath": "/athenaQuery", "requestBody": {"content": {"application/json": [
+                {"name": "query", "type": "string", "value": sql}]}}}}}),
+        trace("orchestrationTrace", {"observation": {"traceId": "orc-0", "actionGroupInvocationOutput": {
+            "text": json.dumps({"ResultSet": {"Rows": [{"Data": [{"VarCharValue": "_col0"}]}, {"Data": [{"VarCharValue": "42"}]}]}})}}}),
+        trace("orchestrationTrace", {"modelInvocationInput": {"traceId": "orc-1"}}),
+        trace("orchestrationTrace", {"modelInvocationOutput": {"traceId": "orc-1", **usage}}),
+        trace("orchestrationTrace", {"observation": {"traceId": "orc-1", "type": "FINISH", "finalResponse": {"text": answer}}}),
+    ]
+    size = max(1, -(-len(answer) // answer_chunks))
+    frames += [encode_chunk(answer[i:i + size]) for i in range(0, len(answer), size)]
+    return frames
+
+
+def exception_frame(exception_type: str = "throttlingException", message: str = "Rate exceeded") -> bytes:
+    return encode_message(
+        {":message-type": "exception", ":exception-type": exception_type, ":content-type": "application/json"},
+        json.dumps({"message": message}).encode("utf-8"),
+    )
+
+
+@dataclass
+class Plan:
+    """What one request gets: an HTTP error, or frames with timing."""
+
+    status: int = 200
+    error_type: str = ""
+    retry_after: Optional[float] = None
+    frames: List[bytes] = field(default_factory=list)
+    first_byte_delay: float = 0.0
+    frame_delay: float = 0.0
+    chunk_bytes: int = 0
+
+
+@dataclass
+class Scenario:
+    """Which stream to replay per request and which failures to inject."""
+
+    recordings: List[List[bytes]] = field(default_factory=list)
+    first_byte_delay_ms: float = 0.0
+    frame_delay_ms: float = 0.0
+    frame_jitter_ms: float = 0.0
+    chunk_bytes: int = 0
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    stream_throttle_rate: float = 0.0
+    retry_after: Optional[float] = 1.0
+    seed: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+
+    @classmethod
+    def synthetic(cls, **options: Any) -> "Scenario":
+        return cls(**options)
+
+    @classmethod
+    def from_files(cls, paths: List[Path], **options: Any) -> "Scenario":
+        return cls(recordings=[split_frames(Path(p).read_bytes()) for p in paths], **options)
+
+    def plan(self, question: str) -> Plan:
+        with self._lock:
+            roll, stream_roll, jitter_seed = self._rng.random(), self._rng.random(), self._rng.random()
+            index = next(self._next)
+        if roll < self.throttle_rate:
+            return Plan(status=429, error_type="ThrottlingException", retry_after=self.retry_after)
+        if roll < self.throttle_rate + self.error_rate:
+            return Plan(status=500, error_type="InternalServerException")
+        frames = list(self.recordings[index % len(self.recordings)]) if self.recordings else synthetic_stream(question)
+        if stream_roll < self.stream_throttle_rate:
+            frames = frames[: max(1, len(frames) // 2)] + [exception_frame()]
+        jitter = (jitter_seed * 2 - 1) * self.frame_jitter_ms
+        return Plan(
+            frames=frames,
+            first_byte_delay=self.first_byte_delay_ms / 1000,
+            frame_delay=max(0.0, self.frame_delay_ms + jitter) / 1000,
+            chunk_bytes=self.chunk_bytes,
+        )
+
+
+def plan_chunks(plan: Plan) -> Iterator[bytes]:
+    """The plan's bytes as network chunks, sleeping as the plan says."""
+
+    time.sleep(plan.first_byte_delay)
+    for number, frame in enumerate(plan.frames):
+        if number and plan.frame_delay:
+            time.sleep(plan.frame_delay)
+        size = plan.chunk_bytes or len(frame)
+        for offset in range(0, len(frame), size):
+            yield frame[offset:offset + size]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "ReplayServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_error(self, status: int, error_type: str, message: str, retry_after: Optional[float] = None) -> None:
+        body = json.dumps({"message": message}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("x-amzn-ErrorType", error_type)
+        if retry_after is not None:
+            self.send_header("Retry-After", f"{retry_after:g}")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("content-length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        match = AGENT_PATH_RE.match(self.path.split("?")[0])
+        if not match:
+            self._send_error(404, "ResourceNotFoundException", f"No route for {self.path}")
+            return
+        agent_id, alias_id, session_id = match.groups()
+        question = body.get("inputText", "")
+        self.server.record({"agent_id": agent_id, "alias_id": alias_id, "session_id": session_id, "body": body})
+
+        plan = self.server.scenario.plan(question)
+        if plan.status != 200:
+            self._send_error(plan.status, plan.error_type, "Injected failure", plan.retry_after)
+            return
+        self.send_response(200)
+        self.send_header("content-type", CONTENT_TYPE)
+        self.send_header("x-amzn-bedrock-agent-session-id", session_id)
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in plan_chunks(plan):
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up, e.g. the losing side of a hedged request
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Threaded HTTP server for one ``Scenario``; ``requests`` lists what it received."""
+
+    daemon_threads = True
+
+    def __init__(self, scenario: Scenario, host: str = "127.0.0.1", port: int = 0, verbose: bool = False) -> None:
+        super().__init__((host, port), _Handler)
+        self.scenario = scenario
+        self.verbose = verbose
+        self.requests: List[Dict[str, Any]] = []
+        self._requests_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, request: Dict[str, Any]) -> None:
+        with self._requests_lock:
+            self.requests.append(request)
+
+    def start(self) -> "ReplayServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="agent-replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "ReplayServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+class StubAgentRuntimeClient:
+    """Drop-in for ``boto3.client("bedrock-agent-runtime")`` that only implements ``invoke_agent``.
+
+    Errors are raised the way botocore raises them: ``ClientError`` for
+    injected HTTP failures, ``EventStreamError`` while iterating for an
+    exception frame.
+    """
+
+    def __init__(self, scenario: Scenario, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.scenario = scenario
+        self.sleep = sleep
+        self.calls: List[Dict[str, Any]] = []
+
+    def invoke_agent(self, *, agentId: str, agentAliasId: str, sessionId: str, inputText: str = "",
+                     enableTrace: bool = False, endSession: bool = False, **kwargs: Any) -> Dict[str, Any]:
+        from botocore.exceptions import ClientError
+
+        self.calls.append({"agentId": agentId, "agentAliasId": agentAliasId, "sessionId": sessionId,
+                           "inputText": inputText, "enableTrace": enableTrace, "endSession": endSession, **kwargs})
+        plan = self.scenario.plan(inputText)
+        if plan.status != 200:
+            raise ClientError(
+                {"Error": {"Code": plan.error_type, "Message": "Injected failure"},
+                 "ResponseMetadata": {"HTTPStatusCode": plan.status,
+                                      "HTTPHeaders": {"retry-after": f"{plan.retry_after:g}"} if plan.retry_after else {}}},
+                "InvokeAgent",
+            )
+        return {
+            "completion": self._completion(plan, enableTrace),
+            "contentType": CONTENT_TYPE,
+            "sessionId": sessionId,
+        }
+
+    def _completion(self, plan: Plan, enable_trace: bool) -> Iterator[Dict[str, Any]]:
+        from botocore.exceptions import EventStreamError as BotocoreEventStreamError
+
+        self.sleep(plan.first_byte_delay)
+        decoder = EventStreamDecoder()
+        text = text_decoder()
+        for number, frame in enumerate(plan.frames):
+            if number and plan.frame_delay:
+                self.sleep(plan.frame_delay)
+            for message in decoder.feed(frame):
+                if message.headers.get(":message-type") == "exception":
+                    error_code = message.headers.get(":exception-type", "")
+                    detail = json.loads(message.payload or b"{}")
+                    raise BotocoreEventStreamError(
+                        {"Error": {"Code": error_code, "Message": detail.get("message", "")}}, "InvokeAgent"
+                    )
+                event = agent_event(message, text)
+                if event.type == "chunk":
+                    # boto3 hands out the decoded bytes, not the base64 text
+                    yield {"chunk": {**event.data, "bytes": base64.b64decode(event.data.get("bytes", ""))}}
+                elif event.type != "trace" or enable_trace:
+                    yield {event.type: event.data}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay agent event streams on a local InvokeAgent endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--recording", type=Path, nargs="*", default=[],
+                        help="Recorded .eventstream files, replayed round-robin (default: synthetic answers)")
+    parser.add_argument("--first-byte-delay-ms", type=float, default=0.0)
+    parser.add_argument("--frame-delay-ms", type=float, default=0.0)
+    parser.add_argument("--frame-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--chunk-bytes", type=int, default=0, help="Split frames into network chunks of this size")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--stream-throttle-rate", type=float, default=0.0,
+                        help="Fraction of streams cut off by a throttlingException frame")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    options = dict(
+        first_byte_delay_ms=args.first_byte_delay_ms,
+        frame_delay_ms=args.frame_delay_ms,
+        frame_jitter_ms=args.frame_jitter_ms,
+        chunk_bytes=args.chunk_bytes,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        stream_throttle_rate=args.stream_throttle_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    scenario = Scenario.from_files(args.recording, **options) if args.recording else Scenario.synthetic(**options)
+    server = ReplayServer(scenario, args.host, args.port, verbose=args.verbose)
+    print(f"Replaying on {server.url} (set AGENT_ENDPOINT_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
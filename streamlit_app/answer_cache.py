@@ -0,0 +1,216 @@
+"""Cache of agent answers keyed by a normalized form of the question.
+
+The same questions come back all the time: the example prompts on the page,
+and small rephrasings of them ("How many records are there?" / "how many
+records are there"). Each one otherwise costs a full agent orchestration and
+an Athena query.
+
+``normalize_question`` lowercases, drops punctuation and filler words
+("please", "the", "can you", ...) and canonicalizes numbers ("five", "5.0"
+and "5" are the same; "1,000" is "1000"), so those variants share a key.
+Keys also include the agent and alias id, so a new agent version never serves
+old answers. They do not include the conversation, so callers only look up
+and store the first question of a session; a follow-up such as "and last
+year?" means something different in every conversation.
+
+Entries live in a backend: ``LocalBackend`` is an in-process LRU bounded by
+entry count; ``DynamoDBBackend`` shares entries between App Runner instances
+(items expire via the table's TTL attribute ``expires_at``; the stored trace
+is cut to ``DEFAULT_MAX_TRACE_BYTES`` to stay under DynamoDB's 400 KB item
+limit). Every entry has a TTL either way. ``AnswerCache`` keeps hit/miss counters and the agent time
+saved by hits.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from trace_collector import trace as trace_event
+
+
+DEFAULT_TTL_SECONDS = 3600.0
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_TRACE_BYTES = 300_000
+DYNAMODB_MAX_ITEM_BYTES = 400_000
+TRACE_TRUNCATED = "\n[trace truncated]"
+
+_FILLER_WORDS = frozenset(
+    "a an the please pls kindly can could would will you me i us we tell just".split()
+)
+_NUMBER_WORDS = {
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+    "eleven": "11", "twelve": "12", "twenty": "20", "fifty": "50", "hundred": "100",
+}
+_THOUSANDS_RE = re.compile(r"(?<=\d),(?=\d{3}\b)")
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?|[a-z0-9_]+")
+
+
+def _canonical_number(token: str) -> str:
+    if token in _NUMBER_WORDS:
+        return _NUMBER_WORDS[token]
+    if token[0].isdigit():
+        value = float(token)
+        return str(int(value)) if value.is_integer() else repr(value)
+    return token
+
+
+def normalize_question(question: str) -> str:
+    text = _THOUSANDS_RE.sub("", question.lower())
+    tokens = [_canonical_number(token) for token in _TOKEN_RE.findall(text)]
+    return " ".join(token for token in tokens if token not in _FILLER_WORDS)
+
+
+def cache_key(agent_id: str, alias_id: str, question: str) -> str:
+    raw = f"{agent_id}\x1f{alias_id}\x1f{normalize_question(question)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LocalBackend:
+    """Thread-safe in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class DynamoDBBackend:
+    """Shared backend on a DynamoDB table with partition key ``cache_key``.
+
+    Enable TTL on the ``expires_at`` attribute; reads also ignore expired
+    items because TTL deletion is lazy. Traces longer than
+    ``max_trace_bytes`` (UTF-8) are truncated; an entry that is still too big
+    for an item raises ``ValueError``.
+    """
+
+    def __init__(self, table_name: str, region: Optional[str] = None,
+                 max_trace_bytes: int = DEFAULT_MAX_TRACE_BYTES) -> None:
+        import boto3
+
+        self.table = boto3.resource("dynamodb", region_name=region).Table(table_name)
+        self.max_trace_bytes = max_trace_bytes
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self.table.get_item(Key={"cache_key": key}).get("Item")
+        if not item or int(item.get("expires_at", 0)) < time.time():
+            return None
+        return json.loads(item["value"])
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        trace_bytes = (value.get("trace") or "").encode("utf-8")
+        if len(trace_bytes) > self.max_trace_bytes:
+            kept = trace_bytes[:self.max_trace_bytes].decode("utf-8", errors="ignore")
+            value = dict(value, trace=kept + TRACE_TRUNCATED)
+        encoded = json.dumps(value, ensure_ascii=False)
+        # Leave room for the key and the other attributes.
+        if len(encoded.encode("utf-8")) > DYNAMODB_MAX_ITEM_BYTES - 1_000:
+            raise ValueError(f"entry of {len(encoded.encode('utf-8'))} bytes is too big for a DynamoDB item")
+        self.table.put_item(
+            Item={
+                "cache_key": key,
+                "expires_at": int(time.time() + ttl),
+                "value": encoded,
+            }
+        )
+
+    def clear(self) -> None:
+        kwargs = {"ProjectionExpression": "cache_key"}
+        with self.table.batch_writer() as batch:
+            while True:
+                page = self.table.scan(**kwargs)
+                for item in page.get("Items", []):
+                    batch.delete_item(Key={"cache_key": item["cache_key"]})
+                if "LastEvaluatedKey" not in page:
+                    return
+                kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+
+class AnswerCache:
+    def __init__(self, backend=None, ttl: float = DEFAULT_TTL_SECONDS, enabled: bool = True) -> None:
+        self.backend = backend or LocalBackend()
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, agent_id: str, alias_id: str, question: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        try:
+            entry = self.backend.get(cache_key(agent_id, alias_id, question))
+        except Exception as e:
+            trace_event("warning", f"Answer cache lookup failed: {e}")
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_seconds += float(entry.get("latency_s") or 0.0)
+        if entry is not None:
+            trace_event(
+                "cache",
+                f"Answer cache hit for '{question[:80]}' (hit rate {self.hit_rate():.0%}, "
+                f"saved {entry.get('latency_s', 0):.1f}s, {self.saved_seconds:.1f}s in total)"
+            )
+        return entry
+
+    def put(self, agent_id: str, alias_id: str, question: str, answer: str,
+            trace: str = "", latency_s: float = 0.0) -> None:
+        if not self.enabled:
+            return
+        value = {
+            "question": question,
+            "answer": answer,
+            "trace": trace,
+            "latency_s": round(latency_s, 3),
+            "cached_at": time.time(),
+        }
+        try:
+            self.backend.set(cache_key(agent_id, alias_id, question), value, self.ttl)
+        except Exception as e:
+            trace_event("warning", f"Answer cache store failed: {e}")
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 3),
+            "saved_seconds": round(self.saved_seconds, 1),
+        }
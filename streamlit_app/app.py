@@ -1,23 +1,21 @@
 import invoke_agent as agenthelper
+from agent_jobs import DEFAULT_MAX_QUEUED, DEFAULT_MAX_WORKERS, AgentJob, JobPool, PoolSaturated
+from athena_export import DEFAULT_CHUNK_ROWS, FORMATS, AthenaExporter
+from chat_history import DEFAULT_PAGE_SIZE, HUMAN_AVATAR, ROBOT_AVATAR, avatar_png, new_entry, page
+from session_manager import DEFAULT_IDLE_TIMEOUT, DynamoDBSessionRegistry, SessionManager
+from trace_collector import TraceCollector, collecting
+from trace_timeline import timeline_from_collector
 import streamlit as st
 import json
 import pandas as pd
-from PIL import Image, ImageOps, ImageDraw
 import traceback
 import sys
+import os
+import time
 
 # Streamlit page configuration
 st.set_page_config(page_title="Text2SQL Agent", page_icon=":robot_face:", layout="wide")
 
-# Function to crop image into a circle
-def crop_to_circle(image):
-    mask = Image.new('L', image.size, 0)
-    mask_draw = ImageDraw.Draw(mask)
-    mask_draw.ellipse((0, 0) + image.size, fill=255)
-    result = ImageOps.fit(image, mask.size, centering=(0.5, 0.5))
-    result.putalpha(mask)
-    return result
-
 # Title
 st.title("Text2SQL Agent - Amazon Athena")
 
@@ -33,6 +31,7 @@ end_session_button = st.button("End Session")
 
 # Sidebar for user input
 st.sidebar.title("Trace Data")
+bypass_cache = st.sidebar.checkbox("Bypass answer cache", value=False)
 
 
 
@@ -41,6 +40,81 @@ st.sidebar.title("Trace Data")
 if 'history' not in st.session_state:
     st.session_state['history'] = []
 
+# Only the newest turns are drawn; "Load more" reveals older ones
+history_page_size = int(os.environ.get("HISTORY_PAGE_SIZE", DEFAULT_PAGE_SIZE))
+if 'history_visible' not in st.session_state:
+    st.session_state['history_visible'] = history_page_size
+
+
+def add_to_history(question, answer, tables=None):
+    st.session_state['history'].append(new_entry(question, answer, tables))
+
+
+# Query results captured from the trace (see result_tables.py) are shown as
+# tables, RESULT_PAGE_SIZE rows at a time
+result_page_size = int(os.environ.get("RESULT_PAGE_SIZE", "200"))
+
+
+def show_table(result, key):
+    """A query result as a sortable table, one page at a time."""
+    frame = result.frame
+    pages = max(1, -(-len(frame) // result_page_size))
+    caption = f"{result.row_count} row(s)"
+    if pages > 1:
+        number = st.number_input("Page", min_value=1, max_value=pages, value=1, key=f"{key}-page")
+        start = (number - 1) * result_page_size
+        frame = frame.iloc[start:start + result_page_size]
+        caption += f", page {number} of {pages}"
+    st.dataframe(frame, use_container_width=True, hide_index=True)
+    st.caption(caption)
+    if result.query_execution_id:
+        show_export(result, key)
+
+
+@st.cache_resource
+def get_exporter():
+    return AthenaExporter(
+        agenthelper.theRegion,
+        export_location=os.environ.get("ATHENA_EXPORT_LOCATION"),
+        chunk_rows=int(os.environ.get("EXPORT_CHUNK_ROWS", DEFAULT_CHUNK_ROWS)),
+    )
+
+
+def show_export(result, key):
+    """Download the query's full result from its Athena output file, without the agent."""
+    fmt = st.selectbox("Export format", FORMATS, key=f"{key}-format")
+    if st.button("Export full result", key=f"{key}-export"):
+        try:
+            with st.spinner(f"Preparing the {fmt.upper()} export..."):
+                url = get_exporter().export(result.query_execution_id, fmt)
+            st.session_state[f"{key}-export-url"] = (fmt, url, time.time())
+        except Exception as e:
+            print(traceback.format_exc(), file=sys.stderr)
+            st.error(f"❌ Export failed ({type(e).__name__}): {e}")
+    exported = st.session_state.get(f"{key}-export-url")
+    # Presigned links expire; offer the button again instead of a dead link
+    if exported and time.time() - exported[2] < get_exporter().url_expiry - 60:
+        st.link_button(f"Download {exported[0].upper()}", exported[1])
+
+
+@st.cache_resource
+def get_session_manager():
+    """One manager per process; every browser session gets its own agent session."""
+    table = os.environ.get("AGENT_SESSION_TABLE")
+    return SessionManager(
+        agenthelper.end_agent_session,
+        idle_timeout=float(os.environ.get("AGENT_SESSION_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT)),
+        registry=DynamoDBSessionRegistry(table, agenthelper.theRegion, os.environ.get("HOSTNAME", "")) if table else None,
+    )
+
+
+@st.cache_data(ttl=30)
+def total_active_sessions():
+    return get_session_manager().registry_count()
+
+
+session_manager = get_session_manager()
+
 # Function to parse and format response
 def format_response(response_body):
     # Handle None or empty input
@@ -76,8 +150,145 @@ def format_response(response_body):
 
 
 
+# Stream the answer as it is generated (set STREAM_ANSWERS=off for the
+# previous request/response flow through lambda_handler). Agent calls run on
+# a bounded worker pool (see agent_jobs.py); a fragment polls the job every
+# JOB_POLL_INTERVAL seconds.
+stream_answers = os.environ.get("STREAM_ANSWERS", "on").lower() in ("1", "on", "true")
+poll_interval = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))
+
+
+@st.cache_resource
+def get_job_pool():
+    return JobPool(
+        agenthelper.run_job,
+        max_workers=int(os.environ.get("AGENT_WORKERS", DEFAULT_MAX_WORKERS)),
+        max_queued=int(os.environ.get("AGENT_QUEUE", DEFAULT_MAX_QUEUED)),
+        on_cancel=agenthelper.cancel_job_queries,
+    )
+
+
+job_pool = get_job_pool()
+
+
+def show_job_progress(job):
+    """Steps so far, the partial answer and a Cancel button for a running job."""
+    with st.status(job.label, expanded=False):
+        for label, detail in list(job.steps):
+            st.write(f"**{label}**")
+            if detail and label.startswith("Calling"):
+                st.code(detail, language="sql")
+            elif detail:
+                st.caption(detail[:500])
+    st.markdown(job.text or "...")
+    if st.button("Cancel", key=f"cancel-{job.id}"):
+        job_pool.cancel(job)
+
+
+def finish_job(job):
+    """Show a finished job's outcome and move it into the history.
+
+    Result tables are drawn only with the history entry, so their widgets
+    keep the same keys on every rerun.
+    """
+    if job.state == AgentJob.DONE:
+        answer = job.text or "No response received from agent"
+        st.markdown(answer)
+        first_output = f" (first output after {job.first_output:.1f}s)" if job.first_output is not None else ""
+        st.caption(f"Done in {job.elapsed():.1f}s{first_output}")
+        with st.expander("Timeline"):
+            show_timeline(timeline_from_collector(job.collector, finished=time.time() - job.collector.started))
+    elif job.state == AgentJob.CANCELLED:
+        answer = (job.text + "\n\n" if job.text else "") + "(cancelled)"
+        st.warning(f"Cancelled after {job.elapsed():.1f}s")
+    else:
+        answer = f"Error occurred: {job.error}"
+        st.error(f"❌ Error ({job.error})")
+    st.sidebar.text_area("", value=job.collector.render() or "...", height=300)
+    # A hedged first question may have been answered in another session.
+    session_manager.adopt(st.session_state, job.session_id)
+    add_to_history(job.question, answer, job.results.results)
+    st.session_state['trace_data'] = answer
+
+
+def show_timeline(timeline):
+    """Waterfall of the agent's steps plus a JSON export."""
+    import altair as alt
+
+    st.caption(
+        f"LLM {timeline['llm_ms'] / 1000:.1f}s ({timeline['input_tokens']} in / {timeline['output_tokens']} out tokens) · "
+        f"actions {timeline['action_ms'] / 1000:.1f}s · other {timeline['other_ms'] / 1000:.1f}s · "
+        f"total {timeline['total_ms'] / 1000:.1f}s"
+    )
+    if timeline["steps"]:
+        steps = pd.DataFrame(timeline["steps"])
+        steps["step"] = [f"{i + 1:02d} {label}" for i, label in enumerate(steps["label"])]
+        tooltip = [c for c in ("step", "duration_ms", "input_tokens", "output_tokens", "detail") if c in steps]
+        chart = alt.Chart(steps).mark_bar().encode(
+            x=alt.X("start_ms:Q", title="ms since request"),
+            x2="end_ms:Q",
+            y=alt.Y("step:N", sort=None, title=None),
+            color=alt.Color("kind:N", title=None),
+            tooltip=tooltip,
+        )
+        st.altair_chart(chart, use_container_width=True)
+    st.download_button(
+        "Download timeline (JSON)",
+        data=json.dumps(timeline, indent=2),
+        file_name="agent-timeline.json",
+        mime="application/json",
+    )
+
+
 # Handling user input and responses
-if submit_button and prompt:
+job = st.session_state.get('job')
+if submit_button and prompt and stream_answers and job is not None and job.active:
+    st.warning("Your previous question is still running. Wait for it or cancel it first.")
+
+elif submit_button and prompt and stream_answers:
+    collector = TraceCollector()
+    answer = None
+    # Only the first question of a conversation can be answered from the cache
+    # or a template.
+    first_turn = not st.session_state['history']
+    with collecting(collector):
+        cached = agenthelper.cached_answer(prompt, bypass=bypass_cache, first_turn=first_turn)
+    try:
+        if cached:
+            answer = cached["answer"]
+            st.write(answer)
+            st.caption(f"Answered from cache (the agent originally took {cached['latency_s']:.1f}s)")
+            collector.add("cache", cached.get("trace", ""))
+            st.session_state['served_turn'] = (prompt, answer)
+        else:
+            started = time.perf_counter()
+            with collecting(collector):
+                match = agenthelper.match_sql_template(prompt, first_turn=first_turn)
+                answer = agenthelper.template_answer(prompt, match) if match else None
+            if answer is not None:
+                st.markdown(answer)
+                st.caption(f"Answered from a saved query template in {time.perf_counter() - started:.1f}s, without the agent")
+                st.session_state['served_turn'] = (prompt, answer)
+            else:
+                session_id = session_manager.session_for(st.session_state)
+                st.session_state['job'] = job_pool.submit(prompt, session_id, {
+                    "template_match": match,
+                    "first_turn": first_turn,
+                    "previous": st.session_state.pop('served_turn', None),
+                })
+    except PoolSaturated as e:
+        print(f"Question rejected: {e}", file=sys.stderr)
+        st.error(f"⏳ The app is busy right now ({e}). Please try again in a moment.")
+    except Exception as e:
+        print(traceback.format_exc(), file=sys.stderr)
+        st.error(f"❌ Error ({type(e).__name__}): {e}")
+        answer = f"Error occurred: {e}"
+    if answer is not None:
+        st.sidebar.text_area("", value=collector.render() or "...", height=300)
+        add_to_history(prompt, answer)
+        st.session_state['trace_data'] = answer
+
+elif submit_button and prompt:
     # Wrap everything in a try-except to catch ALL errors
     try:
         # Initialize variables
@@ -89,9 +300,14 @@ if submit_button and prompt:
         st.write(f"📝 Question: {prompt}")
         
         event = {
-            "sessionId": "MYSESSION",
-            "question": prompt
+            "sessionId": session_manager.session_for(st.session_state),
+            "question": prompt,
+            "bypassCache": bypass_cache,
+            "newSession": not st.session_state['history'],
         }
+        served_turn = st.session_state.pop('served_turn', None)
+        if served_turn:
+            event["previousQuestion"], event["previousAnswer"] = served_turn
         
         # Log to stderr for server logs
         print("=" * 50, file=sys.stderr)
@@ -191,6 +407,10 @@ if submit_button and prompt:
                 if 'response' in response_data and 'trace_data' in response_data:
                     all_data = format_response(response_data['response'])
                     the_response = response_data['trace_data']
+                    if response_data.get('answered_by') in ('cache', 'template'):
+                        st.session_state['served_turn'] = (prompt, the_response)
+                    if response_data.get('session_id'):
+                        session_manager.adopt(st.session_state, response_data['session_id'])
                 elif 'error' in response_data:
                     all_data = "..."
                     the_response = f"Error: {response_data['error']}"
@@ -206,7 +426,7 @@ if submit_button and prompt:
 
         # Use trace_data and formatted_response as needed
         st.sidebar.text_area("", value=all_data, height=300)
-        st.session_state['history'].append({"question": prompt, "answer": the_response})
+        add_to_history(prompt, the_response)
         st.session_state['trace_data'] = the_response
         
     except json.JSONDecodeError as e:
@@ -222,10 +442,7 @@ if submit_button and prompt:
         st.write(f"- Error position: line {e.lineno if hasattr(e, 'lineno') else 'N/A'}, column {e.colno if hasattr(e, 'colno') else 'N/A'}")
         st.write(f"- Response was: {response}")
         # Still add to history so user knows something happened
-        st.session_state['history'].append({
-            "question": prompt, 
-            "answer": f"JSON parsing error: {error_msg}"
-        })
+        add_to_history(prompt, f"JSON parsing error: {error_msg}")
     except Exception as e:
         # Catch ANY other error that might occur
         error_msg = f"Unexpected error: {str(e)}"
@@ -237,55 +454,90 @@ if submit_button and prompt:
         st.write("**Full Traceback:**")
         st.code(traceback.format_exc())
         # Still add to history so user knows something happened
-        st.session_state['history'].append({
-            "question": prompt, 
-            "answer": f"Error occurred: {error_msg}"
-        })
+        add_to_history(prompt, f"Error occurred: {error_msg}")
 
     
     
 
+@st.fragment(run_every=poll_interval)
+def poll_job():
+    """Redraw a running job's progress without rerunning the whole page."""
+    job = st.session_state.get('job')
+    if job is None or not job.active:
+        # Finished: rerun the page so the answer moves into the history.
+        st.rerun()
+    show_job_progress(job)
+
+
+job = st.session_state.get('job')
+if job is not None and job.active:
+    poll_job()
+elif job is not None:
+    del st.session_state['job']
+    finish_job(job)
+
+
 if end_session_button:
-    st.session_state['history'].append({"question": "Session Ended", "answer": "Thank you for using AnyCompany Support Agent!"})
-    event = {
-        "sessionId": "MYSESSION",
-        "question": "placeholder to end session",
-        "endSession": True
-    }
-    agenthelper.lambda_handler(event, None)
+    active_job = st.session_state.pop('job', None)
+    if active_job is not None:
+        job_pool.cancel(active_job)
+        session_manager.adopt(st.session_state, active_job.session_id)
+    session_manager.release(st.session_state)
+    st.session_state.pop('served_turn', None)
     st.session_state['history'].clear()
+    st.session_state['history_visible'] = history_page_size
+
+
+active_sessions = total_active_sessions()
+st.sidebar.caption(
+    f"Agent sessions: {session_manager.active_count()} on this instance"
+    + (f", {active_sessions} in total" if active_sessions is not None else "")
+)
+pool_stats = job_pool.stats()
+st.sidebar.caption(
+    f"Workers: {pool_stats['running']}/{pool_stats['workers']} busy, {pool_stats['queued']} queued"
+)
+if job_pool.saturated():
+    st.sidebar.warning("All agent workers are busy; new questions wait in the queue.")
 
 
 # Display conversation history
 st.write("## Conversation History")
 
-for chat in reversed(st.session_state['history']):
-    
+render_started = time.perf_counter()
+shown, hidden = page(st.session_state['history'], st.session_state['history_visible'])
+for chat in shown:
+
     # Creating columns for Question
     col1_q, col2_q = st.columns([2, 10])
     with col1_q:
-        human_image = Image.open('/home/ubuntu/app/streamlit_app/human_face.png')
-        circular_human_image = crop_to_circle(human_image)
-        st.image(circular_human_image, width=125)
+        st.image(avatar_png(HUMAN_AVATAR), width=125)
     with col2_q:
-        st.text_area("Q:", value=chat["question"], height=50, key=str(chat)+"q", disabled=True)
+        st.text_area("Q:", value=chat["question"], height=50, key=f"{chat['id']}-q", disabled=True)
 
     # Creating columns for Answer
     col1_a, col2_a = st.columns([2, 10])
     if isinstance(chat["answer"], pd.DataFrame):
         with col1_a:
-            robot_image = Image.open('/home/ubuntu/app/streamlit_app/robot_face.jpg')
-            circular_robot_image = crop_to_circle(robot_image)
-            st.image(circular_robot_image, width=100)
+            st.image(avatar_png(ROBOT_AVATAR), width=100)
         with col2_a:
             st.dataframe(chat["answer"])
     else:
         with col1_a:
-            robot_image = Image.open('/home/ubuntu/app/streamlit_app/robot_face.jpg')
-            circular_robot_image = crop_to_circle(robot_image)
-            st.image(circular_robot_image, width=150)
+            st.image(avatar_png(ROBOT_AVATAR), width=150)
         with col2_a:
-            st.text_area("A:", value=chat["answer"], height=100, key=str(chat)+"a")
+            st.text_area("A:", value=chat["answer"], height=100, key=f"{chat['id']}-a")
+            for i, result in enumerate(chat.get("tables", [])):
+                show_table(result, f"{chat['id']}-t{i}")
+
+if hidden and st.button(f"Load more ({hidden} older)", key="history-load-more"):
+    st.session_state['history_visible'] += history_page_size
+    st.rerun()
+
+render_ms = (time.perf_counter() - render_started) * 1000
+st.sidebar.caption(f"History: {len(shown)} of {len(st.session_state['history'])} turns drawn in {render_ms:.0f} ms")
+if render_ms > 500:
+    print(f"Slow history render: {len(shown)} turns in {render_ms:.0f} ms", file=sys.stderr)
 
 
 # Example Prompts Section
@@ -312,3 +564,4 @@ queries_df = pd.DataFrame(query_data)
 # Display the DataFrame in Streamlit
 st.write("## Test Prompts for Amazon Athena")
 st.dataframe(queries_df, width=900)  # Adjust the width to fit your layout
+
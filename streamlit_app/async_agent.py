@@ -0,0 +1,206 @@
+"""asyncio client for running many agent questions concurrently.
+
+``AsyncAgentClient`` signs ``InvokeAgent`` requests with SigV4 (credentials
+re-resolved per request, so long runs survive token refresh), sends them over
+one pooled ``aiohttp`` session and decodes the response with the incremental
+event-stream decoder while it arrives. ``run_questions`` runs a question set
+under a concurrency limit: every question gets its own agent session unless
+several share a ``session`` key, in which case they run in order within that
+session so follow-up questions see their context. Each session is ended
+(``endSession``) after its last question, as ``end_agent_session`` does for
+the app.
+
+``aiohttp`` is only needed here; it is listed in ``scripts/requirements.txt``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from boto3.session import Session
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+from eventstream import EventStreamDecoder, agent_event, text_decoder
+from trace_timeline import build_timeline
+
+
+DEFAULT_CONCURRENCY = 20
+
+
+@dataclass
+class QuestionResult:
+    id: str
+    question: str
+    session_id: str
+    status: str = "ok"
+    answer: str = ""
+    error: Optional[str] = None
+    http_status: Optional[int] = None
+    latency_s: float = 0.0
+    first_byte_s: Optional[float] = None
+    first_chunk_s: Optional[float] = None
+    trace_events: int = 0
+    timeline: Dict[str, Any] = field(default_factory=dict)
+    sql: List[str] = field(default_factory=list)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+
+class AsyncAgentClient:
+    """Signs and streams ``InvokeAgent`` calls on one ``aiohttp`` session."""
+
+    def __init__(
+        self,
+        agent_id: str,
+        agent_alias_id: str,
+        region: str,
+        *,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 300.0,
+        boto_session: Optional[Session] = None,
+        request_attributes: Optional[Callable[[str], Dict[str, Any]]] = None,
+        endpoint_url: Optional[str] = None,
+    ) -> None:
+        import aiohttp
+
+        self.agent_id = agent_id
+        self.agent_alias_id = agent_alias_id
+        self.region = region
+        self.request_attributes = request_attributes
+        self.endpoint_url = (endpoint_url or f"https://bedrock-agent-runtime.{region}.amazonaws.com").rstrip("/")
+        self._credentials = (boto_session or Session(region_name=region)).get_credentials()
+        if self._credentials is None:
+            raise RuntimeError("No AWS credentials found")
+        self._http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout),
+        )
+
+    async def __aenter__(self) -> "AsyncAgentClient":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self._http.close()
+
+    def _url(self, session_id: str) -> str:
+        return (
+            f"{self.endpoint_url}/agents/{self.agent_id}"
+            f"/agentAliases/{self.agent_alias_id}/sessions/{session_id}/text"
+        )
+
+    def _signed_headers(self, url: str, body: str) -> Dict[str, str]:
+        req = AWSRequest(
+            method="POST",
+            url=url,
+            data=body,
+            headers={"content-type": "application/json", "accept": "application/json"},
+        )
+        SigV4Auth(self._credentials.get_frozen_credentials(), "bedrock", self.region).add_auth(req)
+        return dict(req.headers)
+
+    async def ask(self, question: str, session_id: str, question_id: str = "") -> QuestionResult:
+        result = QuestionResult(id=question_id, question=question, session_id=session_id)
+        body: Dict[str, Any] = {"inputText": question, "enableTrace": True, "endSession": False}
+        if self.request_attributes:
+            body.update(self.request_attributes(question))
+        payload = json.dumps(body)
+        url = self._url(session_id)
+
+        started = time.perf_counter()
+        chunks: List[str] = []
+        trace_parts = []
+        try:
+            async with self._http.post(url, data=payload, headers=self._signed_headers(url, payload)) as response:
+                result.http_status = response.status
+                if response.status != 200:
+                    raise RuntimeError(f"HTTP Error {response.status}: {(await response.text())[:500]}")
+                decoder = EventStreamDecoder()
+                text = text_decoder()
+                async for data in response.content.iter_any():
+                    now = time.perf_counter() - started
+                    if result.first_byte_s is None:
+                        result.first_byte_s = round(now, 3)
+                    for message in decoder.feed(data):
+                        event = agent_event(message, text)
+                        if event.type == "chunk":
+                            if result.first_chunk_s is None:
+                                result.first_chunk_s = round(now, 3)
+                            chunks.append(event.text or "")
+                        elif event.type == "trace":
+                            trace_parts.append((now, event.data))
+                decoder.close()
+                text.decode(b"", final=True)
+        except Exception as exc:  # HTTP, decoding, timeouts and aiohttp.ClientError alike
+            result.status = "error"
+            result.error = f"{type(exc).__name__}: {exc}"
+
+        result.latency_s = round(time.perf_counter() - started, 3)
+        result.answer = "".join(chunks)
+        result.trace_events = len(trace_parts)
+        if trace_parts:
+            timeline = build_timeline(trace_parts, started=0.0, finished=result.latency_s)
+            result.sql = [s["detail"] for s in timeline["steps"] if s["kind"] == "action" and s.get("detail")]
+            result.timeline = {k: v for k, v in timeline.items() if k != "steps"}
+        return result
+
+    async def end_session(self, session_id: str) -> bool:
+        """End an agent session so the service drops its memory; True on success."""
+
+        payload = json.dumps({"endSession": True, "enableTrace": False})
+        url = self._url(session_id)
+        try:
+            async with self._http.post(url, data=payload, headers=self._signed_headers(url, payload)) as response:
+                await response.read()
+                return response.status == 200
+        except Exception:
+            return False
+
+
+async def run_questions(
+    client: AsyncAgentClient,
+    questions: List[Dict[str, Any]],
+    *,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    on_result: Optional[Callable[[QuestionResult], Awaitable[None] | None]] = None,
+) -> List[QuestionResult]:
+    """Ask every question; ``{"id", "question", "session"?}`` dicts in, results out."""
+
+    semaphore = asyncio.Semaphore(concurrency)
+    run_id = uuid.uuid4().hex[:8]
+    groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for index, item in enumerate(questions):
+        item.setdefault("id", str(index + 1))
+        groups[str(item.get("session") or f"q{item['id']}")].append(item)
+
+    results: List[QuestionResult] = []
+
+    async def run_group(key: str, items: List[Dict[str, Any]]) -> None:
+        session_id = re.sub(r"[^0-9a-zA-Z._:-]", "-", f"eval-{run_id}-{key}")[:100]
+        for item in items:
+            async with semaphore:
+                result = await client.ask(item["question"], session_id, str(item["id"]))
+            results.append(result)
+            if on_result:
+                outcome = on_result(result)
+                if asyncio.iscoroutine(outcome):
+                    await outcome
+        async with semaphore:
+            await client.end_session(session_id)
+
+    await asyncio.gather(*(run_group(key, items) for key, items in groups.items()))
+    order = {str(item["id"]): index for index, item in enumerate(questions)}
+    results.sort(key=lambda r: order.get(r.id, 0))
+    return results
@@ -0,0 +1,216 @@
+"""Export a query's full result from its Athena output file.
+
+The agent only ever sees the first page of a query's result (one
+``GetQueryResults`` call) and pays for every row it reads or writes back.
+Athena, however, keeps the complete result as a CSV file under the output
+location. The action Lambda returns the query's ``QueryExecutionId`` (see
+``result_tables.QueryResult.query_execution_id``), and ``AthenaExporter``
+serves that file directly:
+
+* ``csv``: a presigned URL for Athena's own file. The browser downloads it
+  from S3 and the rows never pass through the app.
+* ``parquet`` and ``xlsx``: the CSV is downloaded to a temporary file and
+  converted as it is read. Parquet uses pyarrow's streaming CSV reader, with
+  column types from the query's metadata, and writes row groups of
+  ``chunk_rows`` rows; XLSX uses openpyxl's write-only workbook. The file
+  is uploaded next to the result (or under ``export_location``) and a
+  presigned URL to it is returned. Memory use is bounded by the chunk size,
+  not the result size. Exporting the same query and format again reuses
+  the uploaded file.
+"""
+
+from __future__ import annotations
+
+import csv
+import os
+import re
+import tempfile
+from decimal import InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+
+from result_tables import value_converter
+
+
+FORMATS = ("csv", "parquet", "xlsx")
+DEFAULT_CHUNK_ROWS = 100_000
+DEFAULT_URL_EXPIRY = 900
+XLSX_MAX_ROWS = 1_048_576
+_EXECUTION_ID = re.compile(r"^[0-9a-fA-F-]{36}$")
+_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+class ExportError(RuntimeError):
+    pass
+
+
+def split_s3_uri(uri: str) -> Tuple[str, str]:
+    if not uri.startswith("s3://"):
+        raise ExportError(f"Not an S3 location: {uri}")
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def arrow_type(column: Dict[str, Any]):
+    """pyarrow type for an Athena ``ColumnInfo`` entry."""
+
+    import pyarrow as pa
+
+    athena_type = column.get("Type", "varchar").lower()
+    simple = {
+        "boolean": pa.bool_(),
+        "tinyint": pa.int8(),
+        "smallint": pa.int16(),
+        "integer": pa.int32(),
+        "int": pa.int32(),
+        "bigint": pa.int64(),
+        "real": pa.float32(),
+        "float": pa.float32(),
+        "double": pa.float64(),
+        "date": pa.date32(),
+    }
+    if athena_type in simple:
+        return simple[athena_type]
+    if athena_type.startswith("decimal"):
+        return pa.decimal128(column.get("Precision") or 38, column.get("Scale") or 0)
+    if athena_type == "timestamp":
+        return pa.timestamp("ms")
+    return pa.string()
+
+
+class AthenaExporter:
+    def __init__(
+        self,
+        region: Optional[str] = None,
+        *,
+        export_location: Optional[str] = None,
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        url_expiry: int = DEFAULT_URL_EXPIRY,
+    ) -> None:
+        import boto3
+
+        self.athena = boto3.client("athena", region_name=region)
+        self.s3 = boto3.client("s3", region_name=region)
+        self.export_location = export_location.rstrip("/") if export_location else None
+        self.chunk_rows = chunk_rows
+        self.url_expiry = url_expiry
+
+    def source(self, execution_id: str) -> Tuple[str, str]:
+        """Bucket and key of a succeeded query's CSV output."""
+
+        if not _EXECUTION_ID.match(execution_id or ""):
+            raise ExportError(f"Not a query execution id: {execution_id!r}")
+        execution = self.athena.get_query_execution(QueryExecutionId=execution_id)["QueryExecution"]
+        state = execution["Status"]["State"]
+        if state != "SUCCEEDED":
+            raise ExportError(f"Query {execution_id} is {state}; only succeeded queries can be exported")
+        if execution.get("StatementType") not in (None, "DML"):
+            raise ExportError(f"Query {execution_id} did not return rows")
+        return split_s3_uri(execution["ResultConfiguration"]["OutputLocation"])
+
+    def columns(self, execution_id: str) -> List[Dict[str, Any]]:
+        page = self.athena.get_query_results(QueryExecutionId=execution_id, MaxResults=1)
+        return page["ResultSet"]["ResultSetMetadata"]["ColumnInfo"]
+
+    def target(self, execution_id: str, bucket: str, key: str, fmt: str) -> Tuple[str, str]:
+        if self.export_location:
+            target_bucket, prefix = split_s3_uri(self.export_location)
+            return target_bucket, "/".join(p for p in [prefix, f"{execution_id}.{fmt}"] if p)
+        return bucket, f"{key.rsplit('/', 1)[0] + '/' if '/' in key else ''}exports/{execution_id}.{fmt}"
+
+    def _exists(self, bucket: str, key: str) -> bool:
+        try:
+            self.s3.head_object(Bucket=bucket, Key=key)
+            return True
+        except self.s3.exceptions.ClientError:
+            return False
+
+    def presigned_url(self, bucket: str, key: str, filename: str, fmt: str) -> str:
+        return self.s3.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": bucket,
+                "Key": key,
+                "ResponseContentDisposition": f'attachment; filename="{filename}"',
+                "ResponseContentType": _CONTENT_TYPES[fmt],
+            },
+            ExpiresIn=self.url_expiry,
+        )
+
+    def export(self, execution_id: str, fmt: str = "csv") -> str:
+        """A download URL for the query's full result in ``fmt``."""
+
+        if fmt not in FORMATS:
+            raise ExportError(f"Unknown export format {fmt!r}; use one of {', '.join(FORMATS)}")
+        bucket, key = self.source(execution_id)
+        filename = f"query-{execution_id[:8]}.{fmt}"
+        if fmt == "csv":
+            return self.presigned_url(bucket, key, filename, fmt)
+
+        target_bucket, target_key = self.target(execution_id, bucket, key, fmt)
+        if not self._exists(target_bucket, target_key):
+            columns = self.columns(execution_id)
+            with tempfile.TemporaryDirectory(prefix="athena-export-") as workdir:
+                source, converted = os.path.join(workdir, "result.csv"), os.path.join(workdir, f"result.{fmt}")
+                self.s3.download_file(bucket, key, source)
+                rows = (self._to_parquet if fmt == "parquet" else self._to_xlsx)(source, converted, columns)
+                self.s3.upload_file(converted, target_bucket, target_key, ExtraArgs={"ContentType": _CONTENT_TYPES[fmt]})
+            print(f"Exported query {execution_id} ({rows} rows) to s3://{target_bucket}/{target_key}")
+        return self.presigned_url(target_bucket, target_key, filename, fmt)
+
+    def _to_parquet(self, source: str, converted: str, columns: List[Dict[str, Any]]) -> int:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+
+        names = [column["Name"] for column in columns]
+        reader = pa_csv.open_csv(
+            source,
+            read_options=pa_csv.ReadOptions(block_size=1 << 22),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={name: arrow_type(column) for name, column in zip(names, columns)},
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+        rows = 0
+        with pq.ParquetWriter(converted, reader.schema) as writer:
+            pending: List[Any] = []
+            pending_rows = 0
+            for batch in reader:
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                if pending_rows >= self.chunk_rows:
+                    writer.write_table(pa.Table.from_batches(pending, reader.schema))
+                    rows, pending, pending_rows = rows + pending_rows, [], 0
+            if pending:
+                writer.write_table(pa.Table.from_batches(pending, reader.schema))
+                rows += pending_rows
+        return rows
+
+    def _to_xlsx(self, source: str, converted: str, columns: List[Dict[str, Any]]) -> int:
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("result")
+        converters = [value_converter(column.get("Type", "varchar")) for column in columns]
+        rows = 0
+        with open(source, encoding="utf-8", newline="") as text:
+            reader = csv.reader(text)
+            sheet.append(next(reader, []))
+            for row in reader:
+                rows += 1
+                if rows >= XLSX_MAX_ROWS:
+                    raise ExportError(f"More than {XLSX_MAX_ROWS - 1} rows do not fit in a worksheet; export CSV or Parquet")
+                values = []
+                for convert, value in zip(converters, row):
+                    try:
+                        values.append(convert(value) if value != "" else None)
+                    except (ValueError, TypeError, InvalidOperation):
+                        values.append(value)
+                sheet.append(values)
+        workbook.save(converted)
+        return rows
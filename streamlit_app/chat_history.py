@@ -0,0 +1,62 @@
+"""Conversation history entries and avatar images for app.py.
+
+Every rerun used to open the full-size avatar files (1.3 and 1.5 MB), crop
+them to a circle and re-encode them once per history entry, and key each
+entry's widgets by ``str(chat)`` (the whole question and answer). Rendering
+therefore got slower with every turn.
+
+``avatar_png`` crops and downsizes an avatar once per process and returns
+PNG bytes that ``st.image`` can reuse. ``new_entry`` gives each history entry a
+stable id for widget keys, and ``page`` selects the newest entries to show.
+"""
+
+from __future__ import annotations
+
+import io
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageOps
+
+
+ASSET_DIR = Path(__file__).resolve().parent
+HUMAN_AVATAR = "human_face.png"
+ROBOT_AVATAR = "robot_face.jpg"
+DEFAULT_PAGE_SIZE = 10
+
+
+def crop_to_circle(image: Image.Image) -> Image.Image:
+    mask = Image.new('L', image.size, 0)
+    mask_draw = ImageDraw.Draw(mask)
+    mask_draw.ellipse((0, 0) + image.size, fill=255)
+    result = ImageOps.fit(image, mask.size, centering=(0.5, 0.5))
+    result.putalpha(mask)
+    return result
+
+
+@lru_cache(maxsize=None)
+def avatar_png(filename: str, size: int = 300) -> bytes:
+    """Circular avatar, ``size`` pixels square, as PNG bytes (computed once per process)."""
+
+    with Image.open(ASSET_DIR / filename) as image:
+        thumbnail = ImageOps.fit(image.convert("RGB"), (size, size), centering=(0.5, 0.5))
+    buffer = io.BytesIO()
+    crop_to_circle(thumbnail).save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def new_entry(question: str, answer: Any, tables: Optional[List[Any]] = None) -> Dict[str, Any]:
+    """A history entry; ``tables`` are the ``result_tables.QueryResult``s of the answer."""
+
+    return {"id": uuid.uuid4().hex, "question": question, "answer": answer, "tables": tables or []}
+
+
+def page(history: List[Dict[str, Any]], visible: int) -> Tuple[List[Dict[str, Any]], int]:
+    """The newest ``visible`` entries, newest first, and how many older ones are hidden."""
+
+    for entry in history:
+        entry.setdefault("id", uuid.uuid4().hex)  # entries created before ids existed
+    shown = history[-visible:] if visible > 0 else []
+    return list(reversed(shown)), len(history) - len(shown)
@@ -0,0 +1,256 @@
+"""Incremental decoder for ``application/vnd.amazon.eventstream`` responses.
+
+``InvokeAgent`` answers with a binary event stream. Every message is framed as
+
+    total length (4) | headers length (4) | prelude CRC32 (4)
+    headers | payload | message CRC32 (4)
+
+with big-endian integers. Headers carry ``:message-type`` (``event`` or
+``exception``) and ``:event-type`` (``chunk``, ``trace``, ``returnControl``,
+...). ``EventStreamDecoder`` takes bytes as they arrive from the socket and
+yields each complete message once its checksums verify, so nothing is
+buffered beyond the frame currently being received. ``agent_events`` turns
+those messages into typed ``AgentEvent`` objects. The service may split a
+multibyte character across two ``chunk`` events, so chunk text is decoded
+with one incremental UTF-8 decoder per response.
+
+``encode_message`` builds frames in the same format; it is used to record
+and replay streams in benchmarks.
+"""
+
+from __future__ import annotations
+
+import base64
+import codecs
+import json
+import struct
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+CONTENT_TYPE = "application/vnd.amazon.eventstream"
+
+_PRELUDE = struct.Struct(">III")
+_PRELUDE_LENGTH = _PRELUDE.size
+_MIN_MESSAGE_LENGTH = _PRELUDE_LENGTH + 4
+# Service limit for a single message is 16 MiB; anything larger is corruption.
+_MAX_MESSAGE_LENGTH = 16 * 1024 * 1024
+_MAX_HEADERS_LENGTH = 128 * 1024
+
+_BOOL_TRUE, _BOOL_FALSE, _BYTE, _SHORT, _INT, _LONG, _BYTES, _STRING, _TIMESTAMP, _UUID = range(10)
+_FIXED = {_BYTE: struct.Struct(">b"), _SHORT: struct.Struct(">h"), _INT: struct.Struct(">i"), _LONG: struct.Struct(">q")}
+_LENGTH16 = struct.Struct(">H")
+
+
+class EventStreamError(ValueError):
+    """Raised for malformed frames or checksum mismatches."""
+
+
+@dataclass
+class Message:
+    headers: Dict[str, Any]
+    payload: bytes
+
+
+@dataclass
+class AgentEvent:
+    """One decoded ``InvokeAgent`` event.
+
+    ``type`` is the ``:event-type`` header. ``text`` is set for ``chunk``
+    events (the base64 ``bytes`` field decoded), ``data`` holds the parsed
+    JSON payload.
+    """
+
+    type: str
+    data: Dict[str, Any] = field(default_factory=dict)
+    text: Optional[str] = None
+
+
+def _parse_headers(buf: memoryview) -> Dict[str, Any]:
+    headers: Dict[str, Any] = {}
+    pos, end = 0, len(buf)
+    try:
+        while pos < end:
+            name_length = buf[pos]
+            name = bytes(buf[pos + 1:pos + 1 + name_length]).decode("utf-8")
+            pos += 1 + name_length
+            kind = buf[pos]
+            pos += 1
+            if kind == _BOOL_TRUE:
+                value: Any = True
+            elif kind == _BOOL_FALSE:
+                value = False
+            elif kind in _FIXED:
+                fmt = _FIXED[kind]
+                (value,) = fmt.unpack_from(buf, pos)
+                pos += fmt.size
+            elif kind in (_BYTES, _STRING):
+                (length,) = _LENGTH16.unpack_from(buf, pos)
+                raw = bytes(buf[pos + 2:pos + 2 + length])
+                if len(raw) != length:
+                    raise EventStreamError("Truncated header value")
+                value = raw.decode("utf-8") if kind == _STRING else raw
+                pos += 2 + length
+            elif kind == _TIMESTAMP:
+                (millis,) = _FIXED[_LONG].unpack_from(buf, pos)
+                value = datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+                pos += 8
+            elif kind == _UUID:
+                value = uuid.UUID(bytes=bytes(buf[pos:pos + 16]))
+                pos += 16
+            else:
+                raise EventStreamError(f"Unknown header value type {kind}")
+            headers[name] = value
+    except (IndexError, struct.error, UnicodeDecodeError) as exc:
+        raise EventStreamError(f"Malformed headers: {exc}") from exc
+    if pos != end:
+        raise EventStreamError("Header block length mismatch")
+    return headers
+
+
+class EventStreamDecoder:
+    """Feed raw bytes, get complete ``Message`` objects back."""
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self.bytes_received = 0
+        self.messages_decoded = 0
+
+    def feed(self, data: bytes) -> List[Message]:
+        """Append ``data`` and return the messages it completed (possibly none)."""
+
+        self._buffer += data
+        self.bytes_received += len(data)
+        buf = self._buffer
+        messages: List[Message] = []
+        offset = 0
+        try:
+            while len(buf) - offset >= _PRELUDE_LENGTH:
+                total_length, headers_length, prelude_crc = _PRELUDE.unpack_from(buf, offset)
+                if zlib.crc32(buf[offset:offset + 8]) != prelude_crc:
+                    raise EventStreamError("Prelude checksum mismatch")
+                if not _MIN_MESSAGE_LENGTH <= total_length <= _MAX_MESSAGE_LENGTH:
+                    raise EventStreamError(f"Invalid message length {total_length}")
+                if headers_length > min(_MAX_HEADERS_LENGTH, total_length - _MIN_MESSAGE_LENGTH):
+                    raise EventStreamError(f"Invalid headers length {headers_length}")
+                if len(buf) - offset < total_length:
+                    break
+
+                frame = memoryview(bytes(buf[offset:offset + total_length]))
+                (message_crc,) = struct.unpack_from(">I", frame, total_length - 4)
+                if zlib.crc32(frame[:-4]) != message_crc:
+                    raise EventStreamError("Message checksum mismatch")
+                headers_end = _PRELUDE_LENGTH + headers_length
+                message = Message(
+                    headers=_parse_headers(frame[_PRELUDE_LENGTH:headers_end]),
+                    payload=bytes(frame[headers_end:-4]),
+                )
+                offset += total_length
+                self.messages_decoded += 1
+                messages.append(message)
+        finally:
+            # Drop consumed frames only once per feed() call, not per message.
+            if offset:
+                del buf[:offset]
+        return messages
+
+    def close(self) -> None:
+        """Raise if the stream ended in the middle of a message."""
+        if self._buffer:
+            raise EventStreamError(f"Stream ended with {len(self._buffer)} undecoded byte(s)")
+
+
+def text_decoder() -> codecs.IncrementalDecoder:
+    """UTF-8 decoder for the chunk text of one response; see ``agent_event``."""
+
+    return codecs.getincrementaldecoder("utf-8")()
+
+
+def agent_event(message: Message, decoder: Optional[codecs.IncrementalDecoder] = None) -> AgentEvent:
+    """Interpret one message of an ``InvokeAgent`` stream.
+
+    Pass the response's ``text_decoder()`` so that a character split across
+    chunks is carried over to the next one instead of failing to decode.
+    """
+
+    message_type = message.headers.get(":message-type", "event")
+    if message_type == "error":
+        raise EventStreamError(
+            f"{message.headers.get(':error-code')}: {message.headers.get(':error-message')}"
+        )
+    event_type = message.headers.get(
+        ":exception-type" if message_type == "exception" else ":event-type", "unknown"
+    )
+    try:
+        data = json.loads(message.payload) if message.payload else {}
+    except ValueError:
+        data = {"raw": message.payload.decode("utf-8", "replace")}
+    if message_type == "exception":
+        raise EventStreamError(f"{event_type}: {data.get('message', data)}")
+
+    text = None
+    if event_type == "chunk" and "bytes" in data:
+        raw = base64.b64decode(data["bytes"])
+        try:
+            text = decoder.decode(raw) if decoder is not None else raw.decode("utf-8")
+        except UnicodeDecodeError as exc:
+            raise EventStreamError(f"Chunk is not valid UTF-8: {exc}") from exc
+    return AgentEvent(type=event_type, data=data, text=text)
+
+
+def agent_events(chunks: Iterable[bytes]) -> Iterator[AgentEvent]:
+    """Typed events from an iterable of raw response chunks, as they arrive."""
+
+    decoder = EventStreamDecoder()
+    text = text_decoder()
+    for chunk in chunks:
+        if chunk:
+            for message in decoder.feed(chunk):
+                yield agent_event(message, text)
+    decoder.close()
+    try:
+        text.decode(b"", final=True)
+    except UnicodeDecodeError as exc:
+        raise EventStreamError("Stream ended in the middle of a UTF-8 character") from exc
+
+
+def _encode_header(name: str, value: Any) -> bytes:
+    encoded_name = name.encode("utf-8")
+    prefix = bytes([len(encoded_name)]) + encoded_name
+    if isinstance(value, bool):
+        return prefix + bytes([_BOOL_TRUE if value else _BOOL_FALSE])
+    if isinstance(value, int):
+        return prefix + bytes([_LONG]) + _FIXED[_LONG].pack(value)
+    if isinstance(value, bytes):
+        return prefix + bytes([_BYTES]) + _LENGTH16.pack(len(value)) + value
+    raw = str(value).encode("utf-8")
+    return prefix + bytes([_STRING]) + _LENGTH16.pack(len(raw)) + raw
+
+
+def encode_message(headers: Dict[str, Any], payload: bytes) -> bytes:
+    header_bytes = b"".join(_encode_header(name, value) for name, value in headers.items())
+    total_length = _PRELUDE_LENGTH + len(header_bytes) + len(payload) + 4
+    prelude = struct.pack(">II", total_length, len(header_bytes))
+    prelude += struct.pack(">I", zlib.crc32(prelude))
+    body = prelude + header_bytes + payload
+    return body + struct.pack(">I", zlib.crc32(body))
+
+
+def encode_agent_event(event_type: str, data: Dict[str, Any]) -> bytes:
+    """Frame an ``InvokeAgent`` event the way the service does."""
+
+    return encode_message(
+        {
+            ":event-type": event_type,
+            ":content-type": "application/json",
+            ":message-type": "event",
+        },
+        json.dumps(data, separators=(",", ":")).encode("utf-8"),
+    )
+
+
+def encode_chunk(text: str) -> bytes:
+    return encode_agent_event("chunk", {"bytes": base64.b64encode(text.encode("utf-8")).decode("ascii")})
@@ -1,13 +1,18 @@
-from boto3.session import Session
-from botocore.auth import SigV4Auth
-from botocore.awsrequest import AWSRequest
-from botocore.credentials import Credentials
 import json
 import os
-from requests import request
-import base64
-import io
-import sys
+import queue
+import threading
+import time
+import uuid
+
+from agent_client import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, SigV4Client
+from answer_cache import AnswerCache, DynamoDBBackend, LocalBackend
+from eventstream import CONTENT_TYPE as EVENTSTREAM_CONTENT_TYPE, EventStreamError, agent_events
+from resilience import LatencyTracker, RetryBudget, RetryPolicy, call_with_retries, check_response, hedged, is_retryable
+from schema_selector import DEFAULT_MIN_SCORE, DEFAULT_TOP_K, SchemaIndex
+from sql_templates import DEFAULT_MIN_CONFIDENCE, LambdaExecutor, TemplateStore, format_result, sql_from_timeline
+from trace_collector import TraceCollector, collecting, trace
+from trace_timeline import timeline_from_collector
 
 #For this to run on a local machine in VScode, you need to set the AWS_PROFILE environment variable to the name of the profile/credentials you want to use. 
 #You also need to input your model ID near the bottom of this file.
@@ -27,6 +32,191 @@ os.environ["AWS_REGION"] = theRegion
 region = os.environ.get("AWS_REGION")
 llm_response = ""
 
+# Question-relevant schema pruning (see schema_selector.py). When enabled, the
+# orchestration prompt should reference $prompt_session_attributes$ instead of
+# embedding the full <athena_schema>.
+schemaPruning = os.environ.get("SCHEMA_PRUNING", "off").lower() in ("1", "on", "true")
+schemaIndexPath = os.environ.get(
+    "SCHEMA_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema_index.json")
+)
+schemaTopK = int(os.environ.get("SCHEMA_TOP_K", DEFAULT_TOP_K))
+schemaMinScore = float(os.environ.get("SCHEMA_MIN_SCORE", DEFAULT_MIN_SCORE))
+_schema_index = None
+
+# Set AGENT_STREAM_RECORD_DIR to keep the raw event stream of every answer,
+# e.g. for scripts/benchmark_eventstream.py.
+streamRecordDir = os.environ.get("AGENT_STREAM_RECORD_DIR")
+
+# Send agent requests elsewhere than the regional endpoint, e.g. to the local
+# replay server in agent_replay.py.
+agentEndpointUrl = os.environ.get("AGENT_ENDPOINT_URL", f"https://bedrock-agent-runtime.{theRegion}.amazonaws.com").rstrip("/")
+
+# Ask the agent to stream the final answer in several chunks instead of one.
+streamFinalResponse = os.environ.get("STREAM_FINAL_RESPONSE", "on").lower() in ("1", "on", "true")
+
+
+def get_schema_index():
+    """Load the schema index once per process."""
+    global _schema_index
+    if _schema_index is None:
+        _schema_index = SchemaIndex.load(schemaIndexPath)
+    return _schema_index
+
+
+def prompt_session_attributes(question):
+    """Session attributes carrying the pruned schema, or {} when disabled."""
+    if not schemaPruning or not question:
+        return {}
+    try:
+        return {"athena_schema": get_schema_index().pruned_schema(question, top_k=schemaTopK, min_score=schemaMinScore)}
+    except Exception as e:
+        trace("warning", f"Schema pruning disabled for this request: {e}")
+        return {}
+
+# Answer cache (see answer_cache.py), off unless ANSWER_CACHE=on. Only the
+# first question of a conversation is looked up or stored: later questions
+# depend on earlier turns that the key does not capture. ANSWER_CACHE_TABLE
+# switches from the per-process LRU to a DynamoDB table shared by all instances.
+answerCacheTable = os.environ.get("ANSWER_CACHE_TABLE")
+answerCache = AnswerCache(
+    backend=DynamoDBBackend(answerCacheTable, theRegion) if answerCacheTable
+    else LocalBackend(int(os.environ.get("ANSWER_CACHE_SIZE", "512"))),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", "3600")),
+    enabled=os.environ.get("ANSWER_CACHE", "off").lower() in ("1", "on", "true"),
+)
+
+
+def cached_answer(question, bypass=False, first_turn=False):
+    """Cached {"answer", "trace", "latency_s", ...} for the first question of a conversation, or None."""
+    if bypass or not first_turn:
+        return None
+    return answerCache.get(agentId, agentAliasId, question)
+
+
+def remember_answer(question, answer, trace_text="", latency_s=0.0, first_turn=False):
+    if not first_turn or not answer or answer.startswith(("Error", "HTTP Error", "No response")):
+        return
+    answerCache.put(agentId, agentAliasId, question, answer, trace_text, latency_s)
+
+
+# A first question answered without the agent (cache or template) never reaches
+# the agent session, so the next question carries that exchange along.
+previousTurnChars = int(os.environ.get("PREVIOUS_TURN_CHARS", "2000"))
+
+
+def agent_input(question, previous=None):
+    """The inputText for ``question``, prefixed with a turn the agent did not see."""
+    if not previous:
+        return question
+    asked, answered = previous
+    return (
+        f"Earlier in this conversation I asked: {asked}\n"
+        f"and was answered: {answered[:previousTurnChars]}\n\n"
+        f"{question}"
+    )
+
+
+# Question -> SQL templates (see sql_templates.py). SQL_TEMPLATES=shadow only
+# learns and checks matches against the agent's SQL; =on answers matching
+# questions through the query Lambda (SQL_TEMPLATE_LAMBDA) without the agent.
+# Like the answer cache, templates only match and learn first questions; a
+# follow-up's SQL depends on the turns before it.
+sqlTemplateMode = os.environ.get("SQL_TEMPLATES", "off").lower()
+sqlTemplateMinConfidence = float(os.environ.get("SQL_TEMPLATE_MIN_CONFIDENCE", DEFAULT_MIN_CONFIDENCE))
+sqlTemplateMinVerified = int(os.environ.get("SQL_TEMPLATE_MIN_VERIFIED", "1"))
+sqlTemplateLambda = os.environ.get("SQL_TEMPLATE_LAMBDA")
+sqlTemplates = TemplateStore(os.environ.get("SQL_TEMPLATE_PATH")) if sqlTemplateMode in ("shadow", "on") else None
+_template_executor = None
+
+
+def match_sql_template(question, first_turn=False):
+    """(template, confidence, sql) when a first question matches a template confidently, else None."""
+    if sqlTemplates is None or not question or not first_turn:
+        return None
+    match = sqlTemplates.match(question)
+    if match is None:
+        return None
+    template, confidence, sql = match
+    if confidence < sqlTemplateMinConfidence:
+        trace("template", f"SQL template '{template.id}' below threshold ({confidence:.2f})")
+        return None
+    trace("template", f"SQL template '{template.id}' matched ({confidence:.2f}):\n{sql}")
+    return match
+
+
+def template_answer(question, match):
+    """Answer from running a matched template's SQL directly, or None to ask the agent."""
+    global _template_executor
+    template, confidence, sql = match
+    if sqlTemplateMode != "on" or not sqlTemplateLambda:
+        return None
+    verified = sqlTemplates.verified(template, question)
+    if verified < sqlTemplateMinVerified:
+        trace("template", f"SQL template '{template.id}' not verified for this question yet ({verified}/{sqlTemplateMinVerified})")
+        return None
+    try:
+        if _template_executor is None:
+            _template_executor = LambdaExecutor(sqlTemplateLambda, theRegion)
+        result = _template_executor.run(sql)
+    except Exception as e:
+        trace("warning", f"SQL template failed, asking the agent instead: {e}")
+        return None
+    sqlTemplates.record_served(template)
+    return format_result(result)
+
+
+def learn_sql_template(question, answer, collector, match=None, first_turn=False):
+    """Learn from a first answer's trace; in shadow mode, check a match against it."""
+    if sqlTemplates is None or not first_turn or not answer or answer.startswith(("Error", "HTTP Error", "No response")):
+        return
+    sql = sql_from_timeline(timeline_from_collector(collector))
+    if sql is None:
+        return
+    if match is not None:
+        template, confidence, expected = match
+        agreed = sqlTemplates.record_shadow(template, question, expected, sql)
+        with collecting(collector):
+            trace("template", f"SQL template '{template.id}' ({confidence:.2f}) {'agrees with' if agreed else 'differs from'} the agent's SQL")
+    sqlTemplates.learn(question, sql)
+
+
+# One pooled, credential-refreshing client per (service, region); see agent_client.py.
+connectTimeout = float(os.environ.get("AGENT_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT))
+readTimeout = float(os.environ.get("AGENT_READ_TIMEOUT", DEFAULT_READ_TIMEOUT))
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# Throttling (429) and transient 5xx/connection errors are retried with
+# jittered exponential backoff (see resilience.py), within a process-wide
+# retry budget. AGENT_HEDGE=on additionally sends a second request, in a
+# session of its own, when the first question of a conversation has not been
+# answered after the observed AGENT_HEDGE_PERCENTILE latency. The losing
+# session is ended; when the hedge wins, its session becomes the user's.
+retryPolicy = RetryPolicy(
+    max_attempts=int(os.environ.get("AGENT_MAX_ATTEMPTS", "4")),
+    base_delay=float(os.environ.get("AGENT_RETRY_BASE_DELAY", "0.5")),
+)
+retryBudget = RetryBudget(ratio=float(os.environ.get("AGENT_RETRY_BUDGET", "0.2")))
+hedgeRequests = os.environ.get("AGENT_HEDGE", "off").lower() in ("1", "on", "true")
+hedgePercentile = float(os.environ.get("AGENT_HEDGE_PERCENTILE", "95"))
+agentLatency = LatencyTracker()
+
+
+def _log_retry(number, exc, delay):
+    trace("retry", f"Agent request attempt {number} failed ({exc}); retrying in {delay:.1f}s")
+
+
+def get_client(service='bedrock', region=None):
+    region = region or theRegion
+    with _clients_lock:
+        client = _clients.get((service, region))
+        if client is None:
+            client = SigV4Client(service, region, connect_timeout=connectTimeout, read_timeout=readTimeout)
+            _clients[(service, region)] = client
+    return client
+
+
 def sigv4_request(
     url,
     method='GET',
@@ -34,8 +224,9 @@ def sigv4_request(
     params=None,
     headers=None,
     service='execute-api',
-    region=os.environ['AWS_REGION'],
-    credentials=Session().get_credentials().get_frozen_credentials()
+    region=None,
+    credentials=None,
+    stream=False
 ):
     """Sends an HTTP request signed with SigV4
     Args:
@@ -46,63 +237,473 @@ def sigv4_request(
     headers: The request headers (e.g. { 'content-type': 'application/json' }). Defaults to None.
     service: The AWS service name. Defaults to 'execute-api'.
     region: The AWS region id. Defaults to the env var 'AWS_REGION'.
-    credentials: The AWS credentials. Defaults to the current boto3 session's credentials.
+    credentials: Fixed AWS credentials. Defaults to the shared client, which
+     re-resolves (and refreshes) the boto3 session's credentials per request.
+    stream: Return as soon as the headers arrive and read the body incrementally. Defaults to False.
     Returns:
      The HTTP response
     """
+    if credentials is not None:
+        client = SigV4Client(service, region or theRegion, credentials=credentials,
+                             connect_timeout=connectTimeout, read_timeout=readTimeout)
+    else:
+        client = get_client(service, region)
+    return client.request(url, method=method, body=body, params=params, headers=headers, stream=stream)
 
-    # sign request
-    req = AWSRequest(
-        method=method,
-        url=url,
-        data=body,
-        params=params,
-        headers=headers
-    )
-    SigV4Auth(credentials, service, region).add_auth(req)
-    req = req.prepare()
-
-    # send request
-    return request(
-        method=req.method,
-        url=req.url,
-        headers=req.headers,
-        data=req.body
-    )
-    
-    
 
-def askQuestion(question, url, endSession=False):
+def agent_request_body(question, endSession=False, previous=None):
     myobj = {
-        "inputText": question,   
+        "inputText": agent_input(question, previous),
         "enableTrace": True,
         "endSession": endSession
     }
-    
+    schema_attributes = prompt_session_attributes(question) if not endSession else {}
+    if schema_attributes:
+        myobj["sessionState"] = {"promptSessionAttributes": schema_attributes}
+    if streamFinalResponse and not endSession:
+        myobj["streamingConfigurations"] = {"streamFinalResponse": True}
+    return myobj
+
+
+def agent_url(sessionId):
+    return f'{agentEndpointUrl}/agents/{agentId}/agentAliases/{agentAliasId}/sessions/{sessionId}/text'
+
+
+def stream_agent(question, sessionId="MYSESSION", endSession=False, url=None, collector=None, on_response=None,
+                 previous=None, cancel=None):
+    """Yield the agent's events (eventstream.AgentEvent) as they arrive.
+
+    ``chunk`` events carry answer text in ``event.text``; ``trace`` events
+    carry the orchestration trace in ``event.data["trace"]``. Diagnostics
+    produced while preparing the request go to ``collector``. ``on_response``
+    is called with the HTTP response before it is read (e.g. so another
+    thread can close it to cancel). ``previous`` is a (question, answer) turn
+    that was answered without the agent. Once ``cancel`` (a threading.Event)
+    is set, no further attempt is sent. Raises RuntimeError for HTTP errors
+    and EventStreamError for exception frames.
+    """
+    with collecting(collector):
+        body = json.dumps(agent_request_body(question, endSession, previous))
+
+        def attempt(number):
+            if cancel is not None and cancel.is_set():
+                raise RuntimeError("Request abandoned")
+            return check_response(sigv4_request(
+                url or agent_url(sessionId),
+                method='POST',
+                service='bedrock',
+                headers={
+                    'content-type': 'application/json',
+                    'accept': 'application/json',
+                },
+                region=theRegion,
+                body=body,
+                stream=True
+            ))
+
+        # Only the request itself is retried: once answer text has been
+        # yielded, a failure mid-stream is raised to the caller.
+        response = call_with_retries(attempt, policy=retryPolicy, budget=retryBudget, on_retry=_log_retry,
+                                     sleep=cancel.wait if cancel is not None else time.sleep)
+    if on_response is not None:
+        on_response(response)
     try:
-        # send request
-        response = sigv4_request(
-            url,
-            method='POST',
-            service='bedrock',
-            headers={
-                'content-type': 'application/json', 
-                'accept': 'application/json',
-            },
-            region=theRegion,
-            body=json.dumps(myobj)
-        )
-        
-        return decode_response(response)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP Error {response.status_code}: {response.text}")
+        yield from agent_events(response_chunks(response))
+    finally:
+        response.close()
+
+
+def end_agent_session(sessionId):
+    """End an agent session so the service drops its memory; True on success."""
+    response = sigv4_request(
+        agent_url(sessionId),
+        method='POST',
+        service='bedrock',
+        headers={
+            'content-type': 'application/json',
+            'accept': 'application/json',
+        },
+        region=theRegion,
+        body=json.dumps({"endSession": True, "enableTrace": False})
+    )
+    try:
+        if response.status_code != 200:
+            print(f"Ending session {sessionId} failed: HTTP {response.status_code}: {response.text[:300]}")
+        return response.status_code == 200
+    finally:
+        response.close()
+
+
+def hedge_session_id(sessionId):
+    return f"{sessionId}-hedge-{uuid.uuid4().hex[:12]}"[:100]
+
+
+def _end_session_quietly(sessionId):
+    try:
+        end_agent_session(sessionId)
+    except Exception as e:
+        print(f"Ending session {sessionId} failed: {e}")
+
+
+def hedged_stream(job, delay):
+    """Like ``stream_agent`` for ``job``, with a hedged request after ``delay`` seconds.
+
+    Events of the first request are yielded as they arrive. If it has not
+    produced answer text after ``delay``, the question is also sent in a new
+    session and both are read; the first to produce answer text (or finish)
+    wins and the other is closed. Each request collects its own trace. When
+    the hedge wins, ``job`` restarts with the hedge's trace, its events are
+    yielded and ``job.session_id`` becomes the hedge's session; the first
+    session's Athena queries are stopped. The hedge session is ended, once
+    its request has stopped, unless it won.
+    """
+    primary, backup = job.session_id, hedge_session_id(job.session_id)
+    events = queue.Queue()
+    responses = {primary: [], backup: []}
+    collectors = {primary: job.collector, backup: TraceCollector()}
+    cancels = {primary: threading.Event(), backup: threading.Event()}
+    readers = {}
+
+    def on_response(sessionId, response):
+        responses[sessionId].append(response)
+        if cancels[sessionId].is_set():
+            response.close()
+        elif sessionId == job.session_id:
+            job.attach_response(response)
+
+    def read(sessionId):
+        try:
+            for event in stream_agent(job.question, sessionId, collector=collectors[sessionId],
+                                      on_response=lambda response: on_response(sessionId, response),
+                                      previous=job.context.get("previous"), cancel=cancels[sessionId]):
+                events.put((sessionId, event))
+        except Exception as e:
+            events.put((sessionId, e))
+        else:
+            events.put((sessionId, None))
+
+    def start(sessionId):
+        readers[sessionId] = threading.Thread(target=read, args=(sessionId,), name="agent-hedge", daemon=True)
+        readers[sessionId].start()
+
+    def abandon(sessionId):
+        cancels[sessionId].set()
+        for response in responses[sessionId]:
+            response.close()
+
+    start(primary)
+    deadline = time.perf_counter() + delay
+    winner, hedge_sent, held, failed = None, False, [], {}
+    try:
+        while True:
+            job.check_cancelled()
+            if not hedge_sent and winner is None and time.perf_counter() >= deadline:
+                hedge_sent = True
+                note = f"No answer after {delay:.1f}s (p{hedgePercentile:g}); sent a hedged request"
+                job.collector.add("hedge", note)
+                collectors[backup].add("hedge", note)
+                job.add_step("Slower than usual; asking in a second session too")
+                start(backup)
+            wait = 0.5 if hedge_sent or winner else max(0.0, min(0.5, deadline - time.perf_counter()))
+            try:
+                sessionId, event = events.get(timeout=wait)
+            except queue.Empty:
+                continue
+            if winner is not None and sessionId != winner:
+                continue
+            if isinstance(event, Exception):
+                failed[sessionId] = event
+                if winner is not None or not hedge_sent or len(failed) == 2:
+                    raise event
+                continue
+            if winner is None and (event is None or event.type == "chunk"):
+                winner = sessionId
+                abandon(backup if winner == primary else primary)
+                if winner == backup:
+                    # The first request's trace, steps and results are not
+                    # part of the answer, and its queries are no longer needed.
+                    job.restart(collectors[backup])
+                    job.add_step("Answering from the hedged request")
+                    job.session_id = backup
+                    for response in responses[backup]:
+                        job.attach_response(response)
+                    threading.Thread(target=_stop_queries_quietly, args=(primary,), name="stop-hedge", daemon=True).start()
+                    yield from held
+            if event is None:
+                return
+            if sessionId == primary or winner is not None:
+                yield event
+            else:
+                held.append(event)
+    finally:
+        abandon(primary)
+        abandon(backup)
+        if hedge_sent and job.session_id != backup:
+            # Only end the hedge session once its request has stopped: while
+            # it is between retries it could still re-send the question.
+            threading.Thread(target=_end_session_after, args=(readers[backup], backup),
+                             name="end-hedge", daemon=True).start()
+
+
+def _end_session_after(reader, sessionId):
+    reader.join()
+    _end_session_quietly(sessionId)
+
+
+def _stop_queries_quietly(sessionId):
+    try:
+        stop_session_queries(sessionId)
     except Exception as e:
+        print(f"Stopping the queries of session {sessionId} failed: {e}")
+
+
+def run_job(job):
+    """Worker body for agent_jobs.JobPool: stream the answer into ``job``."""
+    started = time.perf_counter()
+    first_turn = job.context.get("first_turn", False)
+    delay = agentLatency.percentile(hedgePercentile) if hedgeRequests and first_turn else None
+    if delay is None:
+        events = stream_agent(job.question, job.session_id, collector=job.collector, on_response=job.attach_response,
+                              previous=job.context.get("previous"))
+    else:
+        events = hedged_stream(job, delay)
+    for event in events:
+        job.check_cancelled()
+        if event.type == "chunk":
+            job.add_text(event.text or "")
+        elif event.type == "trace":
+            job.collector.add("trace", data=event.data)
+            job.results.add(event.data)
+            step = describe_trace(event.data)
+            if step:
+                job.add_step(*step)
+    answer = job.text or "No response received from agent"
+    if job.text:
+        agentLatency.record(time.perf_counter() - started)
+    with collecting(job.collector):
+        remember_answer(job.question, answer, job.collector.render(), time.perf_counter() - started,
+                        first_turn=first_turn)
+    learn_sql_template(job.question, answer, job.collector, job.context.get("template_match"),
+                       first_turn=first_turn)
+
+
+# The action Lambda prefixes its queries with "-- agent-session: <id>", so the
+# queries of a cancelled question can be found and stopped.
+athenaWorkgroup = os.environ.get("ATHENA_WORKGROUP", "primary")
+
+
+def stop_session_queries(sessionId):
+    """Stop queued/running Athena queries of an agent session; returns their ids."""
+    import boto3
+
+    athena = boto3.client("athena", region_name=theRegion)
+    ids = athena.list_query_executions(WorkGroup=athenaWorkgroup, MaxResults=50).get("QueryExecutionIds", [])
+    if not ids:
+        return []
+    marker = f"-- agent-session: {sessionId}\n"
+    stopped = []
+    for execution in athena.batch_get_query_execution(QueryExecutionIds=ids)["QueryExecutions"]:
+        if execution["Status"]["State"] in ("QUEUED", "RUNNING") and execution.get("Query", "").startswith(marker):
+            athena.stop_query_execution(QueryExecutionId=execution["QueryExecutionId"])
+            stopped.append(execution["QueryExecutionId"])
+    print(f"Stopped {len(stopped)} Athena quer{'y' if len(stopped) == 1 else 'ies'} of session {sessionId}: {stopped}")
+    return stopped
+
+
+def cancel_job_queries(job):
+    """JobPool on_cancel hook: stop the Athena query if the agent is waiting on one."""
+    steps = timeline_from_collector(job.collector)["steps"]
+    if any(s["kind"] == "action" and s.get("incomplete") and s["label"] == "Action /athenaQuery" for s in steps):
+        job.collector.add("cancel", f"Stopped Athena queries: {stop_session_queries(job.session_id)}")
+
+
+def describe_trace(data):
+    """Short (label, detail) for a trace event, for progress display; None to skip."""
+    trace = data.get("trace", data)
+    if "preProcessingTrace" in trace:
+        return "Checking the question", None
+    if "failureTrace" in trace:
+        return "Agent failed", trace["failureTrace"].get("failureReason")
+    if "postProcessingTrace" in trace:
+        return "Formatting the answer", None
+    orchestration = trace.get("orchestrationTrace")
+    if not orchestration:
+        return None
+    if "rationale" in orchestration:
+        return "Planning", orchestration["rationale"].get("text")
+    invocation = orchestration.get("invocationInput", {}).get("actionGroupInvocationInput")
+    if invocation:
+        properties = invocation.get("requestBody", {}).get("content", {}).get("application/json", [])
+        detail = "\n".join(str(prop.get("value")) for prop in properties if prop.get("value"))
+        return f"Calling {invocation.get('apiPath', 'action')}", detail or None
+    observation = orchestration.get("observation")
+    if observation:
+        if observation.get("type") == "FINISH":
+            return "Writing the answer", None
+        if "actionGroupInvocationOutput" in observation:
+            return "Reading query results", None
+    if "modelInvocationInput" in orchestration:
+        return "Thinking", None
+    return None
+
+
+def askQuestion(question, url, endSession=False, collector=None, hedge_session=None, previous=None, on_hedge_won=None):
+    """Returns (trace text, answer); traces go to ``collector`` (a new one by default).
+
+    ``hedge_session`` is the id of another, unused session: when hedging is
+    on and the answer is slower than usual, the question is sent there as
+    well and the first answer wins. Only pass it for the first question of a
+    conversation. The losing hedge session is ended; when the hedge wins,
+    ``on_hedge_won(hedge_session)`` is called and the caller should continue
+    the conversation in that session. ``previous`` is a (question, answer)
+    turn that was answered without the agent.
+    """
+    collector = collector or TraceCollector()
+    with collecting(collector):
+        return _ask_question(question, url, endSession, collector, hedge_session, previous, on_hedge_won)
+
+
+def _ask_question(question, url, endSession, collector, hedge_session=None, previous=None, on_hedge_won=None):
+    myobj = agent_request_body(question, endSession, previous)
+
+    def ask(target_url, target_collector, cancel=None):
+        def attempt(number):
+            if cancel is not None and cancel.is_set():
+                raise RuntimeError("Request abandoned")
+            response = sigv4_request(
+                target_url,
+                method='POST',
+                service='bedrock',
+                headers={
+                    'content-type': 'application/json', 
+                    'accept': 'application/json',
+                },
+                region=theRegion,
+                body=json.dumps(myobj),
+                stream=True
+            )
+            return decode_response(check_response(response), target_collector, cancel)
+
+        with collecting(target_collector):
+            return call_with_retries(attempt, policy=retryPolicy, budget=retryBudget, on_retry=_log_retry,
+                                     sleep=cancel.wait if cancel is not None else time.sleep)
+
+    def hedge_attempt(target_url, target_collector, done=None):
+        def run(cancel):
+            try:
+                return target_collector, ask(target_url, target_collector, cancel)
+            finally:
+                if done is not None:
+                    done.set()
+        return run
+
+    def end_hedge_session():
+        # Only once the hedge has stopped: between retries it could still
+        # re-send the question to the session.
+        def end():
+            hedge_done.wait()
+            _end_session_quietly(hedge_session)
+        threading.Thread(target=end, name="end-hedge", daemon=True).start()
+
+    hedge_sent, hedge_done = [], threading.Event()
+
+    try:
+        started = time.perf_counter()
+        delay = agentLatency.percentile(hedgePercentile) if hedgeRequests and hedge_session and not endSession else None
+        if delay is None:
+            trace_text, answer = ask(url, collector)
+        else:
+            hedge_collector = TraceCollector()
+
+            def on_hedge():
+                hedge_sent.append(True)
+                collector.add("hedge", f"No answer after {delay:.1f}s (p{hedgePercentile:g}); sent a hedged request")
+
+            winner, (trace_text, answer) = hedged(
+                hedge_attempt(url, TraceCollector()),
+                hedge_attempt(agent_url(hedge_session), hedge_collector, hedge_done),
+                delay,
+                on_hedge=on_hedge,
+            )
+            collector.extend(winner)
+            trace_text = collector.render()
+            if winner is hedge_collector:
+                if on_hedge_won is not None:
+                    on_hedge_won(hedge_session)
+            elif hedge_sent:
+                end_hedge_session()
+        if not answer.startswith(("Error", "HTTP Error", "No response")):
+            agentLatency.record(time.perf_counter() - started)
+        return trace_text, answer
+    except Exception as e:
+        if hedge_sent:
+            end_hedge_session()
         error_msg = f"Error making request to Bedrock agent: {str(e)}"
-        print(error_msg)
+        collector.add("error", error_msg)
         return error_msg, error_msg
 
 
 
 
-def decode_response(response):
+def response_chunks(response):
+    """Raw body chunks, also written to AGENT_STREAM_RECORD_DIR when set."""
+    if not streamRecordDir:
+        yield from response.iter_content(chunk_size=None)
+        return
+    os.makedirs(streamRecordDir, exist_ok=True)
+    path = os.path.join(streamRecordDir, f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.eventstream")
+    with open(path, "wb") as record:
+        for data in response.iter_content(chunk_size=None):
+            record.write(data)
+            yield data
+
+
+def read_event_stream(response, collector, cancel=None):
+    """Decode the binary event stream incrementally as bytes arrive.
+
+    Trace and other non-answer events go to ``collector``; the text of all
+    chunk events is returned. Stops early once ``cancel`` (a threading.Event)
+    is set.
+    """
+    chunks = []
+    for event in agent_events(response_chunks(response)):
+        if cancel is not None and cancel.is_set():
+            break
+        if event.type == "chunk":
+            chunks.append(event.text or "")
+        elif event.type == "trace":
+            collector.add("trace", data=event.data)
+        else:
+            collector.add(event.type, f"{event.type}:", event.data)
+    return "".join(chunks)
+
+
+def read_plain_response(text):
+    """Fallback for non-eventstream bodies (e.g. JSON error documents)."""
+    if not text or not text.strip():
+        return ""
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return text
+    if isinstance(parsed, dict):
+        final = parsed.get("finalResponse")
+        if isinstance(final, dict) and "text" in final:
+            return final["text"]
+        for key in ("completion", "output", "text", "message"):
+            if key in parsed:
+                return str(parsed[key])
+    return str(parsed)
+
+
+def decode_response(response, collector=None, cancel=None):
+    """Returns (trace text, answer) for an InvokeAgent HTTP response.
+
+    Retryable exception frames (e.g. throttlingException) are raised for the
+    caller to retry; other decoding errors become the answer text.
+    """
     # Check HTTP status code first
     if not hasattr(response, 'status_code'):
         error_msg = f"Invalid response object: {type(response)}"
@@ -117,192 +718,36 @@ def decode_response(response):
         error_msg = f"HTTP Error {response.status_code}: {error_text}"
         return error_msg, f"Error: {error_msg}"
     
-    # Create a StringIO object to capture print statements
-    captured_output = io.StringIO()
-    sys.stdout = captured_output
+    collector = collector or TraceCollector()
 
-    # Your existing logic - try to read the response
-    string = ""
-    try:
-        # First try to use iter_content for streaming responses
-        if hasattr(response, 'iter_content'):
-            for line in response.iter_content(chunk_size=None):
-                try:
-                    if isinstance(line, bytes):
-                        string += line.decode(encoding='utf-8')
-                    else:
-                        string += str(line)
-                except:
-                    continue
-        # Fallback to response.text if iter_content is not available or fails
-        if not string and hasattr(response, 'text'):
-            string = response.text
-        # Last fallback to response.content
-        if not string and hasattr(response, 'content'):
-            try:
-                string = response.content.decode('utf-8')
-            except:
-                string = str(response.content)
-    except Exception as e:
-        error_msg = f"Error reading response: {str(e)}"
-        sys.stdout = sys.__stdout__
-        return error_msg, error_msg
-
-    print("=" * 80)
-    print("RAW RESPONSE FROM BEDROCK (first 2000 chars):")
-    print(string[:2000] if string else "EMPTY")
-    print("=" * 80)
-    
-    # Check if response is empty
-    if not string or len(string.strip()) == 0:
-        error_msg = "Empty response received from Bedrock agent"
-        sys.stdout = sys.__stdout__
-        return error_msg, error_msg
-    
     final_response = ""
-    llm_response = ""
-    
     try:
-        split_response = string.split(":message-type")
-        print(f"Split Response: {split_response}")
-        print(f"length of split: {len(split_response)}")
-
-        # Try to find final response in bytes format
-        for idx in range(len(split_response)):
-            if "bytes" in split_response[idx]:
-                try:
-                    parts = split_response[idx].split("\"")
-                    if len(parts) > 3:
-                        encoded_last_response = parts[3]
-                        decoded = base64.b64decode(encoded_last_response)
-                        final_response = decoded.decode('utf-8')
-                        print(f"Found response in bytes format: {final_response}")
-                        break
-                except Exception as e:
-                    print(f"Error decoding bytes at index {idx}: {e}")
-                    continue
-            else:
-                print(f"no bytes at index {idx}")
-                print(split_response[idx])
-        
-        # If not found in bytes format, try to find in finalResponse format
-        if not final_response:
-            last_response = split_response[-1]
-            print(f"Last Response: {last_response}")
-            if "bytes" in last_response:
-                try:
-                    print("Bytes in last response")
-                    parts = last_response.split("\"")
-                    if len(parts) > 3:
-                        encoded_last_response = parts[3]
-                        decoded = base64.b64decode(encoded_last_response)
-                        final_response = decoded.decode('utf-8')
-                except Exception as e:
-                    print(f"Error decoding bytes in last response: {e}")
-            else:
-                print("no bytes in last response, trying finalResponse format")
-                try:
-                    final_response_idx = string.find('finalResponse')
-                    if final_response_idx != -1:
-                        part1 = string[final_response_idx + len('finalResponse":'):] 
-                        part2_end = part1.find('"}')
-                        if part2_end != -1:
-                            part2 = part1[:part2_end + 2]
-                            if part2 and part2.strip():
-                                try:
-                                    parsed = json.loads(part2)
-                                    if 'text' in parsed:
-                                        final_response = parsed['text']
-                                    else:
-                                        # Try to get the response text from other possible keys
-                                        final_response = str(parsed)
-                                except json.JSONDecodeError as je:
-                                    print(f"JSON decode error parsing part2: {je}, part2: {part2[:100]}")
-                                    final_response = string  # Fallback to raw string
-                            else:
-                                final_response = string  # Fallback to raw string
-                        else:
-                            # Try to parse the entire response as JSON
-                            try:
-                                if string and string.strip():
-                                    parsed = json.loads(string)
-                                    if 'finalResponse' in parsed and 'text' in parsed['finalResponse']:
-                                        final_response = parsed['finalResponse']['text']
-                            except json.JSONDecodeError as je:
-                                print(f"JSON decode error parsing full string: {je}")
-                                pass
-                            except Exception as e:
-                                print(f"Error parsing full string: {e}")
-                                pass
-                    else:
-                        # Try parsing the entire string as JSON
-                        try:
-                            # Check if string is empty before parsing
-                            if not string or not string.strip():
-                                final_response = "No response content received from agent"
-                            else:
-                                parsed = json.loads(string)
-                                # Look for common response patterns
-                                if isinstance(parsed, dict):
-                                    if 'completion' in parsed:
-                                        final_response = parsed['completion']
-                                    elif 'output' in parsed:
-                                        final_response = parsed['output']
-                                    elif 'text' in parsed:
-                                        final_response = parsed['text']
-                                    else:
-                                        final_response = str(parsed)
-                                else:
-                                    final_response = str(parsed)
-                        except json.JSONDecodeError as je:
-                            # If JSON parsing fails, use the raw string
-                            print(f"JSON decode error in decode_response: {je}")
-                            final_response = string if string else "No response content received from agent"
-                        except Exception as e:
-                            # If all parsing fails, use the raw string
-                            print(f"Error parsing response as JSON: {e}")
-                            final_response = string if string else "No response content received from agent"
-                except Exception as e:
-                    print(f"Error parsing finalResponse: {e}")
-                    final_response = string  # Fallback to raw string
-        
-        # Clean up the response
-        if final_response:
-            llm_response = final_response.replace("\"", "")
-            llm_response = llm_response.replace("{input:{value:", "")
-            llm_response = llm_response.replace(",source:null}}", "")
+        content_type = response.headers.get('content-type', '') if hasattr(response, 'headers') else ''
+        if EVENTSTREAM_CONTENT_TYPE in content_type:
+            final_response = read_event_stream(response, collector, cancel)
         else:
-            # If we still don't have a response, use the raw string
-            llm_response = string if string else "No response received from agent"
-        
-        print("=" * 80)
-        print(f"EXTRACTED final_response length: {len(final_response) if final_response else 0}")
-        print(f"EXTRACTED final_response preview: {final_response[:500] if final_response else 'EMPTY'}")
-        print(f"EXTRACTED llm_response length: {len(llm_response) if llm_response else 0}")
-        print(f"EXTRACTED llm_response preview: {llm_response[:500] if llm_response else 'EMPTY'}")
-        print("=" * 80)
-            
+            final_response = read_plain_response(response.text)
+    except EventStreamError as e:
+        if is_retryable(e):
+            raise
+        collector.add("error", f"Error decoding event stream: {e}")
+        final_response = f"Error decoding agent response: {e}"
     except Exception as e:
-        error_msg = f"Error parsing response: {str(e)}"
-        print(error_msg)
-        import traceback
-        print(traceback.format_exc())
-        llm_response = f"{error_msg}. Raw response: {string[:500]}"  # Include first 500 chars for debugging
-
-    # Restore original stdout
-    sys.stdout = sys.__stdout__
+        error_msg = f"Error reading response: {str(e)}"
+        return error_msg, error_msg
+    finally:
+        response.close()
 
-    # Get the string from captured output
-    captured_string = captured_output.getvalue()
-    
-    print("=" * 80)
-    print(f"RETURNING - captured_string length: {len(captured_string) if captured_string else 0}")
-    print(f"RETURNING - llm_response length: {len(llm_response) if llm_response else 0}")
-    print(f"RETURNING - llm_response: {llm_response[:200] if llm_response else 'EMPTY'}")
-    print("=" * 80)
+    # Clean up the response
+    if final_response:
+        llm_response = final_response.replace("\"", "")
+        llm_response = llm_response.replace("{input:{value:", "")
+        llm_response = llm_response.replace(",source:null}}", "")
+    else:
+        llm_response = "No response received from agent"
 
-    # Return both the captured output and the final response
-    return captured_string, llm_response
+    # Return both the trace output and the final response
+    return collector.render(), llm_response
 
 
 def lambda_handler(event, context):
@@ -312,6 +757,13 @@ def lambda_handler(event, context):
     endSession = False
     
     print(f"Session: {sessionId} asked question: {question}")
+
+    if not question and str(event.get("endSession", "")).lower() == "true":
+        ended = end_agent_session(sessionId)
+        return {
+            "status_code": 200 if ended else 502,
+            "body": json.dumps({"response": "", "trace_data": "Session ended" if ended else "Could not end the session"})
+        }
     
     # Validate inputs
     if not question:
@@ -335,15 +787,50 @@ def lambda_handler(event, context):
     except:
         endSession = False
     
-    url = f'https://bedrock-agent-runtime.{theRegion}.amazonaws.com/agents/{agentId}/agentAliases/{agentAliasId}/sessions/{sessionId}/text'
+    url = agent_url(sessionId)
     print(f"Calling Bedrock agent at: {url}")
 
+    # A question that starts a new session may be hedged in a second one and
+    # answered from the cache or a template.
+    newSession = str(event.get("newSession", "")).lower() in ("1", "true")
+    previous = None
+    if event.get("previousQuestion") and event.get("previousAnswer"):
+        previous = (event["previousQuestion"], event["previousAnswer"])
+    hedge_session = hedge_session_id(sessionId) if newSession else None
+    answered_in = []
+
     
+    bypassCache = endSession or str(event.get("bypassCache", "")).lower() in ("1", "true")
+
     try: 
         # askQuestion returns (captured_string, llm_response)
         # captured_string = trace/debug output
         # llm_response = actual agent response text
-        trace_output, agent_response = askQuestion(question, url, endSession)
+        collector = TraceCollector()
+        with collecting(collector):
+            cached = cached_answer(question, bypass=bypassCache, first_turn=newSession)
+        match = templated = None
+        if not cached and not endSession:
+            with collecting(collector):
+                match = match_sql_template(question, first_turn=newSession)
+                templated = template_answer(question, match) if match else None
+        answered_by = "agent"
+        if cached:
+            trace_output = f"Answered from cache (originally took {cached['latency_s']:.1f}s)\n\n{cached.get('trace', '')}"
+            agent_response = cached["answer"]
+            answered_by = "cache"
+        elif templated is not None:
+            trace_output, agent_response = collector.render(), templated
+            answered_by = "template"
+        else:
+            started = time.perf_counter()
+            trace_output, agent_response = askQuestion(question, url, endSession, collector, hedge_session, previous,
+                                                       on_hedge_won=answered_in.append)
+            if not endSession:
+                with collecting(collector):
+                    remember_answer(question, agent_response, trace_output, time.perf_counter() - started,
+                                    first_turn=newSession)
+                learn_sql_template(question, agent_response, collector, match, first_turn=newSession)
         
         print("=" * 80)
         print(f"lambda_handler - after askQuestion:")
@@ -375,8 +862,12 @@ def lambda_handler(event, context):
         # This matches what the frontend expects
         result = {
             "response": trace_output,  # Debug/trace output goes here
-            "trace_data": agent_response  # Actual agent answer goes here
+            "trace_data": agent_response,  # Actual agent answer goes here
+            "answered_by": answered_by  # "cache" and "template" answers never reached the agent session
         }
+        if answered_in:
+            # The hedged request won: continue the conversation in its session.
+            result["session_id"] = answered_in[0]
         
         print("=" * 80)
         print(f"lambda_handler - result dict:")
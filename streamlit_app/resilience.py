@@ -0,0 +1,251 @@
+"""Retries, a retry budget and hedged requests for agent calls.
+
+``askQuestion`` used to make exactly one attempt, so a 429 from Bedrock
+throttling or a transient 5xx reached the user as an error message. This
+module decides what is worth another attempt and when:
+
+* ``is_retryable`` classifies failures: HTTP 429/500/502/503/504, connection
+  errors and connect timeouts, and the agent's retryable exception frames
+  (``throttlingException``, ``internalServerException``, ...). Client errors
+  such as access denied or validation errors are never retried.
+* ``RetryPolicy`` waits with exponential backoff and full jitter between
+  attempts, but never less than the server's ``Retry-After``.
+* ``RetryBudget`` caps retries process-wide at a fraction of first attempts
+  (plus a small floor), so an outage is not multiplied into a retry storm.
+* ``hedged`` starts a second, identical request when the first has not
+  finished after a delay (``LatencyTracker`` supplies the observed p95) and
+  returns whichever finishes first. Only use it for idempotent calls: for the
+  agent that means a question asked in a new session of its own.
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+import requests
+
+from eventstream import EventStreamError
+
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+RETRYABLE_EXCEPTION_TYPES = (
+    "throttlingException",
+    "internalServerException",
+    "serviceUnavailableException",
+    "modelNotReadyException",
+)
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+DEFAULT_BUDGET_RATIO = 0.2
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+
+
+class RetryableError(Exception):
+    """A failed attempt that may succeed when repeated."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None, status: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a ``Retry-After`` header (delta-seconds or HTTP date)."""
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def check_response(response: requests.Response) -> requests.Response:
+    """Return the response, or close it and raise ``RetryableError`` for 429/5xx."""
+
+    if response.status_code not in RETRYABLE_STATUS:
+        return response
+    error_type = response.headers.get("x-amzn-ErrorType", "").split(":")[0]
+    label = f"HTTP Error {response.status_code}" + (f" {error_type}" if error_type else "")
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    try:
+        text = response.text[:300]
+    finally:
+        response.close()
+    raise RetryableError(
+        f"{label}: {text}",
+        retry_after=retry_after,
+        status=response.status_code,
+    )
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, RetryableError):
+        return True
+    if isinstance(exc, requests.ConnectionError):
+        # Includes ConnectTimeout; a ReadTimeout (the agent took too long) is not repeated.
+        return True
+    if isinstance(exc, EventStreamError):
+        return str(exc).startswith(RETRYABLE_EXCEPTION_TYPES)
+    return False
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait after failed attempt number ``attempt`` (1-based)."""
+
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            backoff = max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+
+class RetryBudget:
+    """Token bucket: every first attempt deposits ``ratio`` tokens, every retry spends one.
+
+    ``min_per_second`` tokens are added over time regardless of traffic, so a
+    quiet process can still retry occasionally.
+    """
+
+    def __init__(self, ratio: float = DEFAULT_BUDGET_RATIO, min_per_second: float = 0.5, max_tokens: float = 20.0) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self, amount: float = 0.0) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_attempt(self) -> None:
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens < 1.0:
+                self.exhausted += 1
+                return False
+            self._tokens -= 1.0
+            self.retries += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill()
+            return {"retries": self.retries, "exhausted": self.exhausted, "tokens": round(self._tokens, 2)}
+
+
+def call_with_retries(
+    attempt: Callable[[int], T],
+    *,
+    policy: RetryPolicy,
+    budget: Optional[RetryBudget] = None,
+    on_retry: Optional[Callable[[int, BaseException, float], None]] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """Call ``attempt(n)`` until it succeeds, fails for good or runs out of attempts/budget."""
+
+    if budget is not None:
+        budget.record_attempt()
+    number = 1
+    while True:
+        try:
+            return attempt(number)
+        except Exception as exc:
+            if not is_retryable(exc) or number >= policy.max_attempts:
+                raise
+            if budget is not None and not budget.try_spend():
+                raise
+            delay = policy.delay(number, getattr(exc, "retry_after", None))
+            if on_retry:
+                on_retry(number, exc, delay)
+            sleep(delay)
+            number += 1
+
+
+class LatencyTracker:
+    """Recent successful latencies, for choosing the hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES) -> None:
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+def hedged(
+    primary: Callable[[threading.Event], T],
+    backup: Callable[[threading.Event], T],
+    delay: float,
+    on_hedge: Optional[Callable[[], None]] = None,
+) -> T:
+    """Run ``primary``; if it is still running after ``delay`` seconds, also run ``backup``.
+
+    Returns the first successful result (or raises the last error if both
+    fail). Each call gets a ``threading.Event`` that is set when the other one
+    has won, so it can stop reading and release its connection.
+    """
+
+    cancel_primary, cancel_backup = threading.Event(), threading.Event()
+    first = _hedge_pool.submit(primary, cancel_primary)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+    if on_hedge:
+        on_hedge()
+    second = _hedge_pool.submit(backup, cancel_backup)
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                (cancel_backup if future is first else cancel_primary).set()
+                return future.result()
+            error = future.exception()
+    assert error is not None
+    raise error
@@ -0,0 +1,166 @@
+"""Query results from the agent's trace, as typed tables for the UI.
+
+The rows of an ``/athenaQuery`` call only reached the page as text the model
+wrote into its answer, so results could not be sorted and every row cost
+output tokens. The action Lambda's response is also in the trace, as the
+``actionGroupInvocationOutput`` observation of the call. ``ResultCapture``
+reads it there while the answer streams, pairs it with the call's SQL by
+``traceId`` and keeps one ``QueryResult`` per call: column names, Athena
+types and rows converted to Python values. ``QueryResult.frame`` builds the
+pandas DataFrame once, with nullable dtypes that convert cleanly to the
+Arrow table ``st.dataframe`` sends to the browser.
+
+``/columnValues`` responses (value/count lists) are captured the same way.
+"""
+
+from __future__ import annotations
+
+import ast
+import json
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict, List, Optional
+
+
+_INTEGER_TYPES = {"tinyint", "smallint", "integer", "int", "bigint"}
+_FLOAT_TYPES = {"double", "float", "real"}
+
+
+def _to_bool(value: str) -> Optional[bool]:
+    return {"true": True, "false": False}.get(value.lower())
+
+
+def _to_timestamp(value: str) -> datetime:
+    # Athena writes "2024-05-01 13:45:00.000"; drop a zone name if present.
+    return datetime.fromisoformat(" ".join(value.split(" ")[:2]))
+
+
+def value_converter(athena_type: str) -> Callable[[str], Any]:
+    athena_type = (athena_type or "varchar").lower()
+    if athena_type in _INTEGER_TYPES:
+        return int
+    if athena_type in _FLOAT_TYPES:
+        return float
+    if athena_type.startswith("decimal"):
+        return Decimal
+    if athena_type == "boolean":
+        return _to_bool
+    if athena_type == "date":
+        return date.fromisoformat
+    if athena_type.startswith("timestamp"):
+        return _to_timestamp
+    return str
+
+
+def parse_action_output(text: Any) -> Optional[Any]:
+    """The action Lambda's response body from the observation text, or None."""
+
+    if not isinstance(text, str):
+        return text
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        # The agent may pass the body on in Python repr form.
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+@dataclass
+class QueryResult:
+    columns: List[str]
+    types: List[str]
+    rows: List[List[Any]]
+    sql: Optional[str] = None
+    api_path: str = "/athenaQuery"
+    query_execution_id: Optional[str] = None
+    _frame: Any = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_athena(cls, result: Dict[str, Any], sql: Optional[str] = None) -> Optional["QueryResult"]:
+        """From a ``GetQueryResults`` response; None when it has no column metadata."""
+
+        result_set = result.get("ResultSet") or {}
+        info = (result_set.get("ResultSetMetadata") or {}).get("ColumnInfo") or []
+        if not info:
+            return None
+        columns = [column.get("Label") or column.get("Name") or f"_col{i}" for i, column in enumerate(info)]
+        types = [column.get("Type", "varchar") for column in info]
+        converters = [value_converter(t) for t in types]
+        rows = [[cell.get("VarCharValue") for cell in row.get("Data", [])] for row in result_set.get("Rows", [])]
+        # SELECT results repeat the column names as their first row.
+        if rows and rows[0] == [column.get("Name") for column in info]:
+            rows = rows[1:]
+        typed = []
+        for row in rows:
+            values = []
+            for convert, value in zip(converters, row):
+                try:
+                    values.append(None if value is None else convert(value))
+                except (ValueError, TypeError, InvalidOperation):
+                    values.append(value)
+            typed.append(values)
+        return cls(columns, types, typed, sql=sql, query_execution_id=result.get("QueryExecutionId"))
+
+    @classmethod
+    def from_column_values(cls, body: Dict[str, Any]) -> Optional["QueryResult"]:
+        values = body.get("values")
+        if not isinstance(values, list):
+            return None
+        rows = [[item.get("value"), item.get("count")] for item in values if isinstance(item, dict)]
+        return cls(["value", "count"], ["varchar", "bigint"], rows, sql=body.get("column"), api_path="/columnValues")
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows)
+
+    @property
+    def frame(self):
+        """The rows as a pandas DataFrame, built on first use."""
+
+        if self._frame is None:
+            import pandas as pd
+
+            frame = pd.DataFrame.from_records(self.rows, columns=self.columns)
+            for name, athena_type in zip(self.columns, self.types):
+                athena_type = athena_type.lower()
+                if athena_type.startswith("decimal"):
+                    frame[name] = pd.to_numeric(frame[name], errors="coerce")
+                elif athena_type in ("date",) or athena_type.startswith("timestamp"):
+                    frame[name] = pd.to_datetime(frame[name], errors="coerce")
+            self._frame = frame.convert_dtypes()
+        return self._frame
+
+
+class ResultCapture:
+    """Feed it the agent's trace parts; ``results`` holds one entry per action call."""
+
+    def __init__(self) -> None:
+        self.results: List[QueryResult] = []
+        self._calls: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, part: Dict[str, Any]) -> Optional[QueryResult]:
+        orchestration = part.get("trace", part).get("orchestrationTrace") or {}
+        invocation = orchestration.get("invocationInput") or {}
+        if "actionGroupInvocationInput" in invocation:
+            self._calls[invocation.get("traceId", "")] = invocation["actionGroupInvocationInput"]
+            return None
+        output = (orchestration.get("observation") or {}).get("actionGroupInvocationOutput")
+        if not output:
+            return None
+        call = self._calls.pop((orchestration.get("observation") or {}).get("traceId", ""), {})
+        body = parse_action_output(output.get("text"))
+        if not isinstance(body, dict):
+            return None
+        if "ResultSet" in body:
+            properties = (call.get("requestBody") or {}).get("content", {}).get("application/json", [])
+            sql = next((str(prop.get("value")) for prop in properties if prop.get("value")), None)
+            result = QueryResult.from_athena(body, sql)
+        else:
+            result = QueryResult.from_column_values(body)
+        if result is not None:
+            self.results.append(result)
+        return result
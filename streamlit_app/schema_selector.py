@@ -0,0 +1,275 @@
+"""Pick the table columns relevant to a question before it reaches the agent.
+
+The orchestration prompt used to embed the DDL of every column of every table
+(223 for ``test_population`` alone) on every turn. ``SchemaIndex`` is a small
+inverted index over each column's sanitized name, its original label from
+``schema/column-maps/*.json`` (e.g. ``"reporting date [1.1]"``, including the
+``1.1`` field reference) and an optional description. For a question it ranks
+the columns with BM25 and returns the top-K plus a fixed set of key columns,
+rendered as a compact DDL that ``invoke_agent`` passes to the agent as a
+prompt session attribute. When no column scores at least ``min_score`` (e.g.
+"How many records are there?") the question says nothing about the schema
+and the full schema is rendered instead.
+
+The index is built offline into a JSON file shipped with the app:
+
+    python schema_selector.py build \
+        --column-maps ../schema/column-maps --database txt2sql_dev_athena_db \
+        --output schema_index.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+INDEX_FORMAT_VERSION = 1
+DEFAULT_TOP_K = 25
+DEFAULT_MIN_SCORE = 3.0
+DEFAULT_MANDATORY_COLUMNS = ("kr_record_key", "incident_code", "incident_description")
+
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+_NAME_WEIGHT = 2
+_LABEL_WEIGHT = 2
+_PHRASE_BONUS = 5.0
+
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)+|[a-z0-9]+")
+_STOP_WORDS = frozenset(
+    """
+    a about all an and any are as at be by can count data did do does each for from
+    give had has have how i in is it its list many me much my no not of on or per
+    please records rows select show than that the their them there these this those
+    to top was were what when where which who with within without you
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with light plural stripping; keeps ``2.15`` refs."""
+
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower().replace("_", " ")):
+        if token in _STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class SchemaIndex:
+    """BM25 index over the columns of one or more tables."""
+
+    def __init__(self, data: Dict) -> None:
+        self.data = data
+        self.database: str = data["database"]
+        self.columns: List[Dict] = data["columns"]
+        self.mandatory: List[str] = data.get("mandatory_columns", [])
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._lengths: List[int] = []
+        for idx, column in enumerate(self.columns):
+            counts = Counter(column["tokens"])
+            self._lengths.append(sum(counts.values()))
+            for token, freq in counts.items():
+                self._postings[token].append((idx, freq))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 1.0
+
+    @classmethod
+    def build(
+        cls,
+        column_maps: Dict[str, Dict[str, str]],
+        *,
+        database: str,
+        descriptions: Optional[Dict[str, Dict[str, str]]] = None,
+        mandatory_columns: Sequence[str] = DEFAULT_MANDATORY_COLUMNS,
+    ) -> "SchemaIndex":
+        """Build from ``{table: {sanitized: original label}}`` column maps."""
+
+        descriptions = descriptions or {}
+        columns = []
+        for table in sorted(column_maps):
+            table_descriptions = descriptions.get(table, {})
+            for name, label in column_maps[table].items():
+                description = table_descriptions.get(name, "")
+                tokens = (
+                    tokenize(name) * _NAME_WEIGHT
+                    + tokenize(label) * _LABEL_WEIGHT
+                    + tokenize(description)
+                )
+                columns.append(
+                    {
+                        "table": table,
+                        "name": name,
+                        "label": label,
+                        "description": description,
+                        "tokens": tokens,
+                    }
+                )
+        return cls(
+            {
+                "format_version": INDEX_FORMAT_VERSION,
+                "database": database,
+                "mandatory_columns": list(mandatory_columns),
+                "columns": columns,
+            }
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "SchemaIndex":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported schema index format in {path}")
+        return cls(data)
+
+    def save(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.data, separators=(",", ":")), encoding="utf-8")
+
+    def tables(self) -> List[str]:
+        return sorted({column["table"] for column in self.columns})
+
+    def score(self, question: str) -> List[Tuple[float, int]]:
+        query = tokenize(question)
+        lowered = question.lower()
+        total = len(self.columns)
+        scores: Dict[int, float] = defaultdict(float)
+
+        for token in set(query):
+            # Bare numbers ("top 5", "2024") are values, not field references
+            # like "2.15", and would match the digits of unrelated columns.
+            if token.isdigit():
+                continue
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for idx, freq in postings:
+                norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * self._lengths[idx] / self._avg_length)
+                scores[idx] += idf * freq * (_BM25_K1 + 1) / (freq + norm)
+
+        # Quoting an exact label or column name should always win.
+        for idx in list(scores):
+            column = self.columns[idx]
+            if column["label"].lower() in lowered or column["name"] in lowered:
+                scores[idx] += _PHRASE_BONUS
+
+        return sorted(((score, idx) for idx, score in scores.items()), reverse=True)
+
+    def select(self, question: str, top_k: int = DEFAULT_TOP_K) -> Dict[str, List[Dict]]:
+        """Return ``{table: [column, ...]}`` with mandatory columns first."""
+
+        ranked = [self.columns[idx] for _, idx in self.score(question)[:top_k]]
+        tables = {column["table"] for column in ranked} or set(self.tables())
+
+        selected: Dict[str, List[Dict]] = {}
+        for table in sorted(tables):
+            chosen = [
+                column
+                for column in self.columns
+                if column["table"] == table and column["name"] in self.mandatory
+            ]
+            names = {column["name"] for column in chosen}
+            for column in ranked:
+                if column["table"] == table and column["name"] not in names:
+                    chosen.append(column)
+                    names.add(column["name"])
+            selected[table] = chosen
+        return selected
+
+    def render(self, selected: Dict[str, List[Dict]]) -> str:
+        """Compact DDL with the original label as an inline comment."""
+
+        blocks = []
+        for table, columns in selected.items():
+            lines = []
+            for position, column in enumerate(columns, start=1):
+                hint = column["label"]
+                if column.get("description"):
+                    hint = f"{hint}: {column['description']}"
+                separator = "," if position < len(columns) else ""
+                lines.append(f"  `{column['name']}` STRING{separator} -- {hint}")
+            blocks.append(
+                f"CREATE EXTERNAL TABLE {self.database}.{table} (\n" + "\n".join(lines) + "\n)"
+            )
+        return "\n\n".join(blocks)
+
+    def render_all(self) -> str:
+        grouped: Dict[str, List[Dict]] = defaultdict(list)
+        for column in self.columns:
+            grouped[column["table"]].append(column)
+        return self.render(dict(grouped))
+
+    def pruned_schema(self, question: str, top_k: int = DEFAULT_TOP_K, min_score: float = DEFAULT_MIN_SCORE) -> str:
+        """Pruned DDL, or the full schema when no column matches well enough."""
+
+        ranked = self.score(question)
+        if not ranked or ranked[0][0] < min_score:
+            return self.render_all()
+        return self.render(self.select(question, top_k=top_k))
+
+
+def load_column_maps(directory: Path) -> Dict[str, Dict[str, str]]:
+    return {
+        path.stem: json.loads(path.read_text(encoding="utf-8"))
+        for path in sorted(Path(directory).glob("*.json"))
+    }
+
+
+def load_descriptions(directory: Optional[Path], tables: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    if not directory:
+        return {}
+    descriptions = {}
+    for table in tables:
+        path = Path(directory) / f"{table}.json"
+        if path.exists():
+            descriptions[table] = json.loads(path.read_text(encoding="utf-8"))
+    return descriptions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build or query the schema selection index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build the index from column maps")
+    build.add_argument("--column-maps", type=Path, required=True, help="Directory of column map JSON files")
+    build.add_argument("--descriptions", type=Path, default=None,
+                       help="Optional directory of {column: description} JSON files per table")
+    build.add_argument("--database", required=True, help="Athena database the tables live in")
+    build.add_argument("--mandatory", action="append", default=None,
+                       help="Column always included; repeat (default: key columns)")
+    build.add_argument("--output", type=Path, default=Path("schema_index.json"))
+
+    query = sub.add_parser("query", help="Show the pruned schema for a question")
+    query.add_argument("--index", type=Path, default=Path("schema_index.json"))
+    query.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    query.add_argument("--min-score", type=float, default=DEFAULT_MIN_SCORE,
+                       help="Below this best column score the full schema is shown")
+    query.add_argument("question")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "build":
+        column_maps = load_column_maps(args.column_maps)
+        index = SchemaIndex.build(
+            column_maps,
+            database=args.database,
+            descriptions=load_descriptions(args.descriptions, column_maps),
+            mandatory_columns=args.mandatory or DEFAULT_MANDATORY_COLUMNS,
+        )
+        index.save(args.output)
+        print(f"Indexed {len(index.columns)} column(s) from {len(column_maps)} table(s) into {args.output}")
+    else:
+        index = SchemaIndex.load(args.index)
+        print(index.pruned_schema(args.question, top_k=args.top_k, min_score=args.min_score))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""One Bedrock agent session per Streamlit session, with idle expiry.
+
+Every browser tab used to talk to the agent as ``"MYSESSION"``: all users
+shared one conversation memory, and Bedrock serializes the requests of a
+session, so concurrent users also queued behind each other.
+
+``SessionManager`` hands each Streamlit session its own agent session id
+(random, so ids from different App Runner instances never collide) and
+remembers when it was last used. A session that has been idle longer than
+``idle_timeout`` is ended and replaced on its next use; a background sweep
+ends the sessions of tabs that were simply closed. Ending calls
+``end_session(session_id)``, which sends ``endSession`` to the agent.
+``adopt`` switches a Streamlit session to another agent session, e.g. the one
+a hedged first question was answered in, and ends the one it replaces.
+
+``active_count()`` is per process. With ``DynamoDBSessionRegistry`` (a table
+with partition key ``session_id`` and TTL on ``expires_at``) every instance
+also records its sessions there and ``registry_count()`` covers all of them.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, MutableMapping, Optional
+
+
+DEFAULT_IDLE_TIMEOUT = 1800.0
+DEFAULT_SWEEP_INTERVAL = 60.0
+STATE_KEY = "agent_session"
+
+
+def new_session_id() -> str:
+    return f"st-{uuid.uuid4().hex}"
+
+
+class DynamoDBSessionRegistry:
+    """Shared record of live sessions, for counts across instances."""
+
+    def __init__(self, table_name: str, region: Optional[str] = None, instance_id: str = "") -> None:
+        import boto3
+
+        self.table = boto3.resource("dynamodb", region_name=region).Table(table_name)
+        self.instance_id = instance_id
+
+    def touch(self, session_id: str, expires_at: float) -> None:
+        self.table.put_item(
+            Item={"session_id": session_id, "instance_id": self.instance_id, "expires_at": int(expires_at)}
+        )
+
+    def remove(self, session_id: str) -> None:
+        self.table.delete_item(Key={"session_id": session_id})
+
+    def count(self) -> int:
+        from boto3.dynamodb.conditions import Attr
+
+        total, kwargs = 0, {"Select": "COUNT", "FilterExpression": Attr("expires_at").gt(int(time.time()))}
+        while True:
+            page = self.table.scan(**kwargs)
+            total += page["Count"]
+            if "LastEvaluatedKey" not in page:
+                return total
+            kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+
+class SessionManager:
+    def __init__(
+        self,
+        end_session: Callable[[str], Any],
+        *,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        sweep_interval: float = DEFAULT_SWEEP_INTERVAL,
+        registry: Optional[DynamoDBSessionRegistry] = None,
+    ) -> None:
+        self.end_session = end_session
+        self.idle_timeout = idle_timeout
+        self.registry = registry
+        self._last_used: Dict[str, float] = {}
+        self._registered: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self._stop = threading.Event()
+        if sweep_interval > 0:
+            threading.Thread(target=self._sweep_loop, args=(sweep_interval,), name="session-sweep", daemon=True).start()
+
+    def session_for(self, state: MutableMapping[str, Any]) -> str:
+        """The agent session id for a Streamlit ``session_state``, renewed when idle too long."""
+
+        session_id = state.get(STATE_KEY)
+        now = time.time()
+        with self._lock:
+            last_used = self._last_used.get(session_id) if session_id else None
+        if session_id and last_used is not None and now - last_used > self.idle_timeout:
+            self.end(session_id, reason="idle")
+            session_id = None
+        elif session_id and last_used is None:
+            # Swept in the background (or from before a restart): start afresh.
+            session_id = None
+        started = not session_id
+        if started:
+            session_id = new_session_id()
+            state[STATE_KEY] = session_id
+            with self._lock:
+                self.created += 1
+        self.touch(session_id)
+        if started:
+            print(f"Agent session {session_id} started ({self.active_count()} active in this process)")
+        return session_id
+
+    def touch(self, session_id: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._last_used[session_id] = now
+            register = self.registry is not None and now - self._registered.get(session_id, 0.0) > 60
+            if register:
+                self._registered[session_id] = now
+        if register:
+            try:
+                self.registry.touch(session_id, now + self.idle_timeout)
+            except Exception as e:
+                print(f"Session registry update failed: {e}")
+
+    def end(self, session_id: str, reason: str = "ended") -> None:
+        with self._lock:
+            known = self._last_used.pop(session_id, None) is not None
+            self._registered.pop(session_id, None)
+            if reason == "idle":
+                self.expired += 1
+        try:
+            self.end_session(session_id)
+        except Exception as e:
+            print(f"Ending agent session {session_id} failed: {e}")
+        if self.registry is not None:
+            try:
+                self.registry.remove(session_id)
+            except Exception as e:
+                print(f"Session registry update failed: {e}")
+        if known:
+            print(f"Agent session {session_id} {reason} ({self.active_count()} active in this process)")
+
+    def adopt(self, state: MutableMapping[str, Any], session_id: str) -> None:
+        """Continue the Streamlit session's conversation in ``session_id``."""
+
+        previous = state.get(STATE_KEY)
+        if previous == session_id:
+            return
+        state[STATE_KEY] = session_id
+        self.touch(session_id)
+        if previous:
+            self.end(previous, reason="replaced")
+
+    def release(self, state: MutableMapping[str, Any]) -> None:
+        """End the Streamlit session's agent session (the "End Session" button)."""
+
+        session_id = state.pop(STATE_KEY, None)
+        if session_id:
+            self.end(session_id)
+
+    def sweep(self) -> int:
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            idle = [session_id for session_id, last in self._last_used.items() if last < cutoff]
+        for session_id in idle:
+            self.end(session_id, reason="idle")
+        return len(idle)
+
+    def _sweep_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.sweep()
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._last_used)
+
+    def registry_count(self) -> Optional[int]:
+        if self.registry is None:
+            return None
+        try:
+            return self.registry.count()
+        except Exception as e:
+            print(f"Session registry count failed: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self.active_count(), "created": self.created, "expired": self.expired}
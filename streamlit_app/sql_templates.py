@@ -0,0 +1,375 @@
+"""Reuse the SQL the agent generated for earlier questions of the same shape.
+
+Most of the cost of an answer is the orchestration that writes the SQL, and
+for "Show me 5 incidents with code E_A_C_09" versus "Show me 10 incidents with
+code E_A_D_01" that SQL differs only in its literals. ``TemplateStore.learn``
+takes a successful question and the single ``/athenaQuery`` SQL from its
+trace, finds the SQL literals that also occur in the question and turns both
+into a template with slots::
+
+    question: show {0} incidents with code {1}
+    sql:      SELECT * FROM test_population WHERE incident_code = '{1}' LIMIT {0}
+
+Questions are tokenized like ``answer_cache.normalize_question``, except that
+values such as ISO dates (``2024-11-29``) or hyphenated codes stay one token,
+so a quoted ``'2024-11-29'`` in the SQL becomes a slot like any other value.
+A literal only becomes a slot when its value occurs exactly once in the
+question. Numbers must also occur once in the SQL and be neither a function
+argument nor a ``GROUP BY``/``ORDER BY`` position: in "top 1 code" with
+``SELECT count(1) ... LIMIT 1`` it is not clear which ``1`` came from the
+question, so both stay fixed.
+
+``TemplateStore.match`` aligns a new question with each template. Every fixed
+word other than a function word ("of", "in", "the", ...) must match exactly
+and in order, so "credit asset class" never matches a template learned from
+"interest rate asset class". The confidence is the similarity of the function
+words (1.0 for an exact shape). The match carries the SQL with the new values
+filled in; values are validated per slot kind and quoted, so a question
+cannot inject SQL.
+
+In ``shadow`` mode matches are only compared with the SQL the agent then
+writes. Agreements are counted per exact question shape (the question with
+its slot values replaced), and ``verified`` for that shape can be made a
+precondition for serving in ``on`` mode.
+
+Served templates go straight to the action-group Lambda (``LambdaExecutor``),
+the same code path the agent uses, so label rewriting and the Athena settings
+stay in one place and the answer costs Athena time only.
+"""
+
+from __future__ import annotations
+
+import difflib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from answer_cache import normalize_question
+
+
+TEMPLATE_FORMAT_VERSION = 2
+DEFAULT_MIN_CONFIDENCE = 0.92
+DEFAULT_MAX_TEMPLATES = 2000
+DEFAULT_MAX_ROWS = 50
+
+_SQL_LITERAL_RE = re.compile(r"'((?:[^']|'')*)'|(?<![\w.])(\d+(?:\.\d+)?)(?![\w.])")
+_NUMBER_RE = re.compile(r"^\d+(?:\.\d+)?$")
+_CODE_RE = re.compile(r"^[0-9a-z_.:/-]+$")
+# Dates, times and codes like "2024-11-29" or "ab-12" are kept as one token.
+_VALUE_RE = re.compile(r"[0-9a-z_]+(?:[-/:][0-9a-z_]+)+")
+_FUNCTION_WORDS = frozenset(
+    "of in on at to for from with by as is are was were be been do does did there".split()
+)
+_SLOT_RE = re.compile(r"^\{(\d+)\}$")
+# Numbers right after these are arguments or column positions, not values.
+_NOT_A_VALUE_RE = re.compile(r"(?:[(,]|\bby)\s*$", re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    """Whitespace/case-insensitive form for comparing generated SQL."""
+
+    return re.sub(r"\s+", " ", sql.strip().rstrip(";")).lower()
+
+
+def _case_style(value: str) -> str:
+    if value.isupper():
+        return "upper"
+    if value.islower():
+        return "lower"
+    return "asis"
+
+
+def _is_literal_token(token: str) -> bool:
+    return bool(_NUMBER_RE.match(token)) or any(ch.isdigit() for ch in token) or "_" in token
+
+
+def tokenize_question(text: str) -> List[str]:
+    """``normalize_question`` tokens, with date- and code-like values kept whole."""
+
+    lowered = text.lower()
+    tokens: List[str] = []
+    position = 0
+    for match in _VALUE_RE.finditer(lowered):
+        if not any(ch.isdigit() for ch in match.group(0)):
+            continue
+        tokens += normalize_question(lowered[position:match.start()]).split()
+        tokens.append(match.group(0))
+        position = match.end()
+    return tokens + normalize_question(lowered[position:]).split()
+
+
+def _content_words(tokens: List[str]) -> List[str]:
+    return [token for token in tokens if token not in _FUNCTION_WORDS]
+
+
+def _function_words(tokens: List[str]) -> List[str]:
+    return [token for token in tokens if token in _FUNCTION_WORDS]
+
+
+class Template:
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        self.tokens: List[str] = data["question_tokens"]
+        self.fixed = [token for token in self.tokens if not _SLOT_RE.match(token)]
+
+    @property
+    def id(self) -> str:
+        return self.data["id"]
+
+    def fill(self, values: Dict[int, str], raw_question: str) -> Optional[str]:
+        sql = self.data["sql_template"]
+        for index, slot in enumerate(self.data["slots"]):
+            value = values.get(index)
+            if value is None:
+                return None
+            if slot["kind"] == "number":
+                if not _NUMBER_RE.match(value):
+                    return None
+                rendered = value
+            else:
+                if not _CODE_RE.match(value):
+                    return None
+                match = re.search(re.escape(value), raw_question, re.IGNORECASE)
+                original = match.group(0) if match else value
+                rendered = {"upper": original.upper(), "lower": original.lower()}.get(slot["case"], original)
+                rendered = rendered.replace("'", "''")
+            sql = sql.replace(f"{{{index}}}", rendered)
+        return sql
+
+
+class TemplateStore:
+    """Question -> SQL templates, persisted to a JSON file when a path is given."""
+
+    def __init__(self, path: Optional[Path] = None, max_templates: int = DEFAULT_MAX_TEMPLATES) -> None:
+        self.path = Path(path) if path else None
+        self.max_templates = max_templates
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Template] = {}
+        if self.path and self.path.exists():
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data.get("format_version") == TEMPLATE_FORMAT_VERSION:
+                self._templates = {t["id"]: Template(t) for t in data["templates"]}
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        payload = {
+            "format_version": TEMPLATE_FORMAT_VERSION,
+            "templates": [t.data for t in self._templates.values()],
+        }
+        tmp_path.write_text(json.dumps(payload, indent=1, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def learn(self, question: str, sql: str) -> Optional[Template]:
+        """Record a question/SQL pair; returns the (new or existing) template."""
+
+        if not normalize_sql(sql).startswith(("select", "with")):
+            return None
+        tokens = tokenize_question(question)
+        sql = sql.strip().rstrip(";")
+        slots: List[Dict[str, str]] = []
+        used: Dict[str, int] = {}
+
+        def literal(match: re.Match) -> Tuple[str, str, str]:
+            text = match.group(1) if match.group(1) is not None else match.group(2)
+            kind = "string" if match.group(1) is not None else "number"
+            candidate = " ".join(tokenize_question(text.replace("''", "'") if kind == "string" else text))
+            return text, kind, candidate
+
+        numbers: Dict[str, int] = {}
+        for match in _SQL_LITERAL_RE.finditer(sql):
+            _, kind, candidate = literal(match)
+            if kind == "number":
+                numbers[candidate] = numbers.get(candidate, 0) + 1
+
+        def replace(match: re.Match) -> str:
+            text, kind, candidate = literal(match)
+            if not candidate or " " in candidate or tokens.count(candidate) != 1:
+                return match.group(0)
+            if kind == "number" and (numbers[candidate] > 1 or _NOT_A_VALUE_RE.search(sql, 0, match.start())):
+                return match.group(0)
+            if candidate not in used:
+                used[candidate] = len(slots)
+                slots.append({"kind": kind, "case": _case_style(text) if kind == "string" else "asis"})
+            index = used[candidate]
+            return f"'{{{index}}}'" if kind == "string" else f"{{{index}}}"
+
+        sql_template = _SQL_LITERAL_RE.sub(replace, sql)
+        question_tokens = [f"{{{used[t]}}}" if t in used else t for t in tokens]
+        template_id = " ".join(question_tokens)
+
+        with self._lock:
+            existing = self._templates.get(template_id)
+            if existing:
+                existing.data["seen"] += 1
+                if normalize_sql(existing.data["sql_template"]) != normalize_sql(sql_template):
+                    # The agent answers this shape differently now; trust the latest.
+                    existing.data.update(sql_template=sql_template, slots=slots, verified=0, shapes={})
+                self._save()
+                return existing
+            template = Template(
+                {
+                    "id": template_id,
+                    "question_tokens": question_tokens,
+                    "sql_template": sql_template,
+                    "slots": slots,
+                    "example_question": question,
+                    "example_sql": sql,
+                    "created_at": time.time(),
+                    "seen": 1,
+                    "served": 0,
+                    "verified": 0,
+                    "mismatched": 0,
+                    "shapes": {},
+                }
+            )
+            self._templates[template_id] = template
+            if len(self._templates) > self.max_templates:
+                oldest = min(self._templates.values(), key=lambda t: (t.data["seen"], t.data["created_at"]))
+                del self._templates[oldest.id]
+            self._save()
+            return template
+
+    def match(self, question: str) -> Optional[Tuple[Template, float, str]]:
+        """Best ``(template, confidence, sql)`` for the question, if any slot-complete match."""
+
+        tokens = tokenize_question(question)
+        best: Optional[Tuple[Template, float, str]] = None
+        with self._lock:
+            templates = list(self._templates.values())
+        for template in templates:
+            values, confidence, _ = self._align(template, tokens)
+            if values is None or (best and confidence <= best[1]):
+                continue
+            sql = template.fill(values, question)
+            if sql is not None:
+                best = (template, confidence, sql)
+        return best
+
+    @staticmethod
+    def _align(template: Template, tokens: List[str]) -> Tuple[Optional[Dict[int, str]], float, str]:
+        """Slot values, confidence and shape of the question; ``(None, 0.0, "")`` if it does not fit."""
+
+        matcher = difflib.SequenceMatcher(a=template.tokens, b=tokens, autojunk=False)
+        values: Dict[int, str] = {}
+        shape = list(tokens)
+        for tag, a0, a1, b0, b1 in matcher.get_opcodes():
+            if tag not in ("replace",):
+                continue
+            slots = [(i, _SLOT_RE.match(template.tokens[i])) for i in range(a0, a1)]
+            # A slot is filled by the aligned literal-looking token.
+            for offset, (i, slot) in enumerate(slots):
+                if slot and b0 + offset < b1 and _is_literal_token(tokens[b0 + offset]):
+                    values[int(slot.group(1))] = tokens[b0 + offset]
+                    shape[b0 + offset] = template.tokens[i]
+        slot_count = len(template.tokens) - len(template.fixed)
+        if len(values) != slot_count:
+            return None, 0.0, ""
+        rest = [token for token in shape if not _SLOT_RE.match(token)]
+        if _content_words(rest) != _content_words(template.fixed):
+            return None, 0.0, ""
+        a, b = _function_words(template.fixed), _function_words(rest)
+        confidence = difflib.SequenceMatcher(a=a, b=b, autojunk=False).ratio() if a or b else 1.0
+        return values, confidence, " ".join(shape)
+
+    def shape(self, template: Template, question: str) -> str:
+        """The question with its slot values replaced, e.g. ``show {0} incidents with code {1}``."""
+
+        return self._align(template, tokenize_question(question))[2]
+
+    def verified(self, template: Template, question: str) -> int:
+        """Shadow agreements recorded for this exact question shape."""
+
+        with self._lock:
+            counts = template.data["shapes"].get(self.shape(template, question), {})
+        return counts.get("verified", 0)
+
+    def record_served(self, template: Template) -> None:
+        with self._lock:
+            template.data["served"] += 1
+            self._save()
+
+    def record_shadow(self, template: Template, question: str, expected_sql: str, agent_sql: str) -> bool:
+        """Compare a shadow match with the agent's SQL; returns whether they agree."""
+
+        agreed = normalize_sql(expected_sql) == normalize_sql(agent_sql)
+        shape = self.shape(template, question)
+        with self._lock:
+            outcome = "verified" if agreed else "mismatched"
+            template.data[outcome] += 1
+            counts = template.data["shapes"].setdefault(shape, {"verified": 0, "mismatched": 0})
+            counts[outcome] += 1
+            self._save()
+        return agreed
+
+
+def sql_from_timeline(timeline: Dict[str, Any]) -> Optional[str]:
+    """The SQL of a single successful ``/athenaQuery`` call, else None.
+
+    Answers that needed several queries, other actions or hit a failure are
+    not simple enough to replay from one template.
+    """
+
+    steps = timeline.get("steps", [])
+    if any(step["kind"] in ("failure", "knowledge_base") or step.get("incomplete") for step in steps):
+        return None
+    actions = [step for step in steps if step["kind"] == "action"]
+    if len(actions) != 1 or actions[0]["label"] != "Action /athenaQuery" or not actions[0].get("detail"):
+        return None
+    return actions[0]["detail"]
+
+
+class LambdaExecutor:
+    """Runs SQL through the action-group Lambda, as the agent's ``/athenaQuery`` call would."""
+
+    def __init__(self, function_name: str, region: Optional[str] = None) -> None:
+        import boto3
+
+        self.function_name = function_name
+        self.client = boto3.client("lambda", region_name=region)
+
+    def run(self, sql: str) -> Dict[str, Any]:
+        event = {
+            "messageVersion": "1.0",
+            "actionGroup": "sql-template",
+            "apiPath": "/athenaQuery",
+            "httpMethod": "POST",
+            "requestBody": {"content": {"application/json": {"properties": [{"name": "query", "type": "string", "value": sql}]}}},
+        }
+        response = self.client.invoke(FunctionName=self.function_name, Payload=json.dumps(event).encode("utf-8"))
+        payload = json.loads(response["Payload"].read())
+        if response.get("FunctionError"):
+            raise RuntimeError(f"Query Lambda failed: {payload.get('errorMessage', payload)}")
+        action_response = payload["response"]
+        if action_response.get("httpStatusCode", 200) != 200:
+            raise RuntimeError(f"Query Lambda returned {action_response.get('httpStatusCode')}")
+        return action_response["responseBody"]["application/json"]["body"]
+
+
+def format_result(result: Dict[str, Any], max_rows: int = DEFAULT_MAX_ROWS) -> str:
+    """Markdown table of an Athena ``GetQueryResults`` response (header row first)."""
+
+    rows = [
+        [str(cell.get("VarCharValue", "")).replace("|", "\\|") for cell in row.get("Data", [])]
+        for row in result.get("ResultSet", {}).get("Rows", [])
+    ]
+    if len(rows) < 2:
+        return "The query returned no rows."
+    header, body = rows[0], rows[1:]
+    if len(header) == 1 and len(body) == 1:
+        label = "Result" if header[0].startswith("_col") else header[0]
+        return f"{label}: {body[0][0]}"
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    lines += ["| " + " | ".join(row) + " |" for row in body[:max_rows]]
+    if len(body) > max_rows:
+        lines.append(f"\n{len(body) - max_rows} more row(s) not shown.")
+    return "\n".join(lines)
@@ -0,0 +1,114 @@
+"""Per-request collection of agent trace and diagnostic output.
+
+``decode_response`` used to redirect ``sys.stdout`` into a ``StringIO`` to
+capture its own prints as the "trace" shown in the sidebar. ``sys.stdout`` is
+process-wide, so with several Streamlit sessions answering at once their
+output interleaved, and an exception before the restore left every later
+print redirected.
+
+A ``TraceCollector`` belongs to one request. It stores structured events and
+is bounded (oldest events are dropped first) so a long orchestration cannot
+grow without limit. ``collecting()`` makes a collector current for the
+running context (``contextvars``, so each thread or task has its own) and
+``trace()`` records into whichever collector is current, falling back to a
+plain print when there is none. A job's collector is written by its worker
+thread while the UI thread reads it, so changes and reads go through a lock.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+
+DEFAULT_MAX_EVENTS = 2000
+DEFAULT_MAX_CHARS = 2_000_000
+
+_current: ContextVar[Optional["TraceCollector"]] = ContextVar("trace_collector", default=None)
+
+
+class TraceCollector:
+    """Bounded list of ``{"t", "kind", "message", "data"}`` events."""
+
+    def __init__(self, max_events: int = DEFAULT_MAX_EVENTS, max_chars: int = DEFAULT_MAX_CHARS) -> None:
+        self.max_events = max_events
+        self.max_chars = max_chars
+        self.started = time.time()
+        self.dropped = 0
+        self._events: Deque[Dict[str, Any]] = deque()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, message: str = "", data: Any = None) -> None:
+        event = {"t": round(time.time() - self.started, 3), "kind": kind, "message": message, "data": data}
+        event["_size"] = len(message) + (len(json.dumps(data, default=str)) if data is not None else 0)
+        self._append(event)
+
+    def extend(self, other: "TraceCollector") -> None:
+        """Append another collector's events, keeping their times."""
+
+        for event in other._snapshot():
+            self._append(dict(event, t=round(other.started + event["t"] - self.started, 3)))
+
+    def _append(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self._events.append(event)
+            self._chars += event["_size"]
+            while self._events and (len(self._events) > self.max_events or self._chars > self.max_chars):
+                self._chars -= self._events.popleft()["_size"]
+                self.dropped += 1
+
+    def _snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._events)
+
+    @property
+    def events(self) -> List[Dict[str, Any]]:
+        return [{k: v for k, v in event.items() if k != "_size"} for event in self._snapshot()]
+
+    def of_kind(self, kind: str) -> List[Dict[str, Any]]:
+        return [event for event in self.events if event["kind"] == kind]
+
+    def render(self) -> str:
+        """Plain-text form for the trace panel."""
+
+        with self._lock:
+            events, dropped = list(self._events), self.dropped
+        lines = []
+        if dropped:
+            lines.append(f"... {dropped} earlier event(s) dropped ...")
+        for event in events:
+            if event["message"]:
+                lines.append(event["message"])
+            if event["data"] is not None:
+                lines.append(json.dumps(event["data"], indent=2, default=str))
+        return "\n".join(lines)
+
+
+def current() -> Optional[TraceCollector]:
+    return _current.get()
+
+
+@contextmanager
+def collecting(collector: Optional[TraceCollector] = None) -> Iterator[TraceCollector]:
+    """Make ``collector`` (or a new one) current for the enclosed block."""
+
+    collector = collector or TraceCollector()
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+
+
+def trace(kind: str, message: str = "", data: Any = None) -> None:
+    collector = _current.get()
+    if collector is None:
+        print(message if data is None else f"{message} {json.dumps(data, default=str)}")
+    else:
+        collector.add(kind, message, data)
@@ -0,0 +1,240 @@
+"""Turn InvokeAgent trace events into a timeline of steps with latencies.
+
+With ``enableTrace`` the agent streams one trace part per step of its work:
+model invocation inputs and outputs for pre-processing, orchestration and
+post-processing, the rationale, action group calls (our ``/athenaQuery`` with
+its SQL) and their observations, and finally the answer. ``build_timeline``
+pairs the start and end parts of each step (by ``traceId``) and returns steps
+with start/end offsets, their own latency and, for model invocations, the
+input/output token counts from ``metadata.usage``, plus totals that show how
+much of the request went to the LLM versus the action group (Athena).
+
+Times come from the trace part's ``eventTime`` when the service sends it and
+otherwise from when the part arrived at the client.
+
+A recorded stream (see ``AGENT_STREAM_RECORD_DIR``) can be analysed offline:
+
+    python trace_timeline.py recording.eventstream --output timeline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+_PHASES = (
+    ("preProcessingTrace", "Pre-processing"),
+    ("orchestrationTrace", "Orchestration"),
+    ("postProcessingTrace", "Post-processing"),
+)
+
+
+def _event_seconds(part: Dict[str, Any]) -> Optional[float]:
+    value = part.get("eventTime")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def _usage(output: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    usage = (output.get("metadata") or {}).get("usage") or {}
+    return usage.get("inputTokens"), usage.get("outputTokens")
+
+
+def _action_detail(invocation: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    path = invocation.get("apiPath") or invocation.get("function") or "action"
+    properties = (invocation.get("requestBody") or {}).get("content", {}).get("application/json", [])
+    values = [str(prop.get("value")) for prop in properties if prop.get("value")]
+    values += [str(param.get("value")) for param in invocation.get("parameters", []) if param.get("value")]
+    return path, "\n".join(values) or None
+
+
+class _Builder:
+    def __init__(self) -> None:
+        self.steps: List[Dict[str, Any]] = []
+        self.open: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.final_response: Optional[Dict[str, Any]] = None
+
+    def start(self, key: Tuple[str, str], at: float, **step: Any) -> None:
+        step.update(start=at, end=None)
+        self.open[key] = step
+        self.steps.append(step)
+
+    def end(self, key: Tuple[str, str], at: float, **fields: Any) -> Optional[Dict[str, Any]]:
+        step = self.open.pop(key, None)
+        if step is not None:
+            step["end"] = at
+            step.update({k: v for k, v in fields.items() if v is not None})
+        return step
+
+    def add(self, at: float, part: Dict[str, Any]) -> None:
+        trace = part.get("trace", part)
+        if "failureTrace" in trace:
+            failure = trace["failureTrace"]
+            self.steps.append(
+                {"kind": "failure", "label": "Failure", "start": at, "end": at,
+                 "detail": failure.get("failureReason"), "trace_id": failure.get("traceId")}
+            )
+            return
+        for phase_key, phase in _PHASES:
+            phase_trace = trace.get(phase_key)
+            if phase_trace:
+                self._phase(phase, phase_trace, at)
+
+    def _phase(self, phase: str, trace: Dict[str, Any], at: float) -> None:
+        if "modelInvocationInput" in trace:
+            trace_id = trace["modelInvocationInput"].get("traceId", "")
+            self.start(("model", trace_id), at, kind="model", label=f"{phase}: model", trace_id=trace_id, phase=phase)
+        if "modelInvocationOutput" in trace:
+            output = trace["modelInvocationOutput"]
+            input_tokens, output_tokens = _usage(output)
+            key = ("model", output.get("traceId", ""))
+            if key not in self.open:
+                self.start(key, at, kind="model", label=f"{phase}: model", trace_id=key[1], phase=phase)
+            self.end(key, at, input_tokens=input_tokens, output_tokens=output_tokens)
+        if "rationale" in trace:
+            rationale = trace["rationale"]
+            step = next(
+                (s for s in reversed(self.steps) if s["kind"] == "model" and s.get("trace_id") == rationale.get("traceId")),
+                None,
+            )
+            if step is not None:
+                step["detail"] = rationale.get("text")
+        invocation = (trace.get("invocationInput") or {})
+        if "actionGroupInvocationInput" in invocation:
+            trace_id = invocation.get("traceId", "")
+            path, detail = _action_detail(invocation["actionGroupInvocationInput"])
+            self.start(("action", trace_id), at, kind="action", label=f"Action {path}",
+                       trace_id=trace_id, phase=phase, detail=detail)
+        elif "knowledgeBaseLookupInput" in invocation:
+            trace_id = invocation.get("traceId", "")
+            self.start(("action", trace_id), at, kind="knowledge_base", label="Knowledge base lookup",
+                       trace_id=trace_id, phase=phase, detail=invocation["knowledgeBaseLookupInput"].get("text"))
+        observation = trace.get("observation")
+        if observation:
+            key = ("action", observation.get("traceId", ""))
+            if key in self.open:
+                output = observation.get("actionGroupInvocationOutput") or observation.get("knowledgeBaseLookupOutput") or {}
+                text = output.get("text")
+                self.end(key, at, result_chars=len(text) if isinstance(text, str) else None)
+            if "finalResponse" in observation:
+                self.final_response = {"at": at, "text": observation["finalResponse"].get("text")}
+
+    def result(self, origin: float, finished: Optional[float]) -> Dict[str, Any]:
+        last = max([s["end"] or s["start"] for s in self.steps] + [finished or origin])
+        for step in self.steps:
+            if step["end"] is None:
+                step["end"] = last
+                step["incomplete"] = True
+            step["start_ms"] = round((step.pop("start") - origin) * 1000, 1)
+            step["end_ms"] = round((step.pop("end") - origin) * 1000, 1)
+            step["duration_ms"] = round(step["end_ms"] - step["start_ms"], 1)
+
+        def total(kind: str, field: str = "duration_ms") -> float:
+            return round(sum(s.get(field) or 0 for s in self.steps if s["kind"] == kind), 1)
+
+        total_ms = round((last - origin) * 1000, 1)
+        llm_ms, action_ms = total("model"), total("action") + total("knowledge_base")
+        timeline = {
+            "total_ms": total_ms,
+            "llm_ms": llm_ms,
+            "action_ms": action_ms,
+            "other_ms": round(max(0.0, total_ms - llm_ms - action_ms), 1),
+            "model_invocations": sum(1 for s in self.steps if s["kind"] == "model"),
+            "action_calls": sum(1 for s in self.steps if s["kind"] == "action"),
+            "input_tokens": int(total("model", "input_tokens")),
+            "output_tokens": int(total("model", "output_tokens")),
+            "steps": self.steps,
+        }
+        if self.final_response:
+            timeline["final_response_ms"] = round((self.final_response["at"] - origin) * 1000, 1)
+        return timeline
+
+
+def build_timeline(
+    parts: Iterable[Tuple[float, Dict[str, Any]]],
+    *,
+    started: Optional[float] = None,
+    finished: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Timeline from ``(arrival seconds, trace part)`` pairs.
+
+    ``started``/``finished`` are the request's own start and end on the same
+    clock as the arrival times; without ``started`` the first part is time 0.
+    """
+
+    parts = list(parts)
+    use_event_time = bool(parts) and all(_event_seconds(part) is not None for _, part in parts)
+    timed = [(_event_seconds(part) if use_event_time else at, part) for at, part in parts]
+    if use_event_time:
+        started = finished = None
+    origin = started if started is not None else (timed[0][0] if timed else 0.0)
+
+    builder = _Builder()
+    for at, part in timed:
+        builder.add(at, part)
+    return builder.result(origin, finished)
+
+
+def timeline_from_collector(collector, finished: Optional[float] = None) -> Dict[str, Any]:
+    """Timeline from the ``trace`` events of a ``TraceCollector``."""
+
+    return build_timeline(
+        ((event["t"], event["data"]) for event in collector.of_kind("trace")),
+        started=0.0,
+        finished=finished,
+    )
+
+
+def format_timeline(timeline: Dict[str, Any]) -> str:
+    lines = [
+        f"total {timeline['total_ms']:.0f} ms: LLM {timeline['llm_ms']:.0f} ms "
+        f"({timeline['model_invocations']} call(s), {timeline['input_tokens']} in / "
+        f"{timeline['output_tokens']} out tokens), actions {timeline['action_ms']:.0f} ms "
+        f"({timeline['action_calls']} call(s)), other {timeline['other_ms']:.0f} ms"
+    ]
+    for step in timeline["steps"]:
+        tokens = ""
+        if step.get("input_tokens") is not None:
+            tokens = f"  [{step['input_tokens']} in / {step.get('output_tokens')} out]"
+        lines.append(
+            f"{step['start_ms']:>9.0f} {step['duration_ms']:>9.0f} ms  {step['label']}{tokens}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build a trace timeline from a recorded event stream")
+    parser.add_argument("recording", type=Path, help="Raw .eventstream file")
+    parser.add_argument("--output", type=Path, default=None, help="Write the timeline JSON here")
+    return parser.parse_args()
+
+
+def main() -> None:
+    from eventstream import agent_events
+
+    args = parse_args()
+    parts = [
+        (float(index), event.data)
+        for index, event in enumerate(agent_events([args.recording.read_bytes()]))
+        if event.type == "trace"
+    ]
+    timeline = build_timeline(parts)
+    if parts and any(_event_seconds(part) is None for _, part in parts):
+        print("note: the recording has no eventTime on every part; times are event indices, not ms")
+    print(format_timeline(timeline))
+    if args.output:
+        args.output.write_text(json.dumps(timeline, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "streamlit_app"))
+
+from sql_templates import DEFAULT_MIN_CONFIDENCE, TemplateStore  # noqa: E402
+
+
+QUESTION = "How many incidents with incident code E_A_C_09 were reported on 2024-11-29 for the interest rate asset class?"
+SQL = (
+    "SELECT count(*) FROM test_population WHERE incident_code = 'E_A_C_09' "
+    "AND reporting_date = '2024-11-29' AND asset_class = 'Interest Rate'"
+)
+
+
+def learned_store():
+    store = TemplateStore()
+    store.learn(QUESTION, SQL)
+    return store
+
+
+def test_different_content_word_does_not_match():
+    store = learned_store()
+
+    assert store.match(QUESTION.replace("interest rate", "credit")) is None
+
+
+def test_changed_date_fills_the_date_slot():
+    store = learned_store()
+
+    template, confidence, sql = store.match(QUESTION.replace("2024-11-29", "2024-12-03"))
+
+    assert confidence >= DEFAULT_MIN_CONFIDENCE
+    assert "reporting_date = '2024-12-03'" in sql
+    assert "2024-11-29" not in sql
+
+
+def test_verification_is_counted_per_question_shape():
+    store = learned_store()
+    template, _, sql = store.match(QUESTION)
+    store.record_shadow(template, QUESTION, sql, SQL)
+
+    assert store.verified(template, QUESTION.replace("E_A_C_09", "E_A_D_01")) == 1
+    assert store.verified(template, QUESTION.replace("for the", "in the")) == 0